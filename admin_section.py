@@ -1,8 +1,20 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from config import VEHICLE_OPTIONS, GSHEETS_VEHICLES_COLUMNS
-from utils import save_vehicle_plates_to_gsheets, record_fleet_change_trip
+from config import (GSHEETS_VEHICLES_COLUMNS, GSHEETS_TRIPS_COLUMNS, GSHEETS_CATALOG_WORKSHEET_NAME,
+                    GSHEETS_CATALOG_COLUMNS, FLEET_CHANGE_ROUTE, BULK_EDIT_MAX_ROWS)
+from utils import (save_vehicle_plates_to_gsheets, record_plate_change, migrate_fleet_change_trips,
+                   add_trips_bulk, get_drivers_list, get_all_stores, get_catalog,
+                   refresh_catalog, save_catalog_to_gsheets,
+                   apply_trip_edits, get_data_version, sheet_title,
+                   BULK_EDITABLE_FIELDS)
+from trip_validation import normalize_trip_frame, validate_trip_frame, frame_to_trips
+from plate_history import is_fleet_change_trip
+from trip_query import TripQuery, run_trip_query
+from background_jobs import get_scheduler
+from warmup import get_startup_timings
+from telematics import read_odometer_log, reconcile_trips, plate_aliases
+from config import TELEMATICS_COLUMNS
 
 
 def display_admin_section():
@@ -61,7 +73,7 @@ def display_admin_section():
         with st.form("update_vehicle_form", clear_on_submit=True):
             selected_vehicle = st.selectbox(
                 "Select Vehicle:",
-                options=VEHICLE_OPTIONS,
+                options=get_catalog().vehicle_options,
                 key="admin_vehicle_select"
             )
 
@@ -85,6 +97,12 @@ def display_admin_section():
                 key="admin_comments_input"
             )
 
+            effective_date = st.date_input(
+                "Plate Effective From:",
+                datetime.now().date(),
+                key="admin_plate_effective_date"
+            )
+
             submit_button = st.form_submit_button("Update Vehicle")
 
             if submit_button:
@@ -111,15 +129,17 @@ def display_admin_section():
                         st.session_state.df_vehicles = df_vehicles
                         save_vehicle_plates_to_gsheets()
 
-                        # Record fleet change if plate changed
+                        # Record the change in the plate history if plate changed
                         if plate_changed:
                             admin_name = st.session_state.get(
                                 "admin_user_display_name", "Admin")
-                            record_fleet_change_trip(
+                            record_plate_change(
                                 selected_vehicle,
                                 current_plate,
                                 new_plate,
-                                admin_name
+                                admin_name,
+                                effective_date,
+                                comments
                             )
 
                         st.success(f"Updated {selected_vehicle} successfully!")
@@ -129,11 +149,259 @@ def display_admin_section():
                 else:
                     st.error("Please fill in all required fields.")
 
+        display_plate_history_section()
+        display_bulk_import_section()
+        display_bulk_edit_section()
+        display_telematics_section()
+        display_catalog_section()
+        display_background_jobs_section()
+
         # Logout button
         if st.sidebar.button("Logout", key="admin_logout_btn"):
             st.session_state.logged_in = False
             st.rerun()
 
 
+def display_plate_history_section():
+    """Shows the plate history and migrates legacy fleet-change trip rows into it."""
+    with st.expander("License Plate History"):
+        history = st.session_state.get("plate_history", [])
+        if history:
+            st.dataframe(pd.DataFrame(history).sort_values(["Vehicle", "Effective From"]),
+                         hide_index=True, use_container_width=True)
+        else:
+            st.info("No plate changes recorded yet.")
+
+        legacy_rows = sum(1 for trip in st.session_state.trips if is_fleet_change_trip(trip))
+        if legacy_rows:
+            st.warning(f"{legacy_rows} legacy fleet change row(s) are still stored as trips.")
+            if st.button("Move Fleet Change Rows to Plate History", key="admin_migrate_fleet_rows_btn"):
+                if migrate_fleet_change_trips():
+                    st.rerun()
+
+
+def display_bulk_import_section():
+    """Lets an admin backfill many trips from a CSV file in one validated, single-write import."""
+    with st.expander("Bulk Import Trips (CSV)"):
+        st.caption("Columns: " + ", ".join(GSHEETS_TRIPS_COLUMNS) +
+                   ". Only Date, Vehicle, Start KM, End KM, Driver and Route are required.")
+        uploaded_file = st.file_uploader(
+            "Trips CSV:", type=["csv"], key="admin_bulk_import_file")
+        if uploaded_file is None:
+            return
+
+        try:
+            raw_df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+        except Exception as e:
+            st.error(f"Could not read the CSV file: {e}")
+            return
+
+        frame = normalize_trip_frame(raw_df)
+        issues = validate_trip_frame(frame, st.session_state.trips, get_catalog().vehicles,
+                                     get_drivers_list(), get_all_stores())
+        errors = issues[issues["Severity"] == "error"]
+        warnings = issues[issues["Severity"] == "warning"]
+
+        st.write(f"{len(frame)} row(s) read, {len(errors)} error(s), {len(warnings)} warning(s).")
+        if not issues.empty:
+            st.dataframe(issues, hide_index=True, use_container_width=True)
+
+        if not errors.empty:
+            st.error("Fix the errors above and upload the file again.")
+            return
+
+        allow_gaps = True
+        if not warnings.empty:
+            allow_gaps = st.checkbox("Import despite odometer continuity warnings",
+                                     key="admin_bulk_import_allow_gaps")
+
+        if st.button(f"Import {len(frame)} Trip(s)", key="admin_bulk_import_btn", disabled=not allow_gaps):
+            imported = add_trips_bulk(frame_to_trips(frame))
+            if imported:
+                del st.session_state["admin_bulk_import_file"]
+                st.rerun()
+
+
+def display_bulk_edit_section():
+    """Shows a filtered window of trips in an editable grid and saves all changed rows in one batch."""
+    with st.expander("Bulk Edit Trips"):
+        col_start, col_end, col_vehicle = st.columns(3)
+        with col_start:
+            start_date = st.date_input("From:", datetime.now().replace(day=1),
+                                       key="admin_bulk_edit_start_date")
+        with col_end:
+            end_date = st.date_input("To:", datetime.now(), key="admin_bulk_edit_end_date")
+        with col_vehicle:
+            vehicles = get_catalog().vehicles
+            vehicle = st.selectbox("Vehicle:", vehicles + ("All",),
+                                   index=len(vehicles), key="admin_bulk_edit_vehicle")
+
+        window_query = TripQuery(
+            start_date=start_date, end_date=end_date,
+            vehicles=None if vehicle == "All" else (vehicle,),
+            sort=(("Vehicle", False), ("Date", False)),
+        )
+        window = [
+            trip for trip in run_trip_query(get_data_version(), st.session_state.trips.rows(), window_query)
+            if trip.get("Route") != FLEET_CHANGE_ROUTE
+        ]
+        if len(window) > BULK_EDIT_MAX_ROWS:
+            st.warning(f"Showing the first {BULK_EDIT_MAX_ROWS} of {len(window)} trips. "
+                       "Narrow the filters to edit the rest.")
+            window = window[:BULK_EDIT_MAX_ROWS]
+        if not window:
+            st.info("No trips found for these filters.")
+            return
+
+        grid_columns = ["id"] + BULK_EDITABLE_FIELDS[:4] + ["Accumulated KM"] + BULK_EDITABLE_FIELDS[4:]
+        original = pd.DataFrame(window, columns=grid_columns)
+        text_fields = [f for f in BULK_EDITABLE_FIELDS if f not in ("Start KM", "End KM")]
+        original[text_fields] = original[text_fields].where(original[text_fields].notna(), "")
+        edited = st.data_editor(
+            original,
+            hide_index=True,
+            disabled=["id", "Accumulated KM"],
+            column_config={
+                "id": None,  # Hidden, but kept to match edited rows back to trips
+                "Route": st.column_config.TextColumn("Route", width="medium",
+                                                     help="Comma-separated store names"),
+            },
+            # A new key whenever the data or filters change discards stale grid edits
+            key=f"admin_bulk_edit_grid_{get_data_version()}_{start_date}_{end_date}_{vehicle}",
+        )
+
+        # Diff against the original window; only changed rows are validated and saved
+        changed_mask = (edited[BULK_EDITABLE_FIELDS].astype(str) !=
+                        original[BULK_EDITABLE_FIELDS].astype(str)).any(axis=1)
+        if not changed_mask.any():
+            st.caption("Edit cells above, then save. Only changed rows are written.")
+            return
+
+        changed_positions = changed_mask[changed_mask].index
+        frame = normalize_trip_frame(edited.loc[changed_positions])
+        frame["_row"] = changed_positions + 1  # Grid row numbers
+        changed_ids = set(frame["id"])
+        other_trips = [trip for trip in st.session_state.trips if trip["id"] not in changed_ids]
+        issues = validate_trip_frame(frame, other_trips, get_catalog().vehicles,
+                                     get_drivers_list(), get_all_stores())
+        errors = issues[issues["Severity"] == "error"]
+        warnings = issues[issues["Severity"] == "warning"]
+
+        st.write(f"{len(frame)} changed row(s), {len(errors)} error(s), {len(warnings)} warning(s).")
+        if not issues.empty:
+            st.dataframe(issues, hide_index=True, use_container_width=True)
+        if not errors.empty:
+            st.error("Fix the errors above before saving.")
+            return
+
+        allow_gaps = True
+        if not warnings.empty:
+            allow_gaps = st.checkbox("Save despite odometer continuity warnings",
+                                     key="admin_bulk_edit_allow_gaps")
+
+        if st.button(f"Save {len(frame)} Changed Trip(s)", key="admin_bulk_edit_save_btn",
+                     disabled=not allow_gaps):
+            apply_trip_edits(frame_to_trips(frame))
+            st.rerun()
+
+
+def display_telematics_section():
+    """Reconciles an uploaded telematics odometer log with the recorded trips."""
+    with st.expander("Telematics Reconciliation"):
+        st.caption("CSV columns: " + ", ".join(TELEMATICS_COLUMNS.values()) +
+                   ". Vehicles may be given by name or license plate. "
+                   "For multi-gigabyte logs use: python cli.py reconcile LOG.csv")
+        uploaded_log = st.file_uploader("Odometer log (CSV)", type=["csv"], key="admin_telematics_upload")
+        if uploaded_log is None:
+            return
+        # Every rerun of the page would read the whole log again: the result is kept per upload
+        # and only reconciled again when the trips change
+        result = st.session_state.get('telematics_result')
+        if result is None or result["file_id"] != uploaded_log.file_id:
+            aliases = plate_aliases(st.session_state.df_vehicles.to_dict('records'))
+            try:
+                with st.spinner("Reading log..."):
+                    daily, aggregator = read_odometer_log(uploaded_log, vehicle_aliases=aliases)
+            except (ValueError, pd.errors.ParserError) as e:
+                st.error(f"Could not read the log: {e}")
+                return
+            result = {"file_id": uploaded_log.file_id, "daily": daily, "rows_read": aggregator.rows_read,
+                      "rows_skipped": aggregator.rows_skipped, "data_version": None}
+        if result["data_version"] != st.session_state.trips.data_version:
+            result["report"], result["corrections"] = reconcile_trips(
+                result["daily"], st.session_state.trips.rows())
+            result["data_version"] = st.session_state.trips.data_version
+        st.session_state.telematics_result = result
+        st.write(f"{result['rows_read']} reading(s) over {len(result['daily'])} vehicle-day(s); "
+                 f"{result['rows_skipped']} unreadable row(s) skipped.")
+
+        report, corrections = result["report"], result["corrections"]
+        if report.empty:
+            st.success("Trips match the odometer log.")
+            return
+        st.write(", ".join(f"{count} {issue}" for issue, count in report["Issue"].value_counts().items()))
+        st.dataframe(report, hide_index=True, use_container_width=True)
+        st.download_button("Download Reconciliation Report CSV",
+                           data=report.to_csv(index=False).encode('utf-8'),
+                           file_name="rotiroute_telematics_reconciliation.csv", mime="text/csv",
+                           on_click="ignore", key="download_reconciliation_csv")
+        if not corrections.empty:
+            st.markdown("**Suggested corrections**")
+            st.dataframe(corrections, hide_index=True, use_container_width=True)
+            st.download_button("Download Suggested Corrections CSV",
+                               data=corrections.to_csv(index=False).encode('utf-8'),
+                               file_name="rotiroute_suggested_corrections.csv", mime="text/csv",
+                               on_click="ignore", key="download_corrections_csv")
+
+
+def display_catalog_section():
+    """Shows where the vehicle, driver and store lists come from and lets an admin reload or seed them."""
+    with st.expander("Vehicles, Drivers and Stores"):
+        catalog = get_catalog()
+        st.caption(f"Source: {catalog.source}, version {catalog.version}. Edit the "
+                   f"'{sheet_title(GSHEETS_CATALOG_WORKSHEET_NAME)}' sheet (columns: {', '.join(GSHEETS_CATALOG_COLUMNS)}) "
+                   "to change the lists; every server picks up changes within a few minutes.")
+        st.write(f"{len(catalog.vehicles)} vehicle(s), {len(catalog.drivers)} driver(s), "
+                 f"{len(catalog.all_stores)} store(s) in {len(catalog.regions)} region(s).")
+
+        col_reload, col_seed = st.columns(2)
+        with col_reload:
+            if st.button("Reload Now", key="admin_catalog_reload_btn"):
+                try:
+                    changed = refresh_catalog()
+                    st.success("Catalog updated." if changed else "Catalog is unchanged.")
+                except Exception as e:
+                    st.error(f"Error reading the '{sheet_title(GSHEETS_CATALOG_WORKSHEET_NAME)}' sheet: {e}")
+        with col_seed:
+            if catalog.source == "config.py" and st.button("Copy Built-in Lists to Sheet",
+                                                           key="admin_catalog_seed_btn"):
+                if save_catalog_to_gsheets(catalog):
+                    st.success(f"Wrote the built-in lists to the '{sheet_title(GSHEETS_CATALOG_WORKSHEET_NAME)}' sheet.")
+
+
+def display_background_jobs_section():
+    """Shows the background scheduler's job status and error history, and lets an admin run a job now."""
+    with st.expander("Background Jobs"):
+        scheduler = get_scheduler()
+        status = scheduler.status()
+        st.dataframe(pd.DataFrame(status), hide_index=True, use_container_width=True)
+
+        job_name = st.selectbox("Job", [job["Job"] for job in status], key="admin_job_select")
+        if st.button("Run Now", key="admin_job_run_now_btn"):
+            scheduler.run_now(job_name)
+            st.info(f"'{job_name}' will run in the background shortly.")
+
+        errors = scheduler.errors()
+        if errors:
+            st.markdown("**Recent errors**")
+            for name, when, message, details in errors:
+                with st.container(border=True):
+                    st.markdown(f"{when.strftime('%Y-%m-%d %H:%M:%S')} - {name}: {message}")
+                    st.code(details, language=None)
+
+        st.markdown("**Startup timings**")
+        st.dataframe(pd.DataFrame(get_startup_timings().summary()), hide_index=True, use_container_width=True)
+
+
 if __name__ == "__main__":
     display_admin_section()
@@ -0,0 +1,222 @@
+# anomaly.py
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    FLEET_CHANGE_ROUTE, ANOMALY_WINDOW_DAYS, ANOMALY_Z_THRESHOLD, ANOMALY_MIN_SAMPLES,
+    ANOMALY_MIN_MAD_KM
+)
+
+# Daily KM per vehicle and per driver (the sum of that day's trips) is summarized over the last
+# ANOMALY_WINDOW_DAYS driving days by median, MAD and percentiles. A day is an outlier when its
+# robust z-score, 0.6745 * (km - median) / MAD, exceeds ANOMALY_Z_THRESHOLD.
+
+KmStats = namedtuple("KmStats", ["median", "mad", "p05", "p95", "count"])
+
+ANOMALY_COLUMNS = ["Scope", "Name", "Date", "Day KM", "Median KM", "Typical Range", "Robust Z"]
+
+SCOPES = ("Vehicle", "Driver")
+
+
+def _trip_km(trip):
+    """Returns (date, km) for a trip that counts towards daily KM, or None."""
+    if trip.get("Route") == FLEET_CHANGE_ROUTE or not isinstance(trip.get("Date"), str):
+        return None
+    try:
+        return trip["Date"], float(trip.get("End KM")) - float(trip.get("Start KM"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _robust_z(km, stats):
+    return 0.6745 * (km - stats.median) / max(stats.mad, ANOMALY_MIN_MAD_KM)
+
+
+def daily_km_frame(trips):
+    """Daily KM per scope/name/date for a trip list: columns Scope, Name, Date, KM, Trips."""
+    frame = pd.DataFrame(list(trips), columns=["Date", "Vehicle", "Driver", "Start KM", "End KM", "Route"])
+    frame = frame[(frame["Route"] != FLEET_CHANGE_ROUTE) &
+                  pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce').notna()]
+    frame["KM"] = pd.to_numeric(frame["End KM"], errors='coerce') - pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame = frame.dropna(subset=["KM"])
+    parts = []
+    for scope in SCOPES:
+        named = frame[frame[scope].fillna("").astype(str) != ""]
+        daily = named.groupby([scope, "Date"], sort=True)["KM"].agg(["sum", "size"]).reset_index()
+        parts.append(pd.DataFrame({"Scope": scope, "Name": daily[scope], "Date": daily["Date"],
+                                   "KM": daily["sum"], "Trips": daily["size"]}))
+    return pd.concat(parts, ignore_index=True)
+
+
+def window_stats(daily):
+    """Per scope/name statistics over the last ANOMALY_WINDOW_DAYS days of a daily_km_frame, vectorized."""
+    if daily.empty:
+        return {}
+    window = daily.sort_values(["Scope", "Name", "Date"]).groupby(["Scope", "Name"]).tail(ANOMALY_WINDOW_DAYS)
+    grouped = window.groupby(["Scope", "Name"])["KM"]
+    median = grouped.transform("median")
+    stats = pd.DataFrame({
+        "median": grouped.median(),
+        "mad": (window["KM"] - median).abs().groupby([window["Scope"], window["Name"]]).median(),
+        "p05": grouped.quantile(0.05),
+        "p95": grouped.quantile(0.95),
+        "count": grouped.size(),
+    })
+    return {key: KmStats(*row) for key, row in zip(stats.index, stats.itertuples(index=False))}
+
+
+class AnomalyModel:
+    """Daily KM totals and their rolling statistics per vehicle and per driver.
+
+    Built with one vectorized pass (`build`), then kept current trip by trip (`add_trip` /
+    `remove_trip`); only the statistics of the vehicle and driver a change touches are recomputed,
+    and scoring a trip is a few dict lookups.
+    """
+
+    def __init__(self):
+        self.daily = {}  # (scope, name) -> {date: [km, trip count]}
+        self.stats = {}  # (scope, name) -> KmStats
+        self._dirty = set()
+
+    @classmethod
+    def build(cls, trips):
+        model = cls()
+        daily = daily_km_frame(trips)
+        for scope, name, date, km, count in daily.itertuples(index=False, name=None):
+            model.daily.setdefault((scope, name), {})[date] = [km, count]
+        model.stats = window_stats(daily)
+        return model
+
+    def _keys(self, trip):
+        return [(scope, trip.get(scope)) for scope in SCOPES if trip.get(scope)]
+
+    def _change(self, trip, sign):
+        parsed = _trip_km(trip)
+        if parsed is None:
+            return
+        date, km = parsed
+        for key in self._keys(trip):
+            day = self.daily.setdefault(key, {}).setdefault(date, [0.0, 0])
+            day[0] += sign * km
+            day[1] += sign
+            if day[1] <= 0:
+                del self.daily[key][date]
+            self._dirty.add(key)
+
+    def add_trip(self, trip):
+        self._change(trip, +1)
+
+    def remove_trip(self, trip):
+        self._change(trip, -1)
+
+    def stats_for(self, key):
+        """Statistics for a (scope, name), recomputed only if a change touched it."""
+        if key in self._dirty:
+            self._dirty.discard(key)
+            days = self.daily.get(key, {})
+            values = np.array([days[date][0] for date in sorted(days)[-ANOMALY_WINDOW_DAYS:]], dtype=float)
+            if len(values):
+                median = float(np.median(values))
+                self.stats[key] = KmStats(median, float(np.median(np.abs(values - median))),
+                                          float(np.percentile(values, 5)), float(np.percentile(values, 95)),
+                                          len(values))
+            else:
+                self.stats.pop(key, None)
+        return self.stats.get(key)
+
+    def score_trip(self, trip, replaces=None):
+        """Scores the day a new or edited trip would produce; returns a list of warning messages.
+
+        `replaces` is the stored version of an edited trip, whose KM is taken out of its day first.
+        Only an unusually long day is flagged: while trips are being entered the day is not over
+        yet, so a short day so far says nothing (finished short days are left to `rescore`).
+        """
+        parsed = _trip_km(trip)
+        if parsed is None:
+            return []
+        date, km = parsed
+        old = _trip_km(replaces) if replaces is not None else None
+        warnings = []
+        for key in self._keys(trip):
+            stats = self.stats_for(key)
+            if stats is None or stats.count < ANOMALY_MIN_SAMPLES:
+                continue
+            day_km = self.daily.get(key, {}).get(date, [0.0, 0])[0] + km
+            if old is not None and old[0] == date and replaces.get(key[0]) == key[1]:
+                day_km -= old[1]
+            z = _robust_z(day_km, stats)
+            if z > ANOMALY_Z_THRESHOLD:
+                warnings.append(
+                    f"{day_km:.0f} km on {date} is unusual for {key[0].lower()} {key[1]} "
+                    f"(typically {stats.p05:.0f}-{stats.p95:.0f} km a day, median {stats.median:.0f}).")
+        return warnings
+
+    def rescore(self, trips):
+        """Flags every outlier day in the history in one vectorized pass (ANOMALY_COLUMNS)."""
+        daily = daily_km_frame(trips)
+        if daily.empty:
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+        keys = list(zip(daily["Scope"], daily["Name"]))
+        stats = {key: self.stats_for(key) for key in set(keys)}
+        lookup = pd.DataFrame([(key[0], key[1]) + tuple(s) for key, s in stats.items() if s is not None],
+                              columns=["Scope", "Name"] + list(KmStats._fields))
+        scored = daily.merge(lookup, on=["Scope", "Name"], how="inner")
+        scored = scored[scored["count"] >= ANOMALY_MIN_SAMPLES]
+        scored["Robust Z"] = 0.6745 * (scored["KM"] - scored["median"]) / scored["mad"].clip(lower=ANOMALY_MIN_MAD_KM)
+        flagged = scored[scored["Robust Z"].abs() > ANOMALY_Z_THRESHOLD]
+        if flagged.empty:
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+        result = pd.DataFrame({
+            "Scope": flagged["Scope"], "Name": flagged["Name"], "Date": flagged["Date"],
+            "Day KM": flagged["KM"].round().astype("int64"),
+            "Median KM": flagged["median"].round().astype("int64"),
+            "Typical Range": flagged["p05"].round().astype("int64").astype(str) + "-" +
+                             flagged["p95"].round().astype("int64").astype(str),
+            "Robust Z": flagged["Robust Z"].round(1),
+        }, columns=ANOMALY_COLUMNS)
+        order = result["Robust Z"].abs().sort_values(ascending=False).index
+        return result.loc[order].reset_index(drop=True)
+
+
+class AnomalyIndex:
+    """Keeps one AnomalyModel in step with the shared trip snapshot (one per server process)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model = None
+        self._version = None
+
+    def _model_for(self, snapshot):
+        # Rebuilt when the snapshot was replaced by something other than an incremental write
+        if self._model is None or self._version != snapshot.version:
+            self._model = AnomalyModel.build(snapshot.rows)
+            self._version = snapshot.version
+        return self._model
+
+    def score_trip(self, snapshot, trip, replaces=None):
+        """AnomalyModel.score_trip against the given snapshot."""
+        with self._lock:
+            return self._model_for(snapshot).score_trip(trip, replaces)
+
+    def rescore(self, snapshot):
+        """AnomalyModel.rescore of the whole snapshot."""
+        with self._lock:
+            return self._model_for(snapshot).rescore(snapshot.rows)
+
+    def apply_write(self, before, after, upserts, deletes):
+        """Moves the model from snapshot `before` to `after` by replaying a write's changed trips."""
+        with self._lock:
+            if self._model is None or before is None or self._version != before.version:
+                return  # Rebuilt on next use
+            for trip_id in set(upserts) | set(deletes):
+                old = before.get(trip_id)
+                if old is not None:
+                    self._model.remove_trip(old)
+                new = after.get(trip_id)
+                if new is not None:
+                    self._model.add_trip(new)
+            self._version = after.version
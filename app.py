@@ -1,22 +1,59 @@
 # app.py
 
+import time
+_run_started = time.perf_counter()  # For the import and first paint timings (see warmup.py)
+
 import streamlit as st
 from config import PAGE_TITLE, PAGE_LAYOUT, TAB_TITLES  # Import configuration
 # Import initialization (now includes GSheets load)
-from utils import initialize_state
+from utils import initialize_state, select_depot
+from depots import MULTI_DEPOT
+from background_jobs import get_scheduler  # Background job scheduler
 from admin_section import display_admin_section  # Import admin section display
-from tabs import add_trip_tab, edit_trip_tab, view_records_tab  # Import tab modules
+# Import prompt for concurrent edit conflicts
+from conflicts_section import display_conflicts_section
+from tabs import add_trip_tab, edit_trip_tab, view_records_tab, driver_entry_tab  # Import tab modules
+# Server warm-up and startup timings
+from warmup import get_startup_timings, start_warm_up, mark_first_paint
+
+# Only the first run of a server process imports anything; later runs record nothing
+get_startup_timings().record_import(time.perf_counter() - _run_started)
 
 # --- Configuration ---
 st.set_page_config(layout=PAGE_LAYOUT, page_title=PAGE_TITLE)
 
+# Warm the process up in the background if serve.py has not already (once per server process)
+start_warm_up()
+
 # --- Main App Layout ---
 
 st.title(PAGE_TITLE)
 
+# Each session works on one depot (app URL + ?depot=<key>, or the sidebar choice)
+driver_mode = st.query_params.get("mode") == "driver"
+depot = select_depot(show_selector=not driver_mode)
+if MULTI_DEPOT:
+    st.caption(f"Depot: {depot.name}")
+
+# Driver quick-entry mode (app URL + ?mode=driver): one form for phones, without downloading
+# the trip history, the admin section or the other tabs
+if driver_mode:
+    driver_entry_tab.display_driver_entry()
+    if st.button("Open the full app", key="driver_open_full_app"):
+        del st.query_params["mode"]
+        st.rerun()
+    mark_first_paint(_run_started, mode="driver")
+    st.stop()
+
 # Initialize state and load data from Google Sheets
 initialize_state()
 
+# Start the background jobs (snapshot refresh, aggregates, audit, backup) of this depot once per server process
+get_scheduler()
+
+# Ask about trips that another session changed at the same time (if any)
+display_conflicts_section()
+
 # Display Admin Section in Sidebar
 display_admin_section()
 
@@ -40,3 +77,5 @@ elif chosen_tab == "View Records":
 
 st.markdown("---")
 st.markdown("Engineered by MRP Boyz, 👨‍💻 by DB23 ", unsafe_allow_html=True)
+
+mark_first_paint(_run_started)
@@ -0,0 +1,122 @@
+# audit.py
+
+import pandas as pd
+
+from config import FLEET_CHANGE_ROUTE, AUDIT_MAX_DATE_GAP_DAYS
+
+AUDIT_COLUMNS = [
+    "Rank", "Severity", "Issue", "Vehicle", "Date", "Trip ID",
+    "Related Trip ID", "KM Difference", "Details"
+]
+
+# Issue type -> severity; lower rank sorts first in the report
+ISSUE_SEVERITY = {
+    "Invalid KM": ("High", 0),
+    "Invalid Date": ("High", 0),
+    "Duplicate Trip": ("High", 0),
+    "Odometer Overlap": ("High", 0),
+    "Odometer Gap": ("Medium", 1),
+    "Backdated Entry": ("Medium", 1),
+    "Same-Day Trips": ("Low", 2),
+    "Date Gap": ("Low", 2),
+}
+
+
+def _anomalies(rows, issue, details, km_difference=None, related_id=None):
+    """Builds report rows for one issue type from a slice of the audit frame."""
+    return pd.DataFrame({
+        "Issue": issue,
+        "Vehicle": rows["Vehicle"].values,
+        "Date": rows["Date"].values,
+        "Trip ID": rows["id"].values,
+        "Related Trip ID": related_id.values if related_id is not None else None,
+        "KM Difference": km_difference.values if km_difference is not None else None,
+        "Details": details.values if isinstance(details, pd.Series) else details,
+    })
+
+
+def audit_trips(trips, max_date_gap_days=AUDIT_MAX_DATE_GAP_DAYS):
+    """Audits odometer continuity across the whole trip history and returns a ranked anomaly report.
+
+    Trips are ordered per vehicle by date (then Start KM, then sheet order), and each trip is
+    compared with the previous one through shifted columns, so every check is a single vectorized pass.
+    """
+    frame = pd.DataFrame(list(trips), columns=["id", "Date", "Vehicle", "Start KM", "End KM", "Route"])
+    frame["_pos"] = range(len(frame))  # Sheet order, used to spot backdated entries
+    frame = frame[frame["Route"] != FLEET_CHANGE_ROUTE]
+    frame["_date"] = pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce')
+    frame["_start"] = pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame["_end"] = pd.to_numeric(frame["End KM"], errors='coerce')
+
+    found = []
+
+    bad_date = frame["_date"].isna()
+    found.append(_anomalies(frame[bad_date], "Invalid Date",
+                            "Date '" + frame.loc[bad_date, "Date"].astype(str) + "' is not YYYY-MM-DD."))
+
+    bad_km = ~bad_date & (frame["_start"].isna() | frame["_end"].isna() | (frame["_end"] < frame["_start"]))
+    found.append(_anomalies(
+        frame[bad_km], "Invalid KM",
+        "Start KM '" + frame.loc[bad_km, "Start KM"].astype(str) + "' / End KM '"
+        + frame.loc[bad_km, "End KM"].astype(str) + "' are missing, not numbers, or out of order.",
+        km_difference=frame.loc[bad_km, "_end"] - frame.loc[bad_km, "_start"]))
+
+    valid = frame[~bad_date & ~bad_km]
+    ordered = valid.sort_values(["Vehicle", "_date", "_start", "_pos"], kind="stable")
+    by_vehicle = ordered.groupby("Vehicle", sort=False)
+    prev_end = by_vehicle["_end"].shift()
+    prev_date = by_vehicle["_date"].shift()
+    prev_id = by_vehicle["id"].shift()
+    km_diff = ordered["_start"] - prev_end
+    prev_date_str = prev_date.dt.strftime('%Y-%m-%d')
+
+    # Duplicates first, so the same pair is not also reported as an overlap
+    exact_dup = ordered.duplicated(["Vehicle", "_date", "_start", "_end"], keep="first")
+    found.append(_anomalies(ordered[exact_dup], "Duplicate Trip",
+                            "Same vehicle, date, Start KM and End KM as trip " + prev_id[exact_dup].astype(str) + ".",
+                            related_id=prev_id[exact_dup]))
+
+    gap = prev_end.notna() & (km_diff > 0)
+    found.append(_anomalies(
+        ordered[gap], "Odometer Gap",
+        ordered.loc[gap, "_start"].astype("int64").astype(str) + " km start, but previous trip ("
+        + prev_date_str[gap] + ") ended at " + prev_end[gap].astype("int64").astype(str) + " km.",
+        km_difference=km_diff[gap], related_id=prev_id[gap]))
+
+    overlap = prev_end.notna() & (km_diff < 0) & ~exact_dup
+    found.append(_anomalies(
+        ordered[overlap], "Odometer Overlap",
+        ordered.loc[overlap, "_start"].astype("int64").astype(str) + " km start is below previous trip ("
+        + prev_date_str[overlap] + ") End KM of " + prev_end[overlap].astype("int64").astype(str) + " km.",
+        km_difference=km_diff[overlap], related_id=prev_id[overlap]))
+
+    same_day = ordered.duplicated(["Vehicle", "_date"], keep="first") & ~exact_dup
+    found.append(_anomalies(ordered[same_day], "Same-Day Trips",
+                            "More than one trip recorded for this vehicle on this date.",
+                            related_id=prev_id[same_day]))
+
+    day_gap = (ordered["_date"] - prev_date).dt.days
+    long_gap = day_gap > max_date_gap_days
+    found.append(_anomalies(
+        ordered[long_gap], "Date Gap",
+        day_gap[long_gap].astype("int64").astype(str) + " days since previous trip (" + prev_date_str[long_gap] + ").",
+        related_id=prev_id[long_gap]))
+
+    # Backdated: entered (sheet order) after a trip for the same vehicle with a later date
+    in_sheet_order = valid.sort_values("_pos")
+    latest_so_far = in_sheet_order.groupby("Vehicle", sort=False)["_date"].cummax()
+    latest_before = latest_so_far.groupby(in_sheet_order["Vehicle"], sort=False).shift()
+    backdated = latest_before.notna() & (in_sheet_order["_date"] < latest_before)
+    found.append(_anomalies(
+        in_sheet_order[backdated], "Backdated Entry",
+        "Entered after a trip dated " + latest_before[backdated].dt.strftime('%Y-%m-%d') + "."))
+
+    report = pd.concat([f for f in found if not f.empty] or [pd.DataFrame(columns=AUDIT_COLUMNS[2:])],
+                       ignore_index=True)
+    report["Severity"] = report["Issue"].map(lambda issue: ISSUE_SEVERITY[issue][0])
+    report["_severity_rank"] = report["Issue"].map(lambda issue: ISSUE_SEVERITY[issue][1])
+    report["_magnitude"] = pd.to_numeric(report["KM Difference"], errors='coerce').abs().fillna(0)
+    report = report.sort_values(["_severity_rank", "_magnitude", "Vehicle", "Date"],
+                                ascending=[True, False, True, True], kind="stable")
+    report["Rank"] = range(1, len(report) + 1)
+    return report[AUDIT_COLUMNS].reset_index(drop=True)
@@ -0,0 +1,177 @@
+# background_jobs.py
+
+import os
+from datetime import datetime
+
+import streamlit as st
+
+from config import (
+    GSHEETS_TRIPS_WORKSHEET_NAME, GSHEETS_TRIPS_COLUMNS, SCHEDULER_TICK_SECONDS,
+    SCHEDULER_ERROR_HISTORY, SNAPSHOT_REFRESH_SECONDS, AGGREGATES_REFRESH_SECONDS,
+    AUDIT_REFRESH_SECONDS, BACKUP_INTERVAL_SECONDS, BACKUP_DIR, BACKUP_KEEP, CATALOG_REFRESH_SECONDS
+)
+import storage
+from audit import audit_trips
+from exports import encode_csv_gzip, iter_export_frames
+from change_feed import CHANGE_TRIPS
+from scheduler import JobScheduler
+from trip_core import monthly_vehicle_summary, duplicate_trip_report
+from route_distance import flag_implausible_trips
+from depots import DEPOTS, DEFAULT_DEPOT, depot_context
+from utils import (get_snapshot_store, get_anomaly_index, get_worksheet, read_sheet_version, refresh_catalog,
+                   get_catalog_store, sync_from_shared_cache, share_snapshot, get_change_feed, current_depot)
+
+# Job names, as shown in the admin status view
+REFRESH_SNAPSHOT_JOB = "Refresh trip snapshot"
+REFRESH_CATALOG_JOB = "Refresh catalog"
+MONTHLY_AGGREGATES_JOB = "Monthly aggregates"
+AUDIT_JOB = "Integrity audit"
+ROUTE_CHECK_JOB = "Route distance check"
+ANOMALY_JOB = "KM anomaly rescore"
+DUPLICATES_JOB = "Duplicate trip report"
+BACKUP_JOB = "Local backup"
+
+
+def refresh_trip_snapshot():
+    """Reloads the shared trip snapshot when another process changed the sheet.
+
+    Writes published to the shared cache are applied first, so the sheet is only read when
+    something changed it without going through the cache.
+    """
+    store = get_snapshot_store()
+    followed = sync_from_shared_cache()
+    snapshot = store.current()
+    version, journal_row_count = read_sheet_version()
+    if snapshot is not None and snapshot.sheet_version == version and snapshot.matches_sheet_order:
+        return f"Up to date (version {version}{', via the shared cache' if followed else ''})."
+    trips = storage.read_trips(get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME))
+    published = store.publish(trips, version, journal_row_count, replaces=snapshot)
+    if published is None:
+        return "Skipped: trips were saved during the reload."
+    share_snapshot(published)  # The other processes take it from the cache
+    get_change_feed().publish(CHANGE_TRIPS)  # Any vehicle may have changed
+    return f"Reloaded {len(trips)} trip(s) (version {version})."
+
+
+def refresh_catalog_job():
+    """Re-reads the Catalog worksheet so new vehicles, drivers and stores appear without a restart."""
+    changed = refresh_catalog()
+    catalog = get_catalog_store().current()
+    return f"{'Updated' if changed else 'Unchanged'}: {catalog.source}, version {catalog.version}."
+
+
+def _derived(build, key):
+    """Builds derived data from the current snapshot, tagged with the snapshot version it matches."""
+    snapshot = get_snapshot_store().current()
+    if snapshot is None:
+        return "No trips loaded yet."
+    data = build(snapshot.rows)
+    result = {"version": snapshot.version, "computed_at": datetime.now(), key: data}
+    return f"{len(data)} row(s) for snapshot {snapshot.version}.", result
+
+
+def rebuild_monthly_aggregates():
+    """Per-vehicle monthly summary of the current snapshot."""
+    return _derived(monthly_vehicle_summary, "summary")
+
+
+def run_integrity_audit():
+    """Odometer continuity audit of the current snapshot."""
+    return _derived(audit_trips, "report")
+
+
+def run_route_distance_check():
+    """Trips whose KM is implausible for their route, over the current snapshot."""
+    return _derived(flag_implausible_trips, "report")
+
+
+def run_duplicate_report():
+    """Groups of identical trips in the current snapshot; also builds its duplicate index before the first add."""
+    snapshot = get_snapshot_store().current()
+    if snapshot is not None:
+        snapshot.fingerprint_index()
+    return _derived(duplicate_trip_report, "report")
+
+
+def run_km_anomaly_rescore():
+    """Outlier days across the current snapshot; also rebuilds the anomaly model after a reload."""
+    snapshot = get_snapshot_store().current()
+    if snapshot is None:
+        return "No trips loaded yet."
+    report = get_anomaly_index().rescore(snapshot)
+    result = {"version": snapshot.version, "computed_at": datetime.now(), "report": report}
+    return f"{len(report)} row(s) for snapshot {snapshot.version}.", result
+
+
+def write_local_backup():
+    """Writes the current snapshot as a gzip CSV under BACKUP_DIR and deletes the oldest backups.
+
+    The first depot's backups go in BACKUP_DIR itself, every other depot's in a subfolder named after its key.
+    """
+    snapshot = get_snapshot_store().current()
+    if snapshot is None:
+        return "No trips loaded yet."
+    depot = current_depot()
+    backup_dir = BACKUP_DIR if depot == DEFAULT_DEPOT else os.path.join(BACKUP_DIR, depot.key)
+    os.makedirs(backup_dir, exist_ok=True)
+    path = os.path.join(backup_dir, f"trips_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv.gz")
+    data = encode_csv_gzip(iter_export_frames(snapshot.rows, GSHEETS_TRIPS_COLUMNS))
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)  # Never leave a half-written backup behind
+
+    backups = sorted(name for name in os.listdir(backup_dir)
+                     if name.startswith("trips_") and name.endswith(".csv.gz"))
+    for name in backups[:-BACKUP_KEEP]:
+        os.remove(os.path.join(backup_dir, name))
+    return f"Saved {len(snapshot.rows)} trip(s) to {path}."
+
+
+# (name, job function, interval in seconds) of every depot's jobs
+JOBS = [
+    (REFRESH_SNAPSHOT_JOB, refresh_trip_snapshot, SNAPSHOT_REFRESH_SECONDS),
+    (REFRESH_CATALOG_JOB, refresh_catalog_job, CATALOG_REFRESH_SECONDS),
+    (MONTHLY_AGGREGATES_JOB, rebuild_monthly_aggregates, AGGREGATES_REFRESH_SECONDS),
+    (AUDIT_JOB, run_integrity_audit, AUDIT_REFRESH_SECONDS),
+    (ROUTE_CHECK_JOB, run_route_distance_check, AUDIT_REFRESH_SECONDS),
+    (ANOMALY_JOB, run_km_anomaly_rescore, AUDIT_REFRESH_SECONDS),
+    (DUPLICATES_JOB, run_duplicate_report, AUDIT_REFRESH_SECONDS),
+    (BACKUP_JOB, write_local_backup, BACKUP_INTERVAL_SECONDS),
+]
+
+
+def _in_depot(depot, job):
+    """Wraps a job function to run for one depot (the scheduler thread has no session to ask)."""
+    def run():
+        with depot_context(depot):
+            return job()
+    return run
+
+
+@st.cache_resource  # One scheduler (and worker thread) per depot and server process
+def _depot_scheduler(depot_key):
+    depot = DEPOTS[depot_key]
+    scheduler = JobScheduler(SCHEDULER_TICK_SECONDS, SCHEDULER_ERROR_HISTORY)
+    for name, job, interval_seconds in JOBS:
+        scheduler.add_job(name, _in_depot(depot, job), interval_seconds)
+    scheduler.start()
+    return scheduler
+
+
+def get_scheduler():
+    """Starts the current depot's background job scheduler on first use and returns it."""
+    return _depot_scheduler(current_depot().key)
+
+
+def get_derived_result(job_name):
+    """Latest result of a derived-data job; asks for a rebuild if it is older than the current snapshot.
+
+    Returns None until the job has run once. The rebuild happens on the scheduler thread, never in
+    the calling rerun.
+    """
+    scheduler = get_scheduler()
+    result = scheduler.result(job_name)
+    snapshot = get_snapshot_store().current()
+    if snapshot is not None and (result is None or result["version"] != snapshot.version):
+        scheduler.run_now(job_name)
+    return result
@@ -0,0 +1,181 @@
+# batch_reports.py
+
+import io
+import importlib.util
+import multiprocessing
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from config import FLEET_CHANGE_ROUTE, REPORT_MAX_WORKERS, REPORT_PARALLEL_MIN_TRIPS
+
+# Month-end statements: the trips of a date range are partitioned by vehicle (optionally also by
+# driver) and each partition's report is built in a worker process, then all reports are zipped.
+
+# "CSV": one folder of CSV files per report; "Excel": one workbook per report
+REPORT_FORMATS = ["CSV", "Excel"]
+
+# Excel output needs openpyxl; without it only CSV reports are offered
+EXCEL_AVAILABLE = importlib.util.find_spec("openpyxl") is not None
+
+# Trip fields sent to the workers, as plain tuples (cheap to pickle)
+REPORT_FIELDS = ["id", "Date", "Vehicle", "Driver", "Start KM", "End KM", "Route", "Remarks"]
+
+SUMMARY_COLUMNS = ["Vehicle", "Driver", "Start Date", "End Date", "Trips", "Days Driven",
+                   "Total KM", "First Start KM", "Last End KM", "Store Visits"]
+DAILY_COLUMNS = ["Date", "Trips", "KM", "Store Visits", "Accumulated KM (Period)"]
+
+# Worker pools by size, started on first use and reused for the life of the process. Workers are
+# spawned, not forked: the app server has other threads running, and forking a threaded process
+# can leave a worker holding a lock no thread will ever release.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def partition_trips(trips, by_driver=False):
+    """Groups trips by vehicle (or by vehicle and driver) into {key: [trip tuples]}, fleet change rows excluded."""
+    partitions = {}
+    for trip in trips:
+        if trip.get("Route") == FLEET_CHANGE_ROUTE or not trip.get("Vehicle"):
+            continue
+        key = (trip.get("Vehicle"), trip.get("Driver") or "") if by_driver else (trip.get("Vehicle"),)
+        partitions.setdefault(key, []).append(tuple(trip.get(field) for field in REPORT_FIELDS))
+    return partitions
+
+
+def report_tables(key, rows, start_date, end_date):
+    """Builds the summary, daily breakdown, store visits and trip list for one partition."""
+    frame = pd.DataFrame(rows, columns=REPORT_FIELDS)
+    frame["_date"] = pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce')
+    frame["Start KM"] = pd.to_numeric(frame["Start KM"], errors='coerce').fillna(0).astype("int64")
+    frame["End KM"] = pd.to_numeric(frame["End KM"], errors='coerce').fillna(0).astype("int64")
+    frame = frame.sort_values(["_date", "Start KM"], kind="stable").reset_index(drop=True)
+    frame["KM"] = frame["End KM"] - frame["Start KM"]
+    frame["Accumulated KM (Period)"] = frame["KM"].cumsum()
+
+    stores = frame["Route"].fillna("").astype(str).str.split(",").explode().str.strip()
+    stores = stores[stores != ""]
+    frame["Store Visits"] = stores.groupby(level=0).size().reindex(frame.index, fill_value=0)
+
+    daily = frame.groupby("Date", sort=True).agg(**{
+        "Trips": ("id", "size"), "KM": ("KM", "sum"), "Store Visits": ("Store Visits", "sum")})
+    daily["Accumulated KM (Period)"] = daily["KM"].cumsum()
+    daily = daily.reset_index()[DAILY_COLUMNS]
+
+    store_visits = stores.value_counts().rename_axis("Store").reset_index(name="Visits")
+
+    summary = pd.DataFrame([{
+        "Vehicle": key[0],
+        "Driver": key[1] if len(key) > 1 else "All",
+        "Start Date": start_date or "",
+        "End Date": end_date or "",
+        "Trips": len(frame),
+        "Days Driven": int(frame["Date"].nunique()),
+        "Total KM": int(frame["KM"].sum()),
+        "First Start KM": int(frame["Start KM"].iloc[0]) if len(frame) else 0,
+        "Last End KM": int(frame["End KM"].iloc[-1]) if len(frame) else 0,
+        "Store Visits": int(frame["Store Visits"].sum()),
+    }], columns=SUMMARY_COLUMNS)
+
+    trips = frame[["Date", "Vehicle", "Driver", "Start KM", "End KM", "KM",
+                   "Accumulated KM (Period)", "Route", "Remarks", "id"]]
+    return {"Summary": summary, "Daily": daily, "Stores": store_visits, "Trips": trips}
+
+
+def report_name(key):
+    """File-name stem for a partition, e.g. 'A' or 'A_Cliffy'."""
+    return "_".join(str(part).replace("/", "-").replace(" ", "-") for part in key if part) or "unknown"
+
+
+def build_partition_report(task):
+    """Worker entry point: returns (summary record, [(file name, bytes)]) for one partition.
+
+    `task` is (key, rows, start_date, end_date, file_format); top-level so it can be pickled.
+    """
+    key, rows, start_date, end_date, file_format = task
+    tables = report_tables(key, rows, start_date, end_date)
+    name = report_name(key)
+    if file_format == "Excel":
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+            for sheet, table in tables.items():
+                table.to_excel(writer, sheet_name=sheet, index=False)
+        files = [(f"{name}.xlsx", buffer.getvalue())]
+    else:
+        files = [(f"{name}/{sheet.lower()}.csv", table.to_csv(index=False).encode('utf-8'))
+                 for sheet, table in tables.items()]
+    return tables["Summary"].iloc[0].to_dict(), files
+
+
+def report_pool(max_workers):
+    """The process's report worker pool with `max_workers` workers (replaced if it broke)."""
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        if pool is None or getattr(pool, "_broken", False):
+            pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[max_workers] = pool
+        return pool
+
+
+def generate_batch_reports(trips, start_date=None, end_date=None, by_driver=False,
+                           file_format="CSV", max_workers=REPORT_MAX_WORKERS):
+    """Builds every partition's report and returns (zip bytes, number of reports).
+
+    `trips` should already be limited to the report period; the dates only label the reports.
+    Partitions are built in a process pool when there is enough work to pay for starting it.
+    """
+    if file_format == "Excel" and not EXCEL_AVAILABLE:
+        raise ValueError("Excel reports need the openpyxl package.")
+    partitions = partition_trips(trips, by_driver)
+    start_label = str(start_date) if start_date else None
+    end_label = str(end_date) if end_date else None
+    tasks = [(key, rows, start_label, end_label, file_format)
+             for key, rows in sorted(partitions.items())]
+
+    total_rows = sum(len(rows) for _, rows, *_ in tasks)
+    if len(tasks) > 1 and total_rows >= REPORT_PARALLEL_MIN_TRIPS:
+        try:
+            results = list(report_pool(max_workers).map(build_partition_report, tasks))
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); the next call starts a new pool
+            results = [build_partition_report(task) for task in tasks]
+    else:
+        results = [build_partition_report(task) for task in tasks]
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for _, files in results:
+            for file_name, data in files:
+                archive.writestr(file_name, data)
+        # One overview row per report
+        overview = pd.DataFrame([summary for summary, _ in results], columns=SUMMARY_COLUMNS)
+        archive.writestr("summary.csv", overview.to_csv(index=False))
+    return buffer.getvalue(), len(tasks)
+
+
+def merge_report_archives(archives):
+    """Combines report zips of several depots ([(depot name, zip bytes)]) into one.
+
+    Each depot's reports go in a folder named after the depot, and the overview summary.csv
+    gets a leading Depot column.
+    """
+    buffer = io.BytesIO()
+    overviews = []
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as merged:
+        for depot_name, data in archives:
+            folder = report_name((depot_name,))
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for file_name in archive.namelist():
+                    if file_name == "summary.csv":
+                        overview = pd.read_csv(archive.open(file_name), dtype=str, keep_default_na=False)
+                        overview.insert(0, "Depot", depot_name)
+                        overviews.append(overview)
+                    else:
+                        merged.writestr(f"{folder}/{file_name}", archive.read(file_name))
+        overview = pd.concat(overviews, ignore_index=True) if overviews else pd.DataFrame(
+            columns=["Depot"] + SUMMARY_COLUMNS)
+        merged.writestr("summary.csv", overview.to_csv(index=False))
+    return buffer.getvalue()
@@ -0,0 +1,111 @@
+# catalog.py
+
+import hashlib
+import re
+import threading
+from types import MappingProxyType
+
+from config import VEHICLE_OPTIONS, DRIVER_OPTIONS, STORE_REGION_MAPPING
+
+# Vehicles, drivers and stores (with their regions) come from the Catalog worksheet, one row per
+# entry (GSHEETS_CATALOG_COLUMNS); kinds missing from the sheet fall back to config.py. A Catalog
+# is built once, with every option list presorted and frozen, and shared by all sessions until
+# the sheet changes.
+
+CATALOG_KINDS = ("Vehicle", "Driver", "Store")
+
+
+def catalog_id(kind, name):
+    """Stable id for a catalog entry, e.g. ('Store', 'Kennedy Commons') -> 'store:kennedy-commons'."""
+    return f"{kind.lower()}:{re.sub(r'[^a-z0-9]+', '-', str(name).lower()).strip('-')}"
+
+
+class Catalog:
+    """Immutable option lists and indexes for one version of the catalog.
+
+    Vehicles and drivers keep their listed order; stores are sorted within each region and
+    overall. `version` is a hash of the contents, so equal catalogs have equal versions in
+    every process.
+    """
+
+    __slots__ = ("vehicles", "drivers", "regions", "all_stores", "store_region", "ids",
+                 "version", "source")
+
+    def __init__(self, vehicles, drivers, store_region_mapping, source):
+        self.vehicles = tuple(dict.fromkeys(v for v in vehicles if v))
+        self.drivers = tuple(dict.fromkeys(d for d in drivers if d))
+        self.regions = MappingProxyType({region: tuple(sorted(set(stores)))
+                                         for region, stores in store_region_mapping.items() if stores})
+        self.all_stores = tuple(sorted({store for stores in self.regions.values() for store in stores}))
+        self.store_region = MappingProxyType({store: region for region, stores in self.regions.items()
+                                              for store in stores})
+        self.ids = MappingProxyType({
+            **{catalog_id("Vehicle", v): v for v in self.vehicles},
+            **{catalog_id("Driver", d): d for d in self.drivers},
+            **{catalog_id("Store", s): s for s in self.all_stores}})
+        contents = repr((self.vehicles, self.drivers, tuple(self.regions.items())))
+        self.version = hashlib.sha1(contents.encode("utf-8")).hexdigest()[:12]
+        self.source = source
+
+    @property
+    def vehicle_options(self):
+        """Vehicles with a leading "" for the "Select Vehicle..." placeholder."""
+        return ("",) + self.vehicles
+
+    @property
+    def driver_options(self):
+        """Drivers with a leading "" for the "Select Driver..." placeholder."""
+        return ("",) + self.drivers
+
+
+def config_catalog():
+    """The catalog defined in config.py."""
+    return Catalog(VEHICLE_OPTIONS, DRIVER_OPTIONS, STORE_REGION_MAPPING, "config.py")
+
+
+def parse_catalog_rows(records):
+    """Builds a Catalog from Catalog worksheet records; kinds with no rows come from config.py."""
+    vehicles, drivers, regions = [], [], {}
+    for record in records:
+        kind = str(record.get("Type") or "").strip().capitalize()
+        name = str(record.get("Name") or "").strip()
+        if not name or kind not in CATALOG_KINDS:
+            continue
+        if kind == "Vehicle":
+            vehicles.append(name)
+        elif kind == "Driver":
+            drivers.append(name)
+        else:
+            regions.setdefault(str(record.get("Region") or "").strip() or "Other", []).append(name)
+    if not (vehicles or drivers or regions):
+        return config_catalog()
+    return Catalog(vehicles or VEHICLE_OPTIONS, drivers or DRIVER_OPTIONS,
+                   regions or STORE_REGION_MAPPING, "sheet")
+
+
+def catalog_rows(catalog):
+    """Worksheet rows (GSHEETS_CATALOG_COLUMNS) for a catalog, e.g. to seed the sheet from config.py."""
+    return ([["Vehicle", v, ""] for v in catalog.vehicles] +
+            [["Driver", d, ""] for d in catalog.drivers] +
+            [["Store", s, region] for region, stores in catalog.regions.items() for s in stores])
+
+
+class CatalogStore:
+    """Holds the current Catalog for the process, starting from config.py."""
+
+    def __init__(self):
+        self._catalog = config_catalog()
+        self._lock = threading.Lock()
+        self.loaded = False  # True once the sheet has been read
+
+    def current(self):
+        return self._catalog
+
+    def publish(self, catalog):
+        """Makes `catalog` current; returns True if its version differs from the previous one."""
+        with self._lock:
+            self.loaded = True
+            changed = catalog.version != self._catalog.version
+            if changed:
+                self._catalog = catalog
+            return changed
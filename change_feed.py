@@ -0,0 +1,65 @@
+# change_feed.py
+
+import threading
+import time
+from collections import deque, namedtuple
+
+from config import CHANGE_FEED_HISTORY
+
+# In-process publish/subscribe feed of committed changes. Every save publishes one small
+# Change (which vehicles and trips it touched, plus the new plate rows for plate changes);
+# sessions remember the last seq they saw and ask only for newer changes, so a fragment can
+# tell in memory whether anything it shows was changed by someone else.
+
+CHANGE_TRIPS = "trips"
+CHANGE_PLATES = "plates"
+
+# vehicles is a frozenset, or None when every vehicle may be affected (e.g. a full reload);
+# origin identifies the publishing session so it can skip its own changes
+Change = namedtuple("Change", ["seq", "kind", "vehicles", "trip_ids", "origin", "payload", "at"])
+
+
+class ChangeFeed:
+    """Keeps the last `history` changes of the process in publish order."""
+
+    def __init__(self, history=CHANGE_FEED_HISTORY):
+        self._changes = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def latest_seq(self):
+        """The seq of the newest change (0 before the first one)."""
+        return self._seq
+
+    def publish(self, kind, vehicles=None, trip_ids=(), origin=None, payload=None):
+        """Appends a change and returns it."""
+        with self._lock:
+            self._seq += 1
+            change = Change(self._seq, kind, None if vehicles is None else frozenset(vehicles),
+                            frozenset(trip_ids), origin, payload, time.time())
+            self._changes.append(change)
+            return change
+
+    def since(self, seq):
+        """Changes newer than `seq`, oldest first; None if some of them are no longer kept."""
+        with self._lock:
+            if seq >= self._seq:
+                return []
+            if not self._changes or self._changes[0].seq > seq + 1:
+                return None
+            return [change for change in self._changes if change.seq > seq]
+
+
+def affects(changes, kind, vehicles=None, origin=None):
+    """True if a change of `kind` from someone other than `origin` touches any of `vehicles`.
+
+    `vehicles` None means any vehicle; `changes` None (history lost) always counts.
+    """
+    if changes is None:
+        return True
+    for change in changes:
+        if change.kind != kind or (origin is not None and change.origin == origin):
+            continue
+        if vehicles is None or change.vehicles is None or not change.vehicles.isdisjoint(vehicles):
+            return True
+    return False
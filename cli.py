@@ -0,0 +1,518 @@
+# cli.py
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import gspread
+import pandas as pd
+from gspread.utils import numericise_all, to_records
+
+from config import (
+    GSHEETS_CREDENTIALS, GSHEETS_TRIPS_WORKSHEET_NAME,
+    GSHEETS_META_WORKSHEET_NAME, GSHEETS_JOURNAL_WORKSHEET_NAME,
+    GSHEETS_ODOMETER_WORKSHEET_NAME, GSHEETS_VEHICLES_WORKSHEET_NAME, GSHEETS_TRIPS_COLUMNS, GSHEETS_CATALOG_WORKSHEET_NAME,
+    AUDIT_MAX_DATE_GAP_DAYS, INGEST_HOST, INGEST_PORT, INGEST_TOKEN,
+    TRIP_READ_CHUNK_ROWS, DIFF_HISTORIES, DIFF_TRIPS_PER_HISTORY
+)
+import storage
+from catalog import config_catalog
+from audit import audit_trips
+from batch_reports import REPORT_FORMATS, generate_batch_reports, merge_report_archives
+from depots import DEPOTS, DEFAULT_DEPOT, MULTI_DEPOT, fan_out, merge_depot_frames, merge_depot_trips
+from differential import CHECKS, run_differential
+from exports import ENCODERS, iter_export_frames
+from ingest import SheetsIngestBackend, TripIngestor, make_server
+from shared_cache import SharedCache
+from telematics import read_odometer_log, reconcile_trips, plate_aliases
+from odometer_index import ODOMETER_INDEX_COLUMNS, compute_odometer_summary
+from trip_core import monthly_vehicle_summary, recompute_accumulated_km, duplicate_trip_report
+from trip_query import TripQuery, TripTable
+from trip_sync import JOURNAL_COLUMNS
+
+# Command-line entry point for reports and maintenance jobs, e.g. from cron:
+#   cd /path/to/app && python cli.py monthly-summary --start 2024-01-01 -o summary.csv
+# Reads the same [gsheets] secrets as the app (.streamlit/secrets.toml) and uses the same
+# storage layer, but never starts the Streamlit server. Reports and exports cover every depot
+# unless --depot is given: the depots are loaded in parallel and the results merged, with a
+# leading Depot column when there is more than one.
+
+# --format value -> export format label in exports.ENCODERS
+CLI_EXPORT_FORMATS = {"csv": "CSV", "csv.gz": "CSV (gzip)", "parquet": "Parquet"}
+
+
+class CliError(Exception):
+    """A problem reported to the user as a one-line message (exit status 1)."""
+
+
+def parse_date(value):
+    """argparse type for YYYY-MM-DD dates."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a YYYY-MM-DD date")
+
+
+def open_spreadsheet(depot=DEFAULT_DEPOT):
+    """Opens a depot's spreadsheet."""
+    if GSHEETS_CREDENTIALS is None or not depot.spreadsheet_name:
+        raise CliError("Google Sheets credentials or spreadsheet name not found in "
+                       ".streamlit/secrets.toml (run from the app directory).")
+    try:
+        return storage.authorize_client(GSHEETS_CREDENTIALS).open(depot.spreadsheet_name)
+    except Exception as e:
+        raise CliError(f"Error opening Google Spreadsheet '{depot.spreadsheet_name}': {e}")
+
+
+def open_shared_cache(depot=DEFAULT_DEPOT):
+    """A depot's shared trip cache the app processes use, or None if it is turned off or unavailable."""
+    if not depot.shared_cache_path:
+        return None
+    try:
+        return SharedCache(depot.shared_cache_path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Shared cache not used: {e}", file=sys.stderr)
+        return None
+
+
+def load_trips(spreadsheet, depot=DEFAULT_DEPOT):
+    """Reads a depot's trips, from the shared cache when it matches the sheet version, else from the sheet."""
+    trips_title = depot.worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+    try:
+        meta = storage.open_or_create_worksheet(spreadsheet, depot.worksheet(GSHEETS_META_WORKSHEET_NAME),
+                                                ["Key", "Value"])
+        version, journal_row_count = storage.read_version(meta)
+        cache = open_shared_cache(depot)
+        if cache is not None:
+            try:
+                cached = cache.trips_at(version)
+                if cached is not None:
+                    return [dict(trip) for trip in cached]
+            except sqlite3.Error as e:
+                print(f"Shared cache not used: {e}", file=sys.stderr)
+        trips = storage.read_trips(spreadsheet.worksheet(trips_title))
+    except Exception as e:
+        raise CliError(f"Error loading data from '{trips_title}' sheet: {e}")
+    if cache is not None:
+        # Versioned before the read: a write in between is replayed on top again, never lost
+        share_snapshot(cache, trips, version, journal_row_count)
+    return trips
+
+
+def share_snapshot(cache, trips, version, journal_row_count):
+    """Stores trips just read from or written to the sheet in the shared cache, if possible."""
+    try:
+        cache.store_snapshot(trips, version, journal_row_count, matches_sheet_order=True, origin="cli")
+    except sqlite3.Error as e:
+        print(f"Shared cache not updated: {e}", file=sys.stderr)
+
+
+def load_catalog(spreadsheet, depot=DEFAULT_DEPOT):
+    """Reads a depot's Catalog worksheet, or the config.py lists if there is none."""
+    catalog_title = depot.worksheet(GSHEETS_CATALOG_WORKSHEET_NAME)
+    try:
+        return storage.read_catalog(spreadsheet.worksheet(catalog_title))
+    except gspread.exceptions.WorksheetNotFound:
+        return config_catalog()
+    except Exception as e:
+        raise CliError(f"Error loading data from '{catalog_title}' sheet: {e}")
+
+
+def selected_depots(args):
+    """The depots named with --depot (repeatable), or every depot."""
+    return [DEPOTS[key] for key in dict.fromkeys(args.depot)] if args.depot else list(DEPOTS.values())
+
+
+def depot_error(depot, error):
+    """A CliError naming the depot it happened in (when there are several)."""
+    return CliError(f"{depot.name}: {error}") if MULTI_DEPOT else error
+
+
+def load_depot_trips(args, select=True):
+    """Loads the trips of the selected depots in parallel: {depot key: trips}.
+
+    With `select`, only the trips in the --start/--end range (and --vehicle), in date order.
+    """
+    def depot_trips(depot):
+        try:
+            trips = load_trips(open_spreadsheet(depot), depot)
+        except CliError as e:
+            raise depot_error(depot, e)
+        return select_trips(trips, args) if select else trips
+    return fan_out(depot_trips, selected_depots(args))
+
+
+def select_trips(trips, args):
+    """Trips in the --start/--end range (and --vehicle, if given), in date order."""
+    query = TripQuery(start_date=args.start, end_date=args.end,
+                      vehicles=(args.vehicle,) if args.vehicle else None,
+                      sort=(("Date", False),))
+    table = TripTable(trips)
+    return [table.trips[i] for i in table.select(query)]
+
+
+def write_output(data, path):
+    """Writes bytes to a file, or to stdout for '-'."""
+    if path == "-":
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def write_frame(frame, path):
+    """Writes a DataFrame as CSV to a file or stdout."""
+    write_output(frame.to_csv(index=False).encode('utf-8'), path)
+
+
+# --- Subcommands ---
+
+
+def cmd_export(args):
+    """Exports the trips in a date range."""
+    trips_by_depot = load_depot_trips(args)
+    trips = merge_depot_trips(trips_by_depot)
+    columns = (["Depot"] if len(trips_by_depot) > 1 else []) + GSHEETS_TRIPS_COLUMNS
+    encoder = ENCODERS[CLI_EXPORT_FORMATS[args.format]]
+    write_output(encoder(iter_export_frames(trips, columns)), args.output)
+    print(f"Exported {len(trips)} trip(s).", file=sys.stderr)
+    return 0
+
+
+def store_count_frame(trips):
+    """Store visit counts of a trip list, most visited first."""
+    table = TripTable(trips)
+    return pd.DataFrame(table.store_counts(table.select(TripQuery())), columns=["Store", "Count"])
+
+
+def cmd_store_counts(args):
+    """Counts store visits in a date range."""
+    frames = {key: store_count_frame(trips) for key, trips in load_depot_trips(args).items()}
+    write_frame(merge_depot_frames(frames), args.output)
+    return 0
+
+
+def cmd_monthly_summary(args):
+    """Per-vehicle monthly KM summary."""
+    frames = {key: monthly_vehicle_summary(trips) for key, trips in load_depot_trips(args).items()}
+    write_frame(merge_depot_frames(frames), args.output)
+    return 0
+
+
+def cmd_reports(args):
+    """Per-vehicle (or per vehicle and driver) reports for a date range, zipped (one folder per depot)."""
+    archives, count = [], 0
+    # Trips are loaded in parallel; each depot's reports then use the whole worker pool in turn
+    for key, trips in load_depot_trips(args).items():
+        try:
+            data, depot_count = generate_batch_reports(trips, args.start, args.end, by_driver=args.by_driver,
+                                                       file_format=args.format, max_workers=args.workers)
+        except ValueError as e:
+            raise CliError(str(e))
+        archives.append((DEPOTS[key].name, data))
+        count += depot_count
+    write_output(archives[0][1] if len(archives) == 1 else merge_report_archives(archives), args.output)
+    print(f"Wrote {count} report(s).", file=sys.stderr)
+    return 0
+
+
+def cmd_reconcile(args):
+    """Reconciles a telematics odometer log with one depot's trips; streams the log in chunks."""
+    depot = DEPOTS[args.depot]
+    spreadsheet = open_spreadsheet(depot)
+    plates_title = depot.worksheet(GSHEETS_VEHICLES_WORKSHEET_NAME)
+    try:
+        vehicle_records = spreadsheet.worksheet(plates_title).get_all_records()
+    except Exception as e:
+        raise CliError(f"Error loading data from '{plates_title}' sheet: {e}")
+    try:
+        daily, aggregator = read_odometer_log(args.log, vehicle_aliases=plate_aliases(vehicle_records))
+    except (OSError, ValueError, pd.errors.ParserError) as e:
+        raise CliError(f"Could not read the log: {e}")
+    print(f"{aggregator.rows_read} reading(s) over {len(daily)} vehicle-day(s); "
+          f"{aggregator.rows_skipped} unreadable row(s) skipped.", file=sys.stderr)
+
+    report, corrections = reconcile_trips(daily, load_trips(spreadsheet, depot))
+    write_frame(report, args.output)
+    if args.corrections:
+        write_frame(corrections, args.corrections)
+    print(f"{len(report)} issue(s), {len(corrections)} suggested correction(s).", file=sys.stderr)
+    return 0
+
+
+def cmd_audit(args):
+    """Odometer continuity audit; with --fail-on-high, exits with status 2 if High severity issues were found."""
+    report = merge_depot_frames({key: audit_trips(trips, args.max_gap_days)
+                                 for key, trips in load_depot_trips(args, select=False).items()})
+    write_frame(report, args.output)
+    high = int((report["Severity"] == "High").sum())
+    print(f"{len(report)} issue(s), {high} of High severity.", file=sys.stderr)
+    return 2 if args.fail_on_high and high else 0
+
+
+def cmd_duplicates(args):
+    """Trips recorded more than once; with --fail-on-duplicates, exits with status 2 if any were found."""
+    report = merge_depot_frames({key: duplicate_trip_report(trips)
+                                 for key, trips in load_depot_trips(args, select=False).items()})
+    write_frame(report, args.output)
+    extra = int(report["Copies"].sum()) - len(report)
+    print(f"{len(report)} trip(s) recorded more than once, {extra} extra cop(ies).", file=sys.stderr)
+    return 2 if args.fail_on_duplicates and len(report) else 0
+
+
+def recompute_depot_km(depot, dry_run):
+    """Recomputes one depot's Accumulated KM and saves the corrected trips; returns a status line."""
+    spreadsheet = open_spreadsheet(depot)
+    meta = storage.open_or_create_worksheet(spreadsheet, depot.worksheet(GSHEETS_META_WORKSHEET_NAME),
+                                            ["Key", "Value"])
+    version, journal_row_count = storage.read_version(meta)
+    trips = load_trips(spreadsheet, depot)
+    repaired, changed = recompute_accumulated_km(trips)
+    found = f"{len(changed)} trip(s) with a wrong Accumulated KM"
+    if not changed or dry_run:
+        return f"{found}."
+
+    # Same optimistic concurrency check as the app, under the write lease every trips writer
+    # holds: refuse to overwrite someone else's write
+    trips_title = depot.worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+    recorded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with storage.write_lease(meta, f"cli:{os.getpid()}"):
+            if storage.read_version(meta)[0] != version:
+                raise CliError("The trips sheet changed while recomputing; run the command again.")
+            storage.write_trips(spreadsheet.worksheet(trips_title), repaired)
+            journal = storage.open_or_create_worksheet(
+                spreadsheet, depot.worksheet(GSHEETS_JOURNAL_WORKSHEET_NAME), JOURNAL_COLUMNS)
+            new_version, new_journal_row_count = storage.record_trip_write(
+                meta, journal, version, journal_row_count, changed, set(), recorded_at)
+    except (storage.WriteLeaseBusy, storage.VersionConflict) as e:
+        raise CliError(str(e))
+    cache = open_shared_cache(depot)
+    if cache is not None:
+        share_snapshot(cache, repaired, new_version, new_journal_row_count)
+    vehicles = list(load_catalog(spreadsheet, depot).vehicles)
+    storage.write_odometer_rows(
+        storage.open_or_create_worksheet(spreadsheet, depot.worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME),
+                                         ODOMETER_INDEX_COLUMNS),
+        compute_odometer_summary(repaired, vehicles), vehicles, recorded_at)
+    return f"{found}; saved to '{trips_title}' sheet."
+
+
+def cmd_recompute_km(args):
+    """Recomputes Accumulated KM for every vehicle of the selected depots (in parallel) and saves the corrected trips."""
+    def recompute(depot):
+        try:
+            return recompute_depot_km(depot, args.dry_run)
+        except CliError as e:
+            raise depot_error(depot, e)
+    for key, status in fan_out(recompute, selected_depots(args)).items():
+        print(f"{DEPOTS[key].name}: {status}" if MULTI_DEPOT else status, file=sys.stderr)
+    return 0
+
+
+def cmd_ingest_server(args):
+    """Serves the trip ingestion API for one depot until interrupted (see ingest.py)."""
+    depot = DEPOTS[args.depot]
+    ingestor = TripIngestor(SheetsIngestBackend(open_spreadsheet(depot), open_shared_cache(depot), depot))
+    try:
+        server = make_server(ingestor, args.host, args.port, INGEST_TOKEN)
+    except OSError as e:
+        raise CliError(f"Cannot listen on {args.host}:{args.port}: {e}")
+    ingestor.start()
+    print(f"Accepting trips at http://{args.host}:{args.port}/trips"
+          f"{' (bearer token required)' if INGEST_TOKEN else ''}; Ctrl+C to stop.", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ingestor.stop()
+    return 0
+
+
+def synthetic_sheet_rows(first, count, unformatted):
+    """Trips sheet rows first..first+count-1 (after the header) as the Sheets API returns them.
+
+    Formatted rows are the text get_all_records works from; unformatted rows are typed, with
+    every other date stored as a real date (a serial number) and the KM of one row in seven
+    stored as text (cells formatted as plain text). One id in ten is blank.
+    """
+    rows = []
+    for i in range(first, first + count):
+        day = datetime(2020, 1, 1).toordinal() + i // 20
+        km = 1000 + i * 37
+        date_value = datetime.fromordinal(day).strftime('%Y-%m-%d')
+        if unformatted and i % 2:
+            date_value = day - datetime(1899, 12, 30).toordinal()
+        start_km, end_km = (str(km), str(km + 37)) if unformatted and i % 7 == 0 else (km, km + 37)
+        values = ["" if i % 10 == 0 else f"trip-{i:08d}", date_value, "ABC"[i % 3], start_km, end_km,
+                  37 * (i // 3 + 1), "Cliffy", "Ajax, Oshawa", "", "", "", "ABCD 123"]
+        rows.append(values if unformatted else [str(value) for value in values])
+    return rows
+
+
+def load_records_path(rows):
+    """The get_all_records loader: numericise the text, build records, then parse_trip_records."""
+    return storage.parse_trip_records(
+        to_records(GSHEETS_TRIPS_COLUMNS, [numericise_all(row) for row in rows]))
+
+
+def cmd_bench_load(args):
+    """Compares the get_all_records loader with the chunked unformatted loader on synthetic rows."""
+    def records_loader(response):
+        return load_records_path(response(0, args.rows))
+
+    def chunked_loader(response):
+        trips = []
+        for first in range(0, args.rows, args.chunk_rows):
+            trips.extend(storage.decode_trip_rows(
+                GSHEETS_TRIPS_COLUMNS, response(first, min(args.chunk_rows, args.rows - first))))
+        return trips
+
+    loaders = [("get_all_records", records_loader, False), ("chunked unformatted", chunked_loader, True)]
+    results, loaded = [], {}
+    for name, loader, unformatted in loaders:
+        # Time the decoding alone, on responses fetched beforehand
+        fetched = synthetic_sheet_rows(0, args.rows, unformatted)
+        started = time.perf_counter()
+        loaded[name] = loader(lambda first, count: fetched[first:first + count])
+        seconds = time.perf_counter() - started
+        fetched = None
+        # Peak memory includes the responses, which are only held while they are decoded
+        tracemalloc.start()
+        loader(lambda first, count: synthetic_sheet_rows(first, count, unformatted))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({"Loader": name, "Rows": args.rows, "Seconds": round(seconds, 3),
+                        "Peak MB": round(peak / 2**20, 1)})
+
+    def comparable(trips):
+        return [(t["Date"], t["Vehicle"], t["Start KM"], t["End KM"], t["Accumulated KM"]) for t in trips]
+    same = comparable(loaded["get_all_records"]) == comparable(loaded["chunked unformatted"])
+    write_frame(pd.DataFrame(results), args.output)
+    print(f"Loaded trips {'match' if same else 'DIFFER'}.", file=sys.stderr)
+    return 0 if same else 2
+
+
+def cmd_verify_engines(args):
+    """Differential check of the optimized trip computations against reference versions; exits with status 2 on a mismatch."""
+    report, mismatches = run_differential(args.histories, args.trips, args.seed, args.check)
+    write_frame(report, args.output)
+    if args.mismatches:
+        write_frame(mismatches, args.mismatches)
+    for mismatch in mismatches.head(5).itertuples(index=False):
+        print(f"Mismatch in {mismatch.Check} (history {mismatch.Seed}, arguments {mismatch.Arguments}): "
+              f"expected {mismatch.Expected}, got {mismatch.Actual}", file=sys.stderr)
+    print(f"{int(report['Cases'].sum())} case(s), {len(mismatches)} mismatch(es).", file=sys.stderr)
+    return 2 if len(mismatches) else 0
+
+
+def build_parser():
+    """Builds the argument parser with one subparser per command."""
+    parser = argparse.ArgumentParser(description="Route Tracker reports and maintenance jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_depots_argument(subparser):
+        subparser.add_argument("--depot", action="append", choices=list(DEPOTS),
+                               help="Only this depot (repeatable; default: every depot)")
+
+    def add_depot_argument(subparser):
+        subparser.add_argument("--depot", choices=list(DEPOTS), default=DEFAULT_DEPOT.key,
+                               help=f"Depot (default: {DEFAULT_DEPOT.key})")
+
+    def add_range_arguments(subparser):
+        subparser.add_argument("--start", type=parse_date, help="First date (YYYY-MM-DD, inclusive)")
+        subparser.add_argument("--end", type=parse_date, help="Last date (YYYY-MM-DD, inclusive)")
+        subparser.add_argument("--vehicle", help="Only this vehicle")
+        subparser.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+        add_depots_argument(subparser)
+
+    export = subparsers.add_parser("export", help="Export trips in a date range")
+    add_range_arguments(export)
+    export.add_argument("--format", choices=list(CLI_EXPORT_FORMATS), default="csv")
+    export.set_defaults(func=cmd_export)
+
+    store_counts = subparsers.add_parser("store-counts", help="Store visit counts in a date range")
+    add_range_arguments(store_counts)
+    store_counts.set_defaults(func=cmd_store_counts)
+
+    monthly = subparsers.add_parser("monthly-summary", help="Per-vehicle monthly KM summary")
+    add_range_arguments(monthly)
+    monthly.set_defaults(func=cmd_monthly_summary)
+
+    reports = subparsers.add_parser("reports", help="Per-vehicle reports for a date range, as one zip")
+    add_range_arguments(reports)
+    reports.add_argument("--by-driver", action="store_true", help="One report per vehicle and driver")
+    reports.add_argument("--format", choices=REPORT_FORMATS, default="CSV")
+    reports.add_argument("--workers", type=int, help="Worker processes (default: one per CPU core)")
+    reports.set_defaults(func=cmd_reports)
+
+    reconcile = subparsers.add_parser("reconcile", help="Reconcile a telematics odometer log with the trips")
+    reconcile.add_argument("log", help="Odometer log CSV file")
+    reconcile.add_argument("-o", "--output", default="-", help="Report file (default: stdout)")
+    reconcile.add_argument("--corrections", help="Also write suggested corrections to this CSV file")
+    add_depot_argument(reconcile)
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    audit = subparsers.add_parser("audit", help="Odometer continuity audit")
+    audit.add_argument("--max-gap-days", type=int, default=AUDIT_MAX_DATE_GAP_DAYS)
+    audit.add_argument("--fail-on-high", action="store_true",
+                       help="Exit with status 2 if High severity issues were found")
+    audit.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    add_depots_argument(audit)
+    audit.set_defaults(func=cmd_audit)
+
+    duplicates = subparsers.add_parser("duplicates", help="Trips recorded more than once")
+    duplicates.add_argument("--fail-on-duplicates", action="store_true",
+                            help="Exit with status 2 if duplicates were found")
+    duplicates.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    add_depots_argument(duplicates)
+    duplicates.set_defaults(func=cmd_duplicates)
+
+    recompute = subparsers.add_parser("recompute-km", help="Recompute and save Accumulated KM")
+    recompute.add_argument("--dry-run", action="store_true", help="Only report how many trips are wrong")
+    add_depots_argument(recompute)
+    recompute.set_defaults(func=cmd_recompute_km)
+
+    ingest_server = subparsers.add_parser("ingest-server", help="Accept trips posted as JSON over HTTP")
+    ingest_server.add_argument("--host", default=INGEST_HOST)
+    ingest_server.add_argument("--port", type=int, default=INGEST_PORT)
+    add_depot_argument(ingest_server)
+    ingest_server.set_defaults(func=cmd_ingest_server)
+
+    bench_load = subparsers.add_parser("bench-load", help="Benchmark the trips sheet loaders on synthetic rows")
+    bench_load.add_argument("--rows", type=int, default=100000)
+    bench_load.add_argument("--chunk-rows", type=int, default=TRIP_READ_CHUNK_ROWS)
+    bench_load.add_argument("-o", "--output", default="-", help="Output file (default: stdout)")
+    bench_load.set_defaults(func=cmd_bench_load)
+
+    verify = subparsers.add_parser("verify-engines",
+                                   help="Check the optimized trip computations against reference versions")
+    verify.add_argument("--histories", type=int, default=DIFF_HISTORIES, help="Random trip histories per check")
+    verify.add_argument("--trips", type=int, default=DIFF_TRIPS_PER_HISTORY, help="Trips per history")
+    verify.add_argument("--seed", default="0", help="Seed of the random histories")
+    verify.add_argument("--check", action="append", choices=[check.name for check in CHECKS],
+                        help="Only this check (repeatable)")
+    verify.add_argument("--mismatches", help="Also write the mismatches to this CSV file")
+    verify.add_argument("-o", "--output", default="-", help="Report file (default: stdout)")
+    verify.set_defaults(func=cmd_verify_engines)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except CliError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,13 +9,17 @@ PAGE_LAYOUT = "wide"  # Pagelayout is default set to wide
 
 # Initial structure for session state
 INITIAL_STATE = {
-    'trips': [],
+    'trips': None,  # SessionTrips view of the shared trip snapshot, bound in initialize_state
     'current_tab': "Add New Trip",
     # Removed 'Fleet Change' from df_vehicles structure as it moves to trips
     'df_vehicles': pd.DataFrame(columns=['Vehicle', 'License Plate', 'Comments']),
     'logged_in': False,
     # 'confirm_delete': False # Handled dynamically per trip now
     'data_loaded': False,  # Flag to ensure data is loaded only once per session
+    'plate_history': [],  # Rows of the plate history sheet (one per plate change)
+    'plate_timeline': None,  # PlateTimeline built from plate_history; rebuilt when it changes
+    'write_conflicts': [],  # Trips changed both here and by another server process since the last sync
+    'telematics_result': None,  # Last reconciled telematics upload, reused until the file or trips change
     # Removed 'add_trip_start_km_value' as auto-population is removed
     # Removed 'previous_add_trip_vehicle' as it's no longer needed for auto-population
 }
@@ -51,14 +55,53 @@ STORE_REGION_MAPPING = {
 # spreadsheet_name = "Your RotiRoute Tracker Sheet Name"
 # trips_worksheet_name = "Full_route"
 # vehicles_worksheet_name = "Vehicle plates"
+# plate_history_worksheet_name = "Plate history"
+# meta_worksheet_name = "Meta"
+# journal_worksheet_name = "Trip changes"
+# odometer_worksheet_name = "Latest odometer"
+# catalog_worksheet_name = "Catalog"
 # credentials = "{...}" # The JSON content of your service account key file
-GSHEETS_SPREADSHEET_NAME = st.secrets.get(
-    "gsheets", {}).get("spreadsheet_name")
-GSHEETS_TRIPS_WORKSHEET_NAME = st.secrets.get("gsheets", {}).get(
+
+
+def _secrets_table(name):
+    """Returns a secrets table such as [gsheets], or {} when no secrets file is found."""
+    try:
+        return st.secrets.get(name, {})
+    except FileNotFoundError:  # e.g. cli.py run outside the app directory
+        return {}
+
+
+_GSHEETS_SECRETS = _secrets_table("gsheets")
+GSHEETS_SPREADSHEET_NAME = _GSHEETS_SECRETS.get("spreadsheet_name")
+GSHEETS_TRIPS_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
     "trips_worksheet_name", "Full_route")  # Default
-GSHEETS_VEHICLES_WORKSHEET_NAME = st.secrets.get("gsheets", {}).get(
+GSHEETS_VEHICLES_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
     "vehicles_worksheet_name", "Vehicle plates")  # Default
-GSHEETS_CREDENTIALS = st.secrets.get("gsheets", {}).get("credentials")
+GSHEETS_PLATE_HISTORY_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
+    "plate_history_worksheet_name", "Plate history")  # Default
+GSHEETS_META_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
+    "meta_worksheet_name", "Meta")  # Default
+GSHEETS_JOURNAL_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
+    "journal_worksheet_name", "Trip changes")  # Default
+GSHEETS_ODOMETER_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
+    "odometer_worksheet_name", "Latest odometer")  # Default
+GSHEETS_CATALOG_WORKSHEET_NAME = _GSHEETS_SECRETS.get(
+    "catalog_worksheet_name", "Catalog")  # Default
+GSHEETS_CREDENTIALS = _GSHEETS_SECRETS.get("credentials")
+
+# --- Depots ---
+# Each depot (kitchen) keeps its own trips, plates, plate history, Meta, journal, odometer and
+# Catalog worksheets, so a session loads and rewrites only its own depot (see depots.py). The
+# first depot uses the worksheets named above; more are added in secrets, e.g.
+# [gsheets.depots.east]
+# name = "East Kitchen"
+# spreadsheet_name = "RotiRoute East"  # Optional: defaults to the spreadsheet above
+# worksheet_suffix = " (East)"  # Optional: defaults to " (<name>)", e.g. "Full_route (East Kitchen)"
+GSHEETS_DEPOTS = _GSHEETS_SECRETS.get("depots", {})
+DEFAULT_DEPOT_KEY = _GSHEETS_SECRETS.get("depot_key", "main")  # Key and name of the first depot
+DEFAULT_DEPOT_NAME = _GSHEETS_SECRETS.get("depot_name", "Main Kitchen")
+# Threads used to load or report on several depots at once
+DEPOT_FAN_OUT_WORKERS = 8
 
 # Define the columns expected in the Google Sheet for Trips
 # Ensure these match the keys used in the trip dictionaries
@@ -67,8 +110,194 @@ GSHEETS_TRIPS_COLUMNS = [
     "Driver", "Route", "Remarks", "Edited By", "Fleet Change", "License Plate at Trip Time"
 ]
 
+# Route value used for the special trip rows that record a license plate change
+FLEET_CHANGE_ROUTE = "Fleet Change Event"
+
 # Define the columns expected in the Google Sheet for Vehicle Plates
 # Removed 'Fleet Change' from here
 GSHEETS_VEHICLES_COLUMNS = [
     "Vehicle", "License Plate", "Comments"
 ]
+
+# Define the columns expected in the Google Sheet for the Catalog
+# One row per vehicle, driver or store (Type = Vehicle / Driver / Store); Region is for stores.
+# Kinds with no rows fall back to VEHICLE_OPTIONS, DRIVER_OPTIONS and STORE_REGION_MAPPING above.
+GSHEETS_CATALOG_COLUMNS = ["Type", "Name", "Region"]
+
+# Define the columns expected in the Google Sheet for the Plate History
+# One row per plate a vehicle has carried, effective from a date (YYYY-MM-DD)
+GSHEETS_PLATE_HISTORY_COLUMNS = [
+    "Vehicle", "License Plate", "Effective From", "Changed By", "Comments", "Recorded At"
+]
+
+# --- Export Settings ---
+# Exports are encoded this many rows at a time so large ranges never need one huge DataFrame
+EXPORT_CHUNK_ROWS = 5000
+# How many generated export files (per data version / filter / format) to keep cached
+EXPORT_CACHE_MAX_ENTRIES = 16
+
+# --- Bulk Edit Settings ---
+# Maximum number of trips shown at once in the admin bulk edit grid
+BULK_EDIT_MAX_ROWS = 500
+
+# --- Audit Settings ---
+# Days without a trip (per vehicle) before the continuity audit reports a date gap
+AUDIT_MAX_DATE_GAP_DAYS = 7
+
+# --- Trip Query Cache ---
+# Query results kept per (data version, query), shared by all sessions of the server process
+TRIP_QUERY_CACHE_SIZE = 256
+# Columnar trip tables kept (one per data version)
+TRIP_TABLE_CACHE_SIZE = 8
+
+# --- Trip Loading ---
+# Rows fetched per request when reading the trips worksheet (each chunk is decoded before the next)
+TRIP_READ_CHUNK_ROWS = 20000
+
+# --- Write Lease ---
+# Every trips writer (app sessions, driver mode, the ingest server, the CLI) holds the write
+# lease in the Meta sheet while it writes, so writers in different processes take turns
+WRITE_LEASE_SECONDS = 60  # A lease left by a crashed writer expires after this long
+WRITE_LEASE_WAIT_SECONDS = 30  # How long a writer waits for a busy lease before giving up
+WRITE_LEASE_SETTLE_SECONDS = 0.5  # Pause before reading a claimed lease back (two claims at once: the last wins)
+
+# --- Background Jobs ---
+# Recurring jobs run on one scheduler thread per server process (see background_jobs.py)
+SCHEDULER_TICK_SECONDS = 15  # How often the scheduler checks for due jobs
+SCHEDULER_ERROR_HISTORY = 20  # Errors kept per job for the admin status view
+SNAPSHOT_REFRESH_SECONDS = 300  # Reload the shared trip snapshot if the sheet version moved
+AGGREGATES_REFRESH_SECONDS = 900  # Rebuild the per-vehicle monthly summary
+AUDIT_REFRESH_SECONDS = 1800  # Re-run the odometer continuity audit
+BACKUP_INTERVAL_SECONDS = 86400  # Write a local gzip CSV backup of the trips
+BACKUP_DIR = "backups"  # Relative to the working directory of the server
+BACKUP_KEEP = 14  # Newest backups kept; older ones are deleted
+CATALOG_REFRESH_SECONDS = 120  # Re-read the Catalog worksheet for new vehicles, drivers and stores
+
+# --- Startup ---
+# python serve.py starts the server and warms the process on a background thread (see
+# warmup.py), so the Sheets client, trip snapshot, catalog and indexes are ready before the
+# first visitor. With plain `streamlit run app.py` the first visit starts the warm-up instead.
+STARTUP_FIRST_PAINT_HISTORY = 100  # Recent first page renders kept for the admin timings view
+
+# --- Live Updates ---
+# Saves are published on an in-process change feed (see change_feed.py). Live parts of the page
+# (latest End KM, vehicle details, latest trips) check it this often and redraw only when
+# another session changed something they show.
+CHANGE_FEED_POLL_SECONDS = 5
+CHANGE_FEED_HISTORY = 1000  # Changes kept; a session further behind reloads its plates
+
+# --- Duplicate Protection ---
+# Submission tokens remembered per process (see submission_log.py); a form resubmitted with a
+# token seen this recently is not saved again
+SUBMISSION_TOKEN_HISTORY = 10000
+
+# --- Trip Ingestion API ---
+# Local HTTP endpoint for posting trips as JSON (python cli.py ingest-server, see ingest.py)
+INGEST_HOST = "127.0.0.1"  # Only reachable from this machine unless changed
+INGEST_PORT = 8765
+# Optional shared secret, sent as "Authorization: Bearer <token>"; set it in secrets as
+# [ingest]
+# token = "..."
+INGEST_TOKEN = _secrets_table("ingest").get("token")
+INGEST_BATCH_WINDOW_SECONDS = 0.2  # Requests arriving within this window are written together
+INGEST_MAX_BATCH = 1000  # Trips per sheet write at most
+INGEST_MAX_BODY_BYTES = 5_000_000
+INGEST_REFERENCE_REFRESH_SECONDS = 300  # Re-read catalog and plates this often
+
+# --- Shared Cache ---
+# SQLite file shared by every app process on this machine (see shared_cache.py), so only one of
+# them reads the trips sheet and the others follow its writes. Turn it off in secrets with
+# [shared_cache]
+# path = ""
+SHARED_CACHE_PATH = _secrets_table("shared_cache").get("path", ".cache/shared_trips.sqlite3")
+SHARED_CACHE_COMPACT_WRITES = 200  # Logged writes after which the full snapshot is stored again
+SHARED_CACHE_PLATE_CHANGES = 200  # Plate changes kept for other processes; one further behind reloads its plates
+
+# --- Batch Reports ---
+# Worker processes for month-end report generation (None = one per CPU core)
+REPORT_MAX_WORKERS = None
+# Below this many trips the reports are built in-process; starting workers would cost more
+REPORT_PARALLEL_MIN_TRIPS = 5000
+
+# --- Telematics Reconciliation ---
+# Column names in the odometer log CSV exported by the vehicles' telematics units
+TELEMATICS_COLUMNS = {"vehicle": "Vehicle", "timestamp": "Timestamp", "odometer": "Odometer KM"}
+# Log rows read per chunk; memory use stays flat however large the file is
+TELEMATICS_CHUNK_ROWS = 200_000
+# KM difference between a trip and the log that is still accepted as a typing/rounding difference
+TELEMATICS_KM_TOLERANCE = 2
+# A logged day with at least this much movement but no trip is reported as a missing trip
+TELEMATICS_MIN_MOVEMENT_KM = 5
+
+# --- Route Distance Check ---
+# Approximate (latitude, longitude) of each store in STORE_REGION_MAPPING; stores missing here
+# are left out of route length estimates
+STORE_COORDINATES = {
+    # East
+    "Woodside": (43.8097, -79.2683),
+    "Kennedy Commons": (43.7797, -79.2825),
+    "Scarborough": (43.7731, -79.2578),
+    "Ajax": (43.8509, -79.0204),
+    "Oshawa": (43.8971, -78.8658),
+    # West
+    "Jane": (43.7170, -79.5040),
+    "Stockyard": (43.6690, -79.4700),
+    "Bloor": (43.6540, -79.4660),
+    "Stoney Creek": (43.2187, -79.7600),
+    "Burlington": (43.3255, -79.7990),
+    "Oakville": (43.4675, -79.6877),
+    "Niagara": (43.0896, -79.0849),
+    "Dundas": (43.2660, -79.9550),
+    "Waterloo": (43.4643, -80.5204),
+    "Woodstock": (43.1306, -80.7467),
+    "London": (42.9849, -81.2453),
+    "Brampton": (43.7315, -79.7624),
+    # North
+    "Vaughan": (43.8361, -79.4983),
+    "Bradford": (44.1147, -79.5621),
+    "NewMarket": (44.0592, -79.4613),
+    # Downtown
+    "King": (43.6440, -79.4000),
+    "Momo-King": (43.6445, -79.4010),
+    "Queen": (43.6480, -79.3960),
+    "Harbour": (43.6400, -79.3800),
+    "Harlow": (43.6500, -79.3900),
+    "Maverick": (43.6460, -79.3930),
+    "Momo-Downtown": (43.6560, -79.3830),
+    "Bayview": (43.7070, -79.3760),
+    "Uptown": (43.7060, -79.3980),
+    "Leslie": (43.7590, -79.3640),
+    # Chai Stop
+    "Lakeshore - CS": (43.6300, -79.4800),
+    "Harbourfront - CS": (43.6390, -79.3810),
+    # Central
+    "Veggie Paradise": (43.7000, -79.4500),
+    "Rexdale": (43.7240, -79.5660),
+    # Missisauga
+    "Dixie": (43.5935, -79.5700),
+    "Mississauga": (43.5890, -79.6441),
+    "Square One": (43.5930, -79.6420),
+    "Hakka Mississauga": (43.6000, -79.6500),
+}
+# (latitude, longitude) where routes start and end; None estimates an open path through the stores
+ROUTE_DEPOT_COORDINATES = None
+# Road distance is estimated as straight-line distance times this factor
+ROAD_DISTANCE_FACTOR = 1.3
+# A trip is implausible if its KM is above expected * MAX_RATIO + SLACK or below expected * MIN_RATIO
+ROUTE_MAX_RATIO = 1.5
+ROUTE_MIN_RATIO = 0.7
+ROUTE_KM_SLACK = 40  # Allowance for the drive to the first and from the last store
+# Local cache of the store-to-store distance matrix (rebuilt when the coordinates change)
+ROUTE_DISTANCE_CACHE_PATH = ".cache/store_distances.npz"
+
+# --- KM Anomaly Detection ---
+# Daily KM per vehicle and per driver is compared with the median / MAD of their last N driving days
+ANOMALY_WINDOW_DAYS = 180
+ANOMALY_Z_THRESHOLD = 3.5  # Robust z-score above which a day is an outlier
+ANOMALY_MIN_SAMPLES = 10  # Driving days needed before a vehicle or driver is scored
+ANOMALY_MIN_MAD_KM = 10  # Floor for the MAD, so very regular vehicles are not flagged for small changes
+
+# --- Differential Checks ---
+# Defaults of python cli.py verify-engines: random trip histories per check and trips per history
+DIFF_HISTORIES = 25
+DIFF_TRIPS_PER_HISTORY = 500
@@ -0,0 +1,56 @@
+import streamlit as st
+from utils import apply_accumulated_km, save_trips_to_gsheets
+
+
+def describe_trip(trip):
+    """One-line summary of a trip version for the conflict prompt."""
+    if trip is None:
+        return "Deleted"
+    return (f"{trip.get('Date')} - {trip.get('Vehicle')} - {trip.get('Start KM')} to {trip.get('End KM')}"
+            f" - {trip.get('Driver')} - {trip.get('Route')}")
+
+
+def keep_my_version(conflict):
+    """Re-applies this session's version of a conflicting trip and saves it."""
+    trip_id = conflict["id"]
+    mine = conflict["mine"]
+    trips = st.session_state.trips
+    theirs = trips.get(trip_id)
+    vehicles = {theirs.get("Vehicle")} if theirs is not None else set()
+    if mine is None:
+        trips.remove(trip_id)
+    elif theirs is not None:
+        trips.edit(trip_id).update(mine)
+    else:
+        trips.append(mine)
+    if mine is not None:
+        vehicles.add(mine.get("Vehicle"))
+    for vehicle in vehicles:
+        apply_accumulated_km(trips, vehicle)
+    save_trips_to_gsheets()
+
+
+def display_conflicts_section():
+    """Shows trips that this session and another session changed differently, and lets the user pick a version."""
+    conflicts = st.session_state.get('write_conflicts', [])
+    if not conflicts:
+        return
+
+    st.warning(f"{len(conflicts)} trip(s) were changed by someone else while you were editing them. "
+               "Their version has been kept; choose what to do with yours.")
+    for index, conflict in enumerate(list(conflicts)):
+        with st.container(border=True):
+            st.markdown(f"**Theirs:** {describe_trip(conflict['theirs'])}")
+            st.markdown(f"**Yours:** {describe_trip(conflict['mine'])}")
+            col_mine, col_theirs = st.columns(2)
+            with col_mine:
+                if st.button("Keep My Version", key=f"conflict_keep_mine_{conflict['id']}_{index}"):
+                    st.session_state.write_conflicts = [
+                        c for c in st.session_state.write_conflicts if c is not conflict]
+                    keep_my_version(conflict)
+                    st.rerun()
+            with col_theirs:
+                if st.button("Keep Their Version", key=f"conflict_keep_theirs_{conflict['id']}_{index}"):
+                    st.session_state.write_conflicts = [
+                        c for c in st.session_state.write_conflicts if c is not conflict]
+                    st.rerun()
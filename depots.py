@@ -0,0 +1,123 @@
+# depots.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+import pandas as pd
+
+from config import (
+    GSHEETS_DEPOTS, DEFAULT_DEPOT_KEY, DEFAULT_DEPOT_NAME, GSHEETS_SPREADSHEET_NAME, SHARED_CACHE_PATH,
+    DEPOT_FAN_OUT_WORKERS
+)
+
+# Depot sharding: every depot (kitchen) has its own set of worksheets, so loads, saves, caches
+# and background jobs of one depot never touch another's trips. Code that works on "the"
+# trips asks for the current depot: the session's choice in the app, or the depot set with
+# depot_context on threads that have no session (background jobs, warm-up, fan-out). Reports
+# over several depots run one task per depot in parallel with fan_out and merge the results.
+
+
+@dataclass(frozen=True)
+class Depot:
+    """Where one depot's data lives.
+
+    Its worksheets are named like the [gsheets] ones plus `worksheet_suffix` ("" for the first
+    depot, so a single-depot setup keeps its sheet names); `shared_cache_path` is its SQLite cache.
+    """
+    key: str
+    name: str
+    spreadsheet_name: str
+    worksheet_suffix: str = ""
+    shared_cache_path: str = ""
+
+    def worksheet(self, base_name):
+        """Title of this depot's worksheet for a [gsheets] worksheet name, e.g. 'Full_route (East)'."""
+        return f"{base_name}{self.worksheet_suffix}"
+
+
+def _shared_cache_path(key):
+    """The first depot keeps SHARED_CACHE_PATH; the others get e.g. '.cache/shared_trips.east.sqlite3'."""
+    if not SHARED_CACHE_PATH:
+        return ""
+    root, extension = os.path.splitext(SHARED_CACHE_PATH)
+    return f"{root}.{key}{extension}"
+
+
+def configured_depots(tables):
+    """Builds {key: Depot} from the [gsheets.depots.<key>] secrets tables, the first depot first."""
+    depots = {DEFAULT_DEPOT_KEY: Depot(DEFAULT_DEPOT_KEY, DEFAULT_DEPOT_NAME, GSHEETS_SPREADSHEET_NAME,
+                                       "", SHARED_CACHE_PATH)}
+    for key, table in tables.items():
+        if key in depots:
+            continue  # The first depot is configured by the [gsheets] table itself
+        name = table.get("name", key)
+        depots[key] = Depot(key, name, table.get("spreadsheet_name", GSHEETS_SPREADSHEET_NAME),
+                            table.get("worksheet_suffix", f" ({name})"), _shared_cache_path(key))
+    return depots
+
+
+DEPOTS = configured_depots(GSHEETS_DEPOTS)
+DEFAULT_DEPOT = DEPOTS[DEFAULT_DEPOT_KEY]
+MULTI_DEPOT = len(DEPOTS) > 1
+
+# Depot of the code running on this thread when it has no session (None = ask the session)
+_active_depot = ContextVar("active_depot", default=None)
+
+
+def active_depot():
+    """The depot set with depot_context on this thread, or None."""
+    return _active_depot.get()
+
+
+@contextmanager
+def depot_context(depot):
+    """Runs the enclosed code for `depot`, whatever the session (if any) has chosen."""
+    token = _active_depot.set(depot)
+    try:
+        yield depot
+    finally:
+        _active_depot.reset(token)
+
+
+def fan_out(task, depots, max_workers=DEPOT_FAN_OUT_WORKERS):
+    """Runs task(depot) for every depot in parallel, each inside its depot_context.
+
+    Returns {depot key: result} in the order of `depots`. Tasks are mostly Sheets reads, so
+    threads are enough; if any task fails, the first failure is raised once all have finished.
+    """
+    def run(depot):
+        with depot_context(depot):
+            return task(depot)
+
+    depots = list(depots)
+    if len(depots) == 1:
+        return {depots[0].key: run(depots[0])}  # No pool for the usual single-depot case
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(depots))),
+                            thread_name_prefix="depot-fan-out") as pool:
+        futures = [(depot.key, pool.submit(run, depot)) for depot in depots]
+    return {key: future.result() for key, future in futures}
+
+
+def merge_depot_frames(frames):
+    """Concatenates per-depot DataFrames ({depot key: frame}) with a leading Depot column.
+
+    A single depot's frame is returned unchanged, so single-depot output keeps its columns.
+    """
+    if len(frames) == 1:
+        return next(iter(frames.values()))
+    merged = []
+    for key, frame in frames.items():
+        frame = frame.copy()
+        frame.insert(0, "Depot", DEPOTS[key].name)
+        merged.append(frame)
+    return pd.concat(merged, ignore_index=True)
+
+
+def merge_depot_trips(trips_by_depot):
+    """Concatenates per-depot trip lists; with several depots each trip is copied with a "Depot" field."""
+    if len(trips_by_depot) == 1:
+        return list(next(iter(trips_by_depot.values())))
+    return [dict(trip, Depot=DEPOTS[key].name) for key, trips in trips_by_depot.items() for trip in trips]
@@ -0,0 +1,629 @@
+# differential.py
+
+import math
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+import storage
+from audit import ISSUE_SEVERITY, audit_trips
+from config import AUDIT_MAX_DATE_GAP_DAYS, FLEET_CHANGE_ROUTE, GSHEETS_TRIPS_COLUMNS, STORE_REGION_MAPPING
+from odometer_index import compute_odometer_summary
+from trip_core import latest_end_km, monthly_vehicle_summary
+from trip_query import TripQuery, TripTable
+
+# Differential checks for the optimized trip computations. Each check runs the code the app
+# uses (the columnar TripTable, the one-pass latest End KM, the odometer summary, the
+# vectorized audit and monthly summary, the bulk sheet decoder and the chunked loader) against
+# an oracle written independently of it: the reference_* functions below are either frozen
+# copies of the original implementations (the loops the app started with) or plain
+# trip-by-trip statements of the same rules. They are not used by the app and must not be
+# "improved". Each check generates randomized trip histories (backdated entries, trips moved
+# between vehicles, missing or text KM values, fleet change rows, bad dates, or raw sheet cells)
+# and asserts that both sides return the same result, recording how long each side took.
+#
+# Run it with python cli.py verify-engines. Every history is generated from "<seed>:<index>",
+# so a reported mismatch can be reproduced from its seed and history number.
+
+DIFF_VEHICLES = ["A", "B", "C", "D"]
+DIFF_DRIVERS = ["Georgekutty", "Cliffy", "Adwaith", "Aliyas"]
+DIFF_STORES = sorted(store for stores in STORE_REGION_MAPPING.values() for store in stores)
+DIFF_FIRST_DATE = date(2024, 1, 1)
+
+DIFF_REPORT_COLUMNS = ["Check", "Profile", "Histories", "Cases", "Errors", "Skipped", "Mismatches",
+                       "Reference s", "Engine s", "Speedup"]
+
+# --- Reference oracles (original implementations; do not optimize) ---
+# reference_accumulated_km and reference_period_accumulator have no check yet: the app still runs
+# those original loops (trip_core.accumulated_km and period_accumulated_km), and comparing a
+# function with a copy of itself proves nothing. A faster version gets a Check against them.
+
+
+def reference_accumulated_km(trips, vehicle):
+    """Original recalculate_accumulated_km: [(trip id, Accumulated KM)] in the order assigned."""
+    vehicle_trips = [trip for trip in trips if trip.get("Vehicle") == vehicle]
+    if not vehicle_trips:
+        return []
+    trips_sorted = sorted(vehicle_trips, key=lambda x: datetime.strptime(x["Date"], '%Y-%m-%d'))
+    total_km = 0
+    result = []
+    for trip in trips_sorted:
+        start_km = trip.get("Start KM", 0)
+        end_km = trip.get("End KM", 0)
+        total_km += end_km - start_km
+        result.append((trip.get("id"), total_km))
+    return result
+
+
+def reference_filter_trips(trips, start_date, end_date, vehicle):
+    """Original filter_trips."""
+    filtered = [
+        trip for trip in trips
+        if datetime.strptime(trip["Date"], '%Y-%m-%d').date() >= start_date and
+        datetime.strptime(trip["Date"], '%Y-%m-%d').date() <= end_date
+    ]
+    if vehicle != "All":
+        filtered = [trip for trip in filtered if trip["Vehicle"] == vehicle]
+    return filtered
+
+
+def reference_latest_end_km(trips, vehicle):
+    """Original get_latest_end_km of the Add Trip tab, on a trip list instead of session state."""
+    if not vehicle or not trips:
+        return 0
+    valid_trips = [trip for trip in trips if isinstance(trip.get("Date"), str) and trip.get("Date")]
+    parsed_trips = []
+    for trip in valid_trips:
+        try:
+            datetime.strptime(trip["Date"], '%Y-%m-%d')
+            parsed_trips.append(trip)
+        except ValueError:
+            pass
+    sorted_trips = sorted(parsed_trips, key=lambda x: datetime.strptime(x["Date"], '%Y-%m-%d'), reverse=True)
+    latest_trip_for_vehicle = None
+    for trip in sorted_trips:
+        if trip.get("Vehicle") == vehicle:
+            latest_trip_for_vehicle = trip
+            break
+    if latest_trip_for_vehicle:
+        end_km = latest_trip_for_vehicle.get("End KM", 0)
+        try:
+            if pd.notna(end_km):
+                end_km_str = str(end_km).strip()
+                if end_km_str.replace('.', '', 1).isdigit():
+                    return int(float(end_km_str))
+                return 0
+            return 0
+        except (ValueError, TypeError):
+            return 0
+    return 0
+
+
+def reference_period_accumulator(trips):
+    """Original "Accumulated KM (Filtered)" loop of View Records: {trip id: KM so far}."""
+    trips_for_calc = sorted(
+        trips,
+        key=lambda x: (
+            x.get('Vehicle', ''),
+            datetime.strptime(x.get('Date', '1900-01-01'), '%Y-%m-%d') if x.get('Date') else datetime.min
+        )
+    )
+    vehicle_last_filtered_accum_km = {}
+    trip_id_to_filtered_accum_km = {}
+    for trip in trips_for_calc:
+        trip_id = trip.get("id")
+        if not trip_id:
+            continue
+        vehicle = trip.get("Vehicle")
+        start_km_val = trip.get("Start KM", 0)
+        end_km_val = trip.get("End KM", 0)
+        try:
+            current_start_km = int(float(start_km_val)) if pd.notna(
+                start_km_val) and str(start_km_val).replace('.', '', 1).isdigit() else 0
+            current_end_km = int(float(end_km_val)) if pd.notna(
+                end_km_val) and str(end_km_val).replace('.', '', 1).isdigit() else 0
+        except (ValueError, TypeError):
+            current_start_km = 0
+            current_end_km = 0
+        daily_km_delta = current_end_km - current_start_km
+        if vehicle not in vehicle_last_filtered_accum_km:
+            trip_filtered_accum_km = daily_km_delta
+        else:
+            trip_filtered_accum_km = vehicle_last_filtered_accum_km[vehicle] + daily_km_delta
+        vehicle_last_filtered_accum_km[vehicle] = trip_filtered_accum_km
+        trip_id_to_filtered_accum_km[trip_id] = trip_filtered_accum_km
+    return trip_id_to_filtered_accum_km
+
+
+def reference_store_counts(trips, start_date, end_date):
+    """Original store count loop of View Records: {store: visits} over a date range."""
+    store_counts = {}
+    for trip in reference_filter_trips(trips, start_date, end_date, "All"):
+        route_string = trip.get("Route", "")
+        for store in [store.strip() for store in route_string.split(',') if store.strip()]:
+            store_counts[store] = store_counts.get(store, 0) + 1
+    return store_counts
+
+# --- Rule oracles (trip-by-trip statements of what the vectorized code computes) ---
+
+# Stands in for the id of a trip whose id cell was blank: the loader makes up a random one
+GENERATED_ID = "<generated id>"
+
+
+def _strict_date(value):
+    """A YYYY-MM-DD string as a date, or None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _number(value):
+    """A KM value as float, or None if it is missing or not a number."""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value != value:
+        return None
+    return float(value)
+
+
+def _route_stores(route):
+    return len([store for store in str(route or "").split(",") if store.strip()])
+
+
+def reference_odometer_summary(trips, vehicles):
+    """Each vehicle's trip with the latest (date, End KM), the first such trip in sheet order.
+
+    Fleet change rows and trips without a valid date or End KM do not count. Values are
+    {vehicle: (End KM, date, trip id, Accumulated KM)} with whole-number KM.
+    """
+    latest = {}
+    for position, trip in enumerate(trips):
+        vehicle = trip.get("Vehicle")
+        day, end_km = _strict_date(trip.get("Date")), _number(trip.get("End KM"))
+        if vehicle not in vehicles or trip.get("Route") == FLEET_CHANGE_ROUTE or day is None or end_km is None:
+            continue
+        key = (day, int(end_km), -position)
+        if vehicle not in latest or key > latest[vehicle][0]:
+            latest[vehicle] = (key, trip)
+    summary = {}
+    for vehicle, ((_, end_km, _), trip) in latest.items():
+        accumulated = _number(trip.get("Accumulated KM"))
+        summary[vehicle] = (end_km, trip["Date"], trip.get("id"), None if accumulated is None else int(accumulated))
+    return summary
+
+
+def reference_monthly_summary(trips):
+    """Per (month, vehicle) trip count, KM driven, first Start KM, last End KM and store visits.
+
+    Trips are taken per vehicle in (date, Start KM, sheet order) order; fleet change rows and
+    trips without a valid date or KM values are left out. Rows are sorted by month, then vehicle.
+    """
+    kept = []
+    for position, trip in enumerate(trips):
+        day, start_km, end_km = (_strict_date(trip.get("Date")), _number(trip.get("Start KM")),
+                                 _number(trip.get("End KM")))
+        if trip.get("Route") != FLEET_CHANGE_ROUTE and None not in (day, start_km, end_km):
+            kept.append((trip.get("Vehicle"), day, start_km, position, end_km, trip.get("Route")))
+    months = {}
+    for vehicle, day, start_km, _, end_km, route in sorted(kept, key=lambda entry: entry[:4]):
+        key = (day.strftime('%Y-%m'), vehicle)
+        if key not in months:
+            months[key] = [0, 0.0, start_km, end_km, 0]
+        month = months[key]
+        month[0] += 1
+        month[1] += end_km - start_km
+        month[3] = end_km
+        month[4] += _route_stores(route)
+    return [(month, vehicle, count, int(total), int(first), int(last), stores)
+            for (month, vehicle), (count, total, first, last, stores) in sorted(months.items())]
+
+
+def reference_audit(trips, max_date_gap_days=AUDIT_MAX_DATE_GAP_DAYS):
+    """The audit rules checked trip by trip, in no particular order.
+
+    Returns [(Issue, Vehicle, Date, Trip ID, Related Trip ID, KM Difference)]. Each vehicle's
+    valid trips are walked in (date, Start KM, sheet order) order and compared with the previous
+    one; backdated entries are found by walking them in sheet order.
+    """
+    found, valid = [], []
+    for position, trip in enumerate(trips):
+        if trip.get("Route") == FLEET_CHANGE_ROUTE:
+            continue
+        row = (trip.get("Vehicle"), trip.get("Date"), trip.get("id"))
+        day, start_km, end_km = (_strict_date(trip.get("Date")), _number(trip.get("Start KM")),
+                                 _number(trip.get("End KM")))
+        if day is None:
+            found.append(("Invalid Date",) + row + (None, None))
+        elif start_km is None or end_km is None or end_km < start_km:
+            difference = None if start_km is None or end_km is None else end_km - start_km
+            found.append(("Invalid KM",) + row + (None, difference))
+        else:
+            valid.append((trip.get("Vehicle"), day, start_km, position, end_km, row))
+
+    previous, seen_trips, seen_days = {}, set(), set()
+    for vehicle, day, start_km, _, end_km, row in sorted(valid, key=lambda entry: entry[:4]):
+        duplicate = (vehicle, day, start_km, end_km) in seen_trips
+        if vehicle in previous:
+            previous_day, previous_end_km, previous_id = previous[vehicle]
+            if duplicate:
+                found.append(("Duplicate Trip",) + row + (previous_id, None))
+            if start_km > previous_end_km:
+                found.append(("Odometer Gap",) + row + (previous_id, start_km - previous_end_km))
+            if start_km < previous_end_km and not duplicate:
+                found.append(("Odometer Overlap",) + row + (previous_id, start_km - previous_end_km))
+            if (vehicle, day) in seen_days and not duplicate:
+                found.append(("Same-Day Trips",) + row + (previous_id, None))
+            if (day - previous_day).days > max_date_gap_days:
+                found.append(("Date Gap",) + row + (previous_id, None))
+        previous[vehicle] = (day, end_km, row[2])
+        seen_trips.add((vehicle, day, start_km, end_km))
+        seen_days.add((vehicle, day))
+
+    latest_day = {}
+    for vehicle, day, _, _, _, row in valid:
+        if vehicle in latest_day and day < latest_day[vehicle]:
+            found.append(("Backdated Entry",) + row + (None, None))
+        latest_day[vehicle] = max(day, latest_day.get(vehicle, day))
+    return found
+
+
+def reference_decode_rows(values):
+    """Unformatted trips-sheet values (header row first) decoded cell by cell into trip dicts.
+
+    Serial dates become YYYY-MM-DD, KM text that reads as a finite number (commas allowed)
+    becomes int (or float if it has a fraction), missing columns are None and a blank id is
+    GENERATED_ID.
+    """
+    header, trips = values[0], []
+    for row in values[1:]:
+        trip = {column: None for column in GSHEETS_TRIPS_COLUMNS}
+        for position, key in enumerate(header):
+            value = row[position] if position < len(row) else ""
+            if key == "Date" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = (date(1899, 12, 30) + timedelta(days=math.floor(value))).strftime('%Y-%m-%d')
+            elif key in ("Start KM", "End KM", "Accumulated KM") and isinstance(value, str):
+                number = _number(value.replace(",", ""))
+                if number is not None and math.isfinite(number):
+                    value = int(number) if number.is_integer() else number
+            trip[key] = value
+        if trip["id"] in (None, ""):
+            trip["id"] = GENERATED_ID
+        trips.append(trip)
+    return trips
+
+# --- Randomized trip histories ---
+
+# Irregularities a "messy" history may contain; each history picks a random subset, so a
+# single bad value does not push every case of a check outside the oracle's domain
+MESSY_FEATURES = ["text_km", "missing_km", "fleet_changes", "bad_dates", "missing_routes", "duplicates"]
+
+
+def random_trip_history(rng, size, profile="messy"):
+    """A random trip list in sheet order.
+
+    Every profile has up to four vehicles with odometer chains, gaps and backdated entries (a trip
+    appended after later-dated ones). The "messy" profile adds same-day trips, trips moved to
+    another vehicle and a random subset of MESSY_FEATURES. The "clean" profile has whole-number
+    KM, valid dates and at most one trip per vehicle and day.
+    """
+    features = {feature for feature in MESSY_FEATURES if rng.random() < 0.3} if profile == "messy" else set()
+    vehicles = DIFF_VEHICLES[:rng.randint(1, len(DIFF_VEHICLES))]
+    odometer = {vehicle: rng.randint(0, 50000) for vehicle in vehicles}
+    day = {vehicle: rng.randint(0, 30) for vehicle in vehicles}
+    trips, backdated = [], []
+    for number in range(size):
+        vehicle = rng.choice(vehicles)
+        if profile == "clean" or rng.random() < 0.7:
+            day[vehicle] += rng.randint(1, 3)  # Otherwise a second trip on the same day
+        if rng.random() < 0.05:
+            odometer[vehicle] += rng.randint(1, 500)  # Gap in the chain
+        start_km = odometer[vehicle]
+        end_km = start_km + rng.randint(0, 400)
+        odometer[vehicle] = end_km
+        trip = {
+            "id": f"t{number}",
+            "Date": (DIFF_FIRST_DATE + timedelta(days=day[vehicle])).strftime('%Y-%m-%d'),
+            "Vehicle": vehicle,
+            "Start KM": start_km,
+            "End KM": end_km,
+            "Accumulated KM": rng.randint(0, 100000),  # Usually stale, as after an edit
+            "Driver": rng.choice(DIFF_DRIVERS),
+            "Route": ", ".join(rng.sample(DIFF_STORES, rng.randint(1, 4))),
+            "Remarks": "",
+        }
+        if profile != "clean" and rng.random() < 0.03 and len(vehicles) > 1:
+            trip["Vehicle"] = rng.choice([other for other in vehicles if other != vehicle])  # Moved
+        if "fleet_changes" in features and rng.random() < 0.02:
+            trip.update({"Start KM": 0, "End KM": 0, "Accumulated KM": 0, "Driver": "N/A",
+                         "Route": FLEET_CHANGE_ROUTE})
+        if "text_km" in features and rng.random() < 0.05:
+            key = rng.choice(["Start KM", "End KM"])
+            trip[key] = rng.choice([str(trip[key]), f" {trip[key]} ", float(trip[key]), trip[key] + 0.5])
+        if "missing_km" in features and rng.random() < 0.02:
+            trip[rng.choice(["Start KM", "End KM"])] = rng.choice([None, "", "n/a", float("nan")])
+        if "bad_dates" in features and rng.random() < 0.01:
+            trip["Date"] = rng.choice(["", None, "2024-13-01", "01/02/2024"])
+        if "missing_routes" in features and rng.random() < 0.01:
+            trip["Route"] = rng.choice([None, "", " , "])
+        if rng.random() < 0.05:
+            backdated.append(trip)  # Entered later than the trips after it
+        else:
+            trips.append(trip)
+        if "duplicates" in features and rng.random() < 0.1:
+            trips.append(dict(trip, id=f"t{number}-copy"))  # Submitted twice
+        if backdated and rng.random() < 0.1:
+            trips.append(backdated.pop(0))
+    return trips + backdated
+
+
+
+def random_sheet_values(rng, size):
+    """A messy history as an unformatted read of the trips sheet returns it: header row first.
+
+    Real dates arrive as serial numbers (some with a time of day) unless the cell holds text, and
+    KM cells are numbers or some of: plain, comma-formatted ("1,234") or padded text, and blank. Some
+    ids are blank, some sheets lack a column, and trailing empty cells are left off each row.
+    """
+    header = [column for column in GSHEETS_TRIPS_COLUMNS
+              if column not in ("id", "Accumulated KM") or rng.random() < 0.9]
+    # Each sheet uses a random subset of the text forms, so some have only whole-number text
+    km_forms = [form for form in (str, "{:,}".format, " {} ".format, lambda km: "") if rng.random() < 0.5]
+    values = [header]
+    for trip in random_trip_history(rng, size, "messy"):
+        row = []
+        for column in header:
+            value = trip.get(column)
+            if column == "Date" and _strict_date(value) and rng.random() < 0.9:
+                value = (_strict_date(value) - date(1899, 12, 30)).days + rng.choice([0, 0, 0.25, 0.75])
+            elif column in ("Start KM", "End KM", "Accumulated KM") and isinstance(value, int):
+                value = rng.choice(km_forms)(value) if km_forms and rng.random() < 0.3 else value
+            elif column == "id" and rng.random() < 0.05:
+                value = ""
+            row.append("" if value is None or value != value else value)
+        while row and row[-1] == "":
+            row.pop()
+        values.append(row)
+    return values
+
+
+def _history(rng, size, profile):
+    return random_sheet_values(rng, size) if profile == "sheet" else random_trip_history(rng, size, profile)
+
+def _random_range(rng):
+    """A random inclusive date range over the generated dates; sometimes empty or reversed."""
+    start = DIFF_FIRST_DATE + timedelta(days=rng.randint(-10, 400))
+    end = start + timedelta(days=rng.randint(-5, 300))
+    return start, end
+
+
+def _vehicle_cases(rng, trips):
+    return [(vehicle,) for vehicle in DIFF_VEHICLES + ["Z"]]
+
+
+def _range_cases(rng, trips):
+    return [_random_range(rng) + (rng.choice(DIFF_VEHICLES + ["All", "All", "Z"]),) for _ in range(8)]
+
+
+def _store_count_cases(rng, trips):
+    return [_random_range(rng) for _ in range(8)]
+
+
+def _summary_cases(rng, trips):
+    return [(DIFF_VEHICLES,), (rng.sample(DIFF_VEHICLES, rng.randint(1, len(DIFF_VEHICLES))),)]
+
+
+def _chunk_cases(rng, values):
+    return [(rng.choice([7, 50, 100]),), (rng.randint(len(values), len(values) + 10),)]
+
+# --- Engines under test, adapted to the oracles' signatures ---
+
+
+def _table_query(start_date, end_date, vehicle):
+    return TripQuery(start_date=start_date, end_date=end_date,
+                     vehicles=None if vehicle == "All" else (vehicle,))
+
+
+def _engine_table_filter(table, start_date, end_date, vehicle):
+    return [table.trips[i] for i in table.select(_table_query(start_date, end_date, vehicle))]
+
+
+def _engine_table_store_counts(table, start_date, end_date):
+    counts = table.store_counts(table.select(_table_query(start_date, end_date, "All")))
+    if any(later[1] > earlier[1] for earlier, later in zip(counts, counts[1:])):
+        raise AssertionError("store counts are not sorted by count")
+    return dict(counts)
+
+
+def _engine_summary_latest_end_km(summary, vehicle):
+    latest = summary.get(vehicle)
+    return latest[0] if latest else 0
+
+
+def _engine_monthly_summary(trips):
+    return list(monthly_vehicle_summary(trips).itertuples(index=False, name=None))
+
+
+AUDIT_COMPARED_COLUMNS = ["Issue", "Vehicle", "Date", "Trip ID", "Related Trip ID", "KM Difference"]
+
+
+def _engine_audit(trips):
+    report = audit_trips(trips)
+    order = list(zip(report["Issue"].map(lambda issue: ISSUE_SEVERITY[issue][1]),
+                     -pd.to_numeric(report["KM Difference"], errors='coerce').abs().fillna(0)))
+    if order != sorted(order) or list(report["Rank"]) != list(range(1, len(report) + 1)):
+        raise AssertionError("the audit report is not ranked by severity, then KM difference")
+    return list(report[AUDIT_COMPARED_COLUMNS].itertuples(index=False, name=None))
+
+
+def _generated_ids(values, trips):
+    """Checks the ids made up for blank id cells (distinct and non-empty) and replaces them with GENERATED_ID."""
+    header, rows = values[0], values[1:]
+    position = header.index("id") if "id" in header else None
+    blank = [position is None or position >= len(row) or row[position] == "" for row in rows]
+    made_up = [trip["id"] for trip, is_blank in zip(trips, blank) if is_blank]
+    if not all(isinstance(trip_id, str) and trip_id for trip_id in made_up) or len(set(made_up)) < len(made_up):
+        raise AssertionError("generated trip ids are empty or repeated")
+    return [dict(trip, id=GENERATED_ID) if is_blank else trip for trip, is_blank in zip(trips, blank)]
+
+
+def _engine_decode(values):
+    return _generated_ids(values, storage.decode_trip_rows(values[0], values[1:]))
+
+
+class _SheetValues:
+    """Serves row ranges ("first:last") of fixed values, like an unformatted worksheet read."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, range_name, **kwargs):
+        first, last = (int(number) for number in range_name.split(":"))
+        return [list(row) for row in self.values[first - 1:last]]
+
+
+def _engine_read_trips(values, chunk_rows):
+    return _generated_ids(values, storage.read_trips(_SheetValues(values), chunk_rows))
+
+
+def _trip_ids(trips):
+    return [trip.get("id") for trip in trips]
+
+
+def _unordered(rows):
+    """Rows compared as a multiset, with missing values (None or NaN) alike and numbers as floats."""
+    def plain(value):
+        if value is None or (isinstance(value, float) and value != value):
+            return None
+        return float(value) if isinstance(value, float) else value
+    return sorted((tuple(plain(value) for value in row) for row in rows), key=repr)
+
+
+class Check:
+    """One oracle/engine pair.
+
+    `cases(rng, trips)` gives the argument tuples to try on a history. `prepare(trips)` builds
+    what the engine works on (timed on the engine side, once per history); by default the
+    engine gets the trips. Where the oracle raises, the engine has to raise the same exception
+    type (counted under Errors); with `lenient` those cases are skipped instead, because the
+    engine deliberately accepts input the original did not.
+    """
+
+    def __init__(self, name, reference, engine, cases, prepare=None, profile="messy", lenient=False,
+                 normalize=None):
+        self.name = name
+        self.reference = reference
+        self.engine = engine
+        self.cases = cases
+        self.prepare = prepare
+        self.profile = profile
+        self.lenient = lenient
+        self.normalize = normalize or (lambda value: value)
+
+
+CHECKS = [
+    # TripTable never matches trips without a valid date, where the original raised
+    Check("TripQuery date and vehicle filter", reference_filter_trips, _engine_table_filter, _range_cases,
+          prepare=TripTable, lenient=True, normalize=_trip_ids),
+    # Same date handling as the TripQuery filter; a trip without a route is simply not counted
+    Check("Store counts", reference_store_counts, _engine_table_store_counts, _store_count_cases,
+          prepare=TripTable, lenient=True),
+    Check("Latest End KM", reference_latest_end_km, latest_end_km, _vehicle_cases),
+    # The odometer summary deliberately skips fleet change rows and unreadable End KM, and
+    # breaks same-day ties by End KM, so it is compared with the original on histories where
+    # those cannot arise, and with its own rules on every history
+    Check("Odometer summary latest End KM", reference_latest_end_km, _engine_summary_latest_end_km,
+          _vehicle_cases, prepare=lambda trips: compute_odometer_summary(trips, DIFF_VEHICLES),
+          profile="clean"),
+    Check("Odometer summary", reference_odometer_summary, compute_odometer_summary, _summary_cases),
+    Check("Monthly summary", reference_monthly_summary, _engine_monthly_summary, lambda rng, trips: [()]),
+    Check("Audit", reference_audit, _engine_audit, lambda rng, trips: [()], normalize=_unordered),
+    Check("Sheet row decode", reference_decode_rows, _engine_decode, lambda rng, values: [()], profile="sheet"),
+    Check("Chunked trip loader", lambda values, chunk_rows: reference_decode_rows(values), _engine_read_trips,
+          _chunk_cases, profile="sheet"),
+]
+
+
+def _outcome(function, *args):
+    """("ok", result) or ("error", exception type name), with the time it took."""
+    started = time.perf_counter()
+    try:
+        result = ("ok", function(*args))
+    except Exception as e:
+        result = ("error", type(e).__name__)
+    return result, time.perf_counter() - started
+
+
+def _canonical(value):
+    """A comparable form of a result: NaN (which is never equal to itself) becomes a marker."""
+    if isinstance(value, float) and value != value:
+        return "NaN"
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    return value
+
+
+def _short(value, limit=300):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def run_check(check, histories, size, seed):
+    """Runs one check over `histories` random histories; returns (report row, mismatches)."""
+    row = {"Check": check.name, "Profile": check.profile, "Histories": histories, "Cases": 0,
+           "Errors": 0, "Skipped": 0, "Mismatches": 0, "Reference s": 0.0, "Engine s": 0.0}
+    mismatches = []
+    for index in range(histories):
+        rng = random.Random(f"{seed}:{index}")
+        trips = _history(rng, size, check.profile)
+        subject = trips
+        if check.prepare is not None:
+            started = time.perf_counter()
+            subject = check.prepare(trips)
+            row["Engine s"] += time.perf_counter() - started
+        for args in check.cases(rng, trips):
+            expected, reference_seconds = _outcome(check.reference, trips, *args)
+            actual, engine_seconds = _outcome(check.engine, subject, *args)
+            row["Cases"] += 1
+            row["Reference s"] += reference_seconds
+            row["Engine s"] += engine_seconds
+            if expected[0] == "error":
+                if check.lenient:
+                    row["Skipped"] += 1
+                    continue
+                row["Errors"] += 1  # The engine must raise the same exception
+            if expected[0] == "ok":
+                expected = ("ok", _canonical(check.normalize(expected[1])))
+            if actual[0] == "ok":
+                actual = ("ok", _canonical(check.normalize(actual[1])))
+            if expected != actual:
+                row["Mismatches"] += 1
+                mismatches.append({"Check": check.name, "Seed": f"{seed}:{index}",
+                                   "Arguments": _short(args), "Expected": _short(expected),
+                                   "Actual": _short(actual)})
+    row["Speedup"] = round(row["Reference s"] / row["Engine s"], 2) if row["Engine s"] else None
+    row["Reference s"] = round(row["Reference s"], 4)
+    row["Engine s"] = round(row["Engine s"], 4)
+    return row, mismatches
+
+
+def run_differential(histories=20, size=500, seed=0, names=None):
+    """Runs every check (or those named) and returns (report DataFrame, mismatches DataFrame)."""
+    rows, mismatches = [], []
+    for check in CHECKS:
+        if names and check.name not in names:
+            continue
+        row, found = run_check(check, histories, size, seed)
+        rows.append(row)
+        mismatches.extend(found)
+    return (pd.DataFrame(rows, columns=DIFF_REPORT_COLUMNS),
+            pd.DataFrame(mismatches, columns=["Check", "Seed", "Arguments", "Expected", "Actual"]))
@@ -0,0 +1,130 @@
+# exports.py
+
+import io
+import gzip
+import streamlit as st
+import pandas as pd
+
+from config import EXPORT_CHUNK_ROWS, EXPORT_CACHE_MAX_ENTRIES
+from plate_history import stamp_trip_plates
+
+# --- Export Formats ---
+# Label shown in the UI -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+# Columns that hold kilometre readings; typed as numbers in Parquet exports
+NUMERIC_EXPORT_COLUMNS = ["Start KM", "End KM",
+                          "Accumulated KM", "Accumulated KM (Filtered)"]
+
+
+def iter_export_frames(rows, columns, chunk_rows=EXPORT_CHUNK_ROWS, plate_timeline=None):
+    """Yields DataFrames of at most `chunk_rows` trips so large ranges are encoded piece by piece.
+
+    With a plate timeline, each chunk's "License Plate at Trip Time" is taken from the plate history.
+    """
+    if not rows:
+        yield pd.DataFrame(columns=columns)
+        return
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        if plate_timeline is not None:
+            chunk = stamp_trip_plates([dict(row) for row in chunk], plate_timeline)
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def _write_csv_chunks(frames, stream):
+    """Writes CSV chunks to a binary stream, emitting the header only once."""
+    for i, frame in enumerate(frames):
+        stream.write(frame.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+
+
+def encode_csv(frames):
+    """Encodes an iterable of DataFrames as plain CSV bytes."""
+    buffer = io.BytesIO()
+    _write_csv_chunks(frames, buffer)
+    return buffer.getvalue()
+
+
+def encode_csv_gzip(frames):
+    """Encodes an iterable of DataFrames as gzip-compressed CSV bytes."""
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as gz:
+        _write_csv_chunks(frames, gz)
+    return buffer.getvalue()
+
+
+def _normalize_for_parquet(frame):
+    """Gives every chunk the same column types so they share one Parquet schema."""
+    frame = frame.copy()
+    for col in frame.columns:
+        if col in NUMERIC_EXPORT_COLUMNS:
+            frame[col] = pd.to_numeric(
+                frame[col], errors='coerce').astype('float64')
+        else:
+            frame[col] = frame[col].map(
+                lambda v: None if v is None or (isinstance(v, float) and pd.isna(v)) else str(v)
+            ).astype('object')
+    return frame
+
+
+def encode_parquet(frames):
+    """Encodes an iterable of DataFrames as Parquet bytes, one row group per chunk."""
+    import pyarrow as pa  # pyarrow ships with Streamlit
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    writer = None
+    try:
+        for frame in frames:
+            table = pa.Table.from_pandas(
+                _normalize_for_parquet(frame), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return buffer.getvalue()
+
+
+ENCODERS = {
+    "CSV": encode_csv,
+    "CSV (gzip)": encode_csv_gzip,
+    "Parquet": encode_parquet,
+}
+
+
+# --- Cached Export Builders ---
+# The leading underscore on `_rows` tells Streamlit not to hash the trip list;
+# the cache key is the data version plus the filter parameters instead.
+
+@st.cache_data(max_entries=EXPORT_CACHE_MAX_ENTRIES, show_spinner=False)
+def build_trip_export(data_version, export_name, export_format, filter_params, columns, _rows,
+                      _plate_timeline=None):
+    """Encodes trip rows in the requested format. Cached per (data version, export, format, filters)."""
+    frames = iter_export_frames(_rows, list(columns), plate_timeline=_plate_timeline)
+    return ENCODERS[export_format](frames)
+
+
+def lazy_trip_export(data_version, export_name, export_format, filter_params, columns, rows,
+                     plate_timeline=None):
+    """Returns a zero-argument callable for st.download_button so the file is only built when clicked."""
+    def _build():
+        return build_trip_export(data_version, export_name, export_format,
+                                 filter_params, tuple(columns), rows, plate_timeline)
+    return _build
+
+
+def export_file_name(base_name, export_format):
+    """Returns the download file name for a base name and export format."""
+    return base_name + EXPORT_FORMATS[export_format][0]
+
+
+def export_mime(export_format):
+    """Returns the MIME type for an export format."""
+    return EXPORT_FORMATS[export_format][1]
+
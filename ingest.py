@@ -0,0 +1,418 @@
+# ingest.py
+
+import hmac
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    GSHEETS_TRIPS_WORKSHEET_NAME, GSHEETS_META_WORKSHEET_NAME, GSHEETS_JOURNAL_WORKSHEET_NAME,
+    GSHEETS_ODOMETER_WORKSHEET_NAME, GSHEETS_VEHICLES_WORKSHEET_NAME, GSHEETS_CATALOG_WORKSHEET_NAME,
+    GSHEETS_CATALOG_COLUMNS, GSHEETS_PLATE_HISTORY_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_COLUMNS,
+    INGEST_BATCH_WINDOW_SECONDS, INGEST_MAX_BATCH, INGEST_MAX_BODY_BYTES,
+    INGEST_REFERENCE_REFRESH_SECONDS
+)
+import storage
+from depots import DEFAULT_DEPOT
+from odometer_index import ODOMETER_INDEX_COLUMNS
+from plate_history import build_plate_timeline
+from route_distance import check_route_distance
+from submission_log import SubmissionLog
+from trip_sync import JOURNAL_COLUMNS
+from trip_validation import basic_trip_errors
+
+# Trip ingestion over HTTP: POST /trips with one trip object, a list of them, or {"trips": [...]}.
+# Request threads only parse JSON and wait; one writer thread takes everything queued within
+# INGEST_BATCH_WINDOW_SECONDS, validates it in arrival order against the latest odometer
+# summary (the same rules as the Add Trip form) and writes all accepted trips with one append,
+# one journal entry and an update of those vehicles' summary rows. Each request gets a result
+# per trip. A client may send an Idempotency-Key header; retrying a request with the same key
+# returns the first response instead of writing the trips again. If the trips were appended but
+# the journal or summary update failed, they are reported as "partial" (with their ids) and the
+# key is kept, so a retry cannot append them twice.
+
+# Fields read from each posted trip; Route may be a list of stores or a comma-separated string
+INGEST_FIELDS = ["Date", "Vehicle", "Start KM", "End KM", "Driver", "Route", "Remarks"]
+
+
+def _as_int(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(number):  # "nan" and "inf" parse as floats but are not KM readings
+        return None
+    return int(number) if number == int(number) else None
+
+
+def parse_item(item, catalog):
+    """Checks one posted trip's fields; returns (fields, errors)."""
+    if not isinstance(item, dict):
+        return None, ["Each trip must be a JSON object."]
+    errors = []
+    date_str = str(item.get("Date") or "").strip()
+    try:
+        datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError:
+        errors.append("Date must be YYYY-MM-DD.")
+    start_km, end_km = _as_int(item.get("Start KM")), _as_int(item.get("End KM"))
+    if start_km is None or end_km is None:
+        errors.append("Start KM and End KM must be whole numbers.")
+        start_km, end_km = start_km or 0, end_km or 0
+    route = item.get("Route") or []
+    if isinstance(route, str):
+        route = route.split(",")
+    route_list = [str(store).strip() for store in route if str(store).strip()]
+    vehicle = str(item.get("Vehicle") or "").strip()
+    driver = str(item.get("Driver") or "").strip()
+
+    errors += basic_trip_errors(vehicle, driver, start_km, end_km, route_list)
+    if vehicle and vehicle not in catalog.vehicles:
+        errors.append(f"Unknown vehicle '{vehicle}'.")
+    if driver and driver not in catalog.drivers:
+        errors.append(f"Unknown driver '{driver}'.")
+    unknown = [store for store in route_list if store not in catalog.store_region]
+    if unknown:
+        errors.append(f"Unknown store(s): {', '.join(unknown)}.")
+    fields = {"Date": date_str, "Vehicle": vehicle, "Start KM": start_km, "End KM": end_km,
+              "Driver": driver, "Route": route_list, "Remarks": str(item.get("Remarks") or "")}
+    return fields, errors
+
+
+def check_against_latest(fields, latest):
+    """Odometer continuity against the vehicle's latest trip; returns (errors, warnings)."""
+    errors, warnings = [], []
+    latest_end_km, latest_date = (latest[0], latest[1]) if latest else (None, "")
+    if latest_end_km is not None and latest_end_km > 0 and fields["Start KM"] != latest_end_km:
+        errors.append(f"Start KM ({fields['Start KM']}) must match the latest recorded End KM "
+                      f"({latest_end_km}) for {fields['Vehicle']}.")
+    if latest_end_km is not None and latest_date and fields["Date"] < latest_date:
+        # Would shift the Accumulated KM of later trips, which needs the full history (use the app)
+        errors.append(f"Date is before {fields['Vehicle']}'s latest trip ({latest_date}).")
+    previous_day = (datetime.strptime(fields["Date"], '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+    if latest_date and latest_date < previous_day:
+        warnings.append(f"Previous day ({previous_day}) has not been filled for Vehicle {fields['Vehicle']}.")
+    distance_warning = check_route_distance(fields["Route"], fields["Start KM"], fields["End KM"])
+    if distance_warning:
+        warnings.append(distance_warning)
+    return errors, warnings
+
+
+class IngestState:
+    """What validation needs: catalog, plate timeline and {vehicle: latest odometer entry}."""
+
+    def __init__(self, catalog, plate_timeline, odometer):
+        self.catalog = catalog
+        self.plate_timeline = plate_timeline
+        self.odometer = odometer
+
+
+class SheetsIngestBackend:
+    """Reads validation state from and writes accepted trips to one depot's worksheets."""
+
+    def __init__(self, spreadsheet, shared_cache=None, depot=DEFAULT_DEPOT):
+        self.spreadsheet = spreadsheet
+        self.shared_cache = shared_cache  # Optional SharedCache the app processes follow
+        self.depot = depot
+        self._worksheets = {}
+        self._reference = None  # (catalog, plate timeline, loaded at)
+
+    def _worksheet(self, name, columns):
+        if name not in self._worksheets:
+            self._worksheets[name] = storage.open_or_create_worksheet(
+                self.spreadsheet, self.depot.worksheet(name), columns)
+        return self._worksheets[name]
+
+    def load_state(self):
+        """Catalog and plates (re-read every INGEST_REFERENCE_REFRESH_SECONDS) plus a fresh odometer summary."""
+        if self._reference is None or time.monotonic() - self._reference[2] > INGEST_REFERENCE_REFRESH_SECONDS:
+            catalog = storage.read_catalog(self._worksheet(GSHEETS_CATALOG_WORKSHEET_NAME, GSHEETS_CATALOG_COLUMNS))
+            plates = self.spreadsheet.worksheet(self.depot.worksheet(GSHEETS_VEHICLES_WORKSHEET_NAME))
+            current_plates = {record.get("Vehicle"): record.get("License Plate")
+                              for record in plates.get_all_records()}
+            history = self._worksheet(GSHEETS_PLATE_HISTORY_WORKSHEET_NAME,
+                                      GSHEETS_PLATE_HISTORY_COLUMNS).get_all_records()
+            self._reference = (catalog, build_plate_timeline(history, current_plates), time.monotonic())
+        catalog, plate_timeline, _ = self._reference
+        odometer = storage.read_odometer_details(
+            self._worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS))
+        return IngestState(catalog, plate_timeline, odometer)
+
+    def write(self, trips, state):
+        """Appends the trips, journals them and updates their vehicles' summary rows, under the write lease.
+
+        Raises storage.WriteLeaseBusy if another writer holds the lease too long (nothing is written).
+        Raises PartialWriteError if anything fails after the append, when the trips are saved.
+        """
+        recorded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        meta = self._worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"])
+        upserts = {trip["id"]: trip for trip in trips}
+        # Hold the same write lease as the app, so the append never lands while an app save
+        # has cleared the trips sheet and not yet written it back
+        with storage.write_lease(meta, f"ingest:{os.getpid()}"):
+            version, journal_row_count = storage.read_version(meta)
+            storage.append_trips(self.spreadsheet.worksheet(self.depot.worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)),
+                                 trips)
+            try:
+                new_version, new_journal_row_count = storage.record_trip_write(
+                    meta, self._worksheet(GSHEETS_JOURNAL_WORKSHEET_NAME, JOURNAL_COLUMNS),
+                    version, journal_row_count, upserts, set(), recorded_at)
+                # Only the batch's vehicles, like Driver Mode: the other rows in state were read before
+                # the lease and may be older than what another writer has saved since
+                odometer_worksheet = self._worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS)
+                for vehicle in dict.fromkeys(trip["Vehicle"] for trip in trips):
+                    storage.write_odometer_row(odometer_worksheet, vehicle, state.odometer[vehicle], recorded_at)
+            except Exception as e:
+                raise PartialWriteError(e) from e
+        if self.shared_cache is not None:
+            try:
+                self.shared_cache.publish_write(version, new_version, new_journal_row_count, upserts, set(),
+                                                order_preserved=True, origin="ingest")
+            except sqlite3.Error:
+                pass  # The trips are saved; app processes pick them up from the sheet instead
+
+
+class PartialWriteError(Exception):
+    """The trips were appended to the sheet, but the journal or odometer summary update failed."""
+
+
+class _Submission:
+    def __init__(self, items):
+        self.items = items
+        self.results = None
+        self.done = threading.Event()
+
+
+class TripIngestor:
+    """Queues posted trips and writes them in batches on one writer thread."""
+
+    def __init__(self, backend, batch_window=INGEST_BATCH_WINDOW_SECONDS, max_batch=INGEST_MAX_BATCH):
+        self.backend = backend
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.submissions = SubmissionLog()  # Responses by Idempotency-Key
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="trip-ingestor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, items):
+        """Queues trips and blocks until they are written; returns one result dict per item."""
+        submission = _Submission(items)
+        self._queue.put(submission)
+        submission.done.wait()
+        return submission.results
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # Gather whatever else arrives within the batch window
+            count = len(batch[0].items)
+            deadline = time.monotonic() + self.batch_window
+            while count < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    submission = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(submission)
+                count += len(submission.items)
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Never let one bad batch stop the writer thread: every later request would wait forever
+                self._fail(batch, f"Unexpected error: {e}")
+
+    def _fail(self, batch, message):
+        """Reports every trip of the batch's unfinished submissions as failed."""
+        for submission in batch:
+            if not submission.done.is_set():
+                submission.results = [{"index": i, "status": "failed", "errors": [message]}
+                                      for i in range(len(submission.items))]
+                submission.done.set()
+
+    def _process(self, batch):
+        try:
+            state = self.backend.load_state()
+        except Exception as e:
+            self._fail(batch, f"Could not read the sheet: {e}")
+            return
+
+        accepted = []  # (trip, result)
+        for submission in batch:
+            submission.results = []
+            for index, item in enumerate(submission.items):
+                result = {"index": index}
+                fields, errors = parse_item(item, state.catalog)
+                warnings = []
+                if not errors:
+                    latest = state.odometer.get(fields["Vehicle"])
+                    errors, warnings = check_against_latest(fields, latest)
+                if errors:
+                    result.update(status="rejected", errors=errors)
+                else:
+                    trip = self._new_trip(fields, state)
+                    result.update(status="accepted", id=trip["id"], warnings=warnings)
+                    accepted.append((trip, result))
+                submission.results.append(result)
+
+        if accepted:
+            try:
+                self.backend.write([trip for trip, _ in accepted], state)
+                self.written += len(accepted)
+            except PartialWriteError as e:
+                self.written += len(accepted)
+                for _, result in accepted:
+                    result.update(status="partial", errors=[
+                        f"Saved to the trips sheet, but the change journal or odometer summary "
+                        f"could not be updated: {e}"])
+            except Exception as e:
+                for _, result in accepted:
+                    result.update(status="failed", errors=[f"Could not save to the sheet: {e}"])
+                    result.pop("id", None)
+        for submission in batch:
+            submission.done.set()
+
+    def _new_trip(self, fields, state):
+        """Builds the stored trip and moves the vehicle's latest entry to it (later items chain on)."""
+        latest = state.odometer.get(fields["Vehicle"])
+        km = fields["End KM"] - fields["Start KM"]
+        accumulated = ((latest[3] or 0) if latest and latest[0] is not None else 0) + km
+        trip = {
+            "id": str(uuid.uuid4()),
+            "Date": fields["Date"],
+            "Vehicle": fields["Vehicle"],
+            "Start KM": fields["Start KM"],
+            "End KM": fields["End KM"],
+            "Accumulated KM": accumulated,
+            "Driver": fields["Driver"],
+            "Route": ", ".join(fields["Route"]),
+            "Remarks": fields["Remarks"],
+            "Edited By": "",
+            "Fleet Change": "",
+            "License Plate at Trip Time": state.plate_timeline.plate_on(fields["Vehicle"], fields["Date"],
+                                                                        default="N/A"),
+        }
+        state.odometer[fields["Vehicle"]] = (fields["End KM"], fields["Date"], trip["id"], accumulated)
+        return trip
+
+
+class IngestRequestHandler(BaseHTTPRequestHandler):
+    """POST /trips and GET /health; `ingestor` and `token` are set by make_server."""
+
+    ingestor = None
+    token = None
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown the console at hundreds of requests per second
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        if not self.token:
+            return True
+        supplied = self.headers.get("Authorization", "")
+        return hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "Not found."})
+            return
+        self._send_json(200, {"status": "ok", "pending": self.ingestor.pending(),
+                              "written": self.ingestor.written})
+
+    def do_POST(self):
+        if self.path != "/trips":
+            self._send_json(404, {"error": "Not found."})
+            return
+        if not self._authorized():
+            self._send_json(401, {"error": "Missing or wrong bearer token."})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > INGEST_MAX_BODY_BYTES:
+            self._send_json(413, {"error": f"Body larger than {INGEST_MAX_BODY_BYTES} bytes."})
+            return
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as e:
+            self._send_json(400, {"error": f"Invalid JSON: {e}"})
+            return
+        if isinstance(payload, dict) and isinstance(payload.get("trips"), list):
+            items = payload["trips"]
+        elif isinstance(payload, list):
+            items = payload
+        elif isinstance(payload, dict):
+            items = [payload]
+        else:
+            self._send_json(400, {"error": "Send a trip object, a list of trips or {\"trips\": [...]}."})
+            return
+
+        key = self.headers.get("Idempotency-Key")
+        if key:
+            claimed, previous = self.ingestor.submissions.claim(key)
+            if not claimed:
+                if previous is None:
+                    self._send_json(409, {"error": "A request with this Idempotency-Key is still being processed."})
+                else:
+                    self._send_json(200, dict(previous, replayed=True))
+                return
+
+        try:
+            results = self.ingestor.submit(items) if items else []
+        except BaseException:
+            if key:
+                self.ingestor.submissions.release(key)
+            raise
+        counts = {status: sum(1 for r in results if r["status"] == status)
+                  for status in ("accepted", "partial", "rejected", "failed")}
+        response = dict(counts, results=results)
+        if key:
+            if counts["failed"] and not counts["accepted"] and not counts["partial"]:
+                self.ingestor.submissions.release(key)  # Nothing was written; a retry may succeed
+            else:
+                self.ingestor.submissions.complete(key, response)
+        self._send_json(200, response)
+
+
+class IngestHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Many clients connect at once while a batch is being written
+
+
+def make_server(ingestor, host, port, token=None):
+    """Returns an HTTP server for the ingestion API of `ingestor` (call serve_forever on it)."""
+    handler = type("BoundIngestRequestHandler", (IngestRequestHandler,),
+                   {"ingestor": ingestor, "token": token})
+    return IngestHTTPServer((host, port), handler)
@@ -0,0 +1,79 @@
+# odometer_index.py
+
+from datetime import datetime
+
+from config import FLEET_CHANGE_ROUTE
+
+# Columns of the per-vehicle odometer summary worksheet (one row per vehicle)
+ODOMETER_INDEX_COLUMNS = ["Vehicle", "Latest End KM", "Latest Date", "Trip ID", "Updated At",
+                          "Accumulated KM"]
+
+
+def _as_km(value):
+    """Returns a KM value as int, or None if it is missing or not a number."""
+    try:
+        return int(float(str(value).strip()))
+    except (ValueError, TypeError):
+        return None
+
+
+def compute_odometer_summary(trips, vehicles):
+    """Returns {vehicle: (latest End KM, latest date, trip id, Accumulated KM)} for the given vehicles.
+
+    The latest trip is the one with the latest date; several trips on that date are ordered by End KM.
+    Fleet change rows and trips without a valid date or End KM are ignored.
+    """
+    wanted = set(vehicles)
+    latest = {}
+    for trip in trips:
+        vehicle = trip.get("Vehicle")
+        if vehicle not in wanted or trip.get("Route") == FLEET_CHANGE_ROUTE:
+            continue
+        date_str = trip.get("Date")
+        end_km = _as_km(trip.get("End KM"))
+        if end_km is None or not isinstance(date_str, str):
+            continue
+        try:
+            datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            continue
+        current = latest.get(vehicle)
+        if current is None or (date_str, end_km) > (current[1], current[0]):
+            latest[vehicle] = (end_km, date_str, trip.get("id"), _as_km(trip.get("Accumulated KM")))
+    return latest
+
+
+def summary_rows(summary, vehicles, updated_at):
+    """Worksheet rows for a summary, one per vehicle in the given (catalog) order."""
+    rows = []
+    for vehicle in vehicles:
+        end_km, date_str, trip_id, accumulated = summary.get(vehicle, ("", "", "", ""))
+        rows.append([vehicle, end_km, date_str, trip_id, updated_at,
+                     "" if accumulated is None else accumulated])
+    return rows
+
+
+def parse_summary_rows(values):
+    """Reads worksheet rows back into {vehicle: (latest End KM, latest date)}.
+
+    A vehicle's first row wins: rows left below a shorter full rewrite are stale.
+    """
+    parsed = {}
+    for row in values:
+        if not row or not row[0] or row[0] in parsed:
+            continue
+        end_km = _as_km(row[1]) if len(row) > 1 else None
+        date_str = row[2] if len(row) > 2 else ""
+        parsed[row[0]] = (end_km, date_str)
+    return parsed
+
+
+def parse_summary_details(values):
+    """Reads full worksheet rows into {vehicle: (latest End KM, latest date, trip id, Accumulated KM)}."""
+    parsed = {}
+    for row in values:
+        if not row or not row[0] or row[0] in parsed:
+            continue  # A vehicle's first row wins (see parse_summary_rows)
+        row = list(row) + [""] * (len(ODOMETER_INDEX_COLUMNS) - len(row))
+        parsed[row[0]] = (_as_km(row[1]), row[2], row[3], _as_km(row[5]))
+    return parsed
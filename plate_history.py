@@ -0,0 +1,104 @@
+# plate_history.py
+
+import re
+from bisect import bisect_right
+
+from config import FLEET_CHANGE_ROUTE
+
+# Effective date used for a vehicle's first known plate ("since the beginning")
+EARLIEST_PLATE_DATE = "1900-01-01"
+
+# Matches the note written by the old fleet-change trips:
+# "[2024-05-01 10:00:00] Plate changed for A: ABC 123 -> XYZ 789"
+FLEET_CHANGE_NOTE_PATTERN = re.compile(
+    r"Plate changed for (?P<vehicle>.+?): (?P<old>.*?) -> (?P<new>.*)$")
+
+
+class PlateTimeline:
+    """Per-vehicle license plate history, indexed by effective date.
+
+    Each vehicle keeps two parallel lists sorted by "Effective From" (ISO dates sort as text),
+    so "which plate did vehicle V carry on date D" is a binary search: O(log n).
+    """
+
+    def __init__(self, records=()):
+        self._dates = {}
+        self._plates = {}
+        for record in sorted(records, key=lambda r: (r["Vehicle"], r["Effective From"])):
+            self._dates.setdefault(record["Vehicle"], []).append(record["Effective From"])
+            self._plates.setdefault(record["Vehicle"], []).append(record["License Plate"])
+
+    def plate_on(self, vehicle, date_str, default=None):
+        """Returns the plate a vehicle carried on a YYYY-MM-DD date, or `default` if unknown."""
+        dates = self._dates.get(vehicle)
+        if not dates or not date_str:
+            return default
+        position = bisect_right(dates, date_str)
+        if position == 0:
+            return default
+        return self._plates[vehicle][position - 1] or default
+
+    def current_plate(self, vehicle, default=None):
+        """Returns the most recent plate recorded for a vehicle."""
+        plates = self._plates.get(vehicle)
+        return plates[-1] if plates else default
+
+    def vehicles(self):
+        """Returns the vehicles that have a plate history."""
+        return list(self._dates)
+
+
+def build_plate_timeline(history_records, current_plates=None):
+    """Builds a PlateTimeline from plate history rows, seeding vehicles without history from their current plate."""
+    records = [r for r in history_records if r.get("Vehicle") and r.get("Effective From")]
+    known = {r["Vehicle"] for r in records}
+    for vehicle, plate in (current_plates or {}).items():
+        if vehicle and plate and vehicle not in known:
+            records.append({"Vehicle": vehicle, "License Plate": plate,
+                            "Effective From": EARLIEST_PLATE_DATE})
+    return PlateTimeline(records)
+
+
+def stamp_trip_plates(trips, timeline, default="N/A"):
+    """Sets "License Plate at Trip Time" in place from the timeline, keeping the stored value if unknown."""
+    for trip in trips:
+        stored = trip.get("License Plate at Trip Time") or default
+        trip["License Plate at Trip Time"] = timeline.plate_on(
+            trip.get("Vehicle"), trip.get("Date"), default=stored)
+    return trips
+
+
+def is_fleet_change_trip(trip):
+    """True for the legacy trip rows that recorded a plate change."""
+    return trip.get("Route") == FLEET_CHANGE_ROUTE
+
+
+def fleet_change_trips_to_history(trips):
+    """Converts legacy fleet-change trip rows into plate history rows.
+
+    The first change seen for a vehicle also yields its previous plate, effective from the beginning.
+    """
+    records = []
+    seen_vehicles = set()
+    fleet_rows = sorted((t for t in trips if is_fleet_change_trip(t)),
+                        key=lambda t: str(t.get("Date") or ""))
+    for trip in fleet_rows:
+        vehicle = trip.get("Vehicle")
+        note = str(trip.get("Fleet Change") or "")
+        match = FLEET_CHANGE_NOTE_PATTERN.search(note)
+        new_plate = trip.get("License Plate at Trip Time") or (match.group("new").strip() if match else "")
+        if not vehicle or not new_plate:
+            continue
+        if vehicle not in seen_vehicles and match and match.group("old").strip():
+            records.append({
+                "Vehicle": vehicle, "License Plate": match.group("old").strip(),
+                "Effective From": EARLIEST_PLATE_DATE, "Changed By": "",
+                "Comments": "Migrated: plate before first recorded change", "Recorded At": "",
+            })
+        seen_vehicles.add(vehicle)
+        records.append({
+            "Vehicle": vehicle, "License Plate": new_plate,
+            "Effective From": trip.get("Date"), "Changed By": trip.get("Edited By") or "",
+            "Comments": f"Migrated: {note}" if note else "Migrated fleet change", "Recorded At": "",
+        })
+    return records
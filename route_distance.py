@@ -0,0 +1,189 @@
+# route_distance.py
+
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    STORE_COORDINATES, ROUTE_DEPOT_COORDINATES, ROAD_DISTANCE_FACTOR, ROUTE_MAX_RATIO,
+    ROUTE_MIN_RATIO, ROUTE_KM_SLACK, ROUTE_DISTANCE_CACHE_PATH, FLEET_CHANGE_ROUTE
+)
+
+# Expected route lengths: a store-to-store road distance matrix (straight-line distance times
+# ROAD_DISTANCE_FACTOR) is built once and cached on disk, and each distinct set of stores is
+# ordered with nearest-neighbour plus 2-opt. Routes repeat a lot, so estimates are memoized by
+# store set and checking the whole history costs one estimate per distinct route.
+
+DEPOT = "__depot__"
+
+ROUTE_CHECK_COLUMNS = ["Date", "Vehicle", "Driver", "Trip ID", "Route", "Actual KM",
+                       "Expected KM", "Issue"]
+
+EARTH_RADIUS_KM = 6371.0
+
+_matrix_lock = threading.Lock()
+_matrix = None  # (store -> row index, distance matrix)
+
+
+def _locations():
+    """Names and coordinates of every place in the matrix (stores, plus the depot if configured)."""
+    locations = dict(STORE_COORDINATES)
+    if ROUTE_DEPOT_COORDINATES is not None:
+        locations[DEPOT] = ROUTE_DEPOT_COORDINATES
+    names = sorted(locations)
+    return names, np.array([locations[name] for name in names], dtype=float)
+
+
+def compute_distance_matrix(coords):
+    """Road distance estimate (km) between every pair of (lat, lon) points, in one vectorized pass."""
+    lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1))) * ROAD_DISTANCE_FACTOR
+
+
+def _load_cached_matrix(names, coords):
+    """Returns the matrix saved at ROUTE_DISTANCE_CACHE_PATH if it was built from the same places."""
+    try:
+        with np.load(ROUTE_DISTANCE_CACHE_PATH) as cached:
+            if (list(cached["names"]) == names and np.array_equal(cached["coords"], coords)
+                    and float(cached["road_factor"]) == ROAD_DISTANCE_FACTOR):
+                return cached["matrix"]
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def get_distance_matrix():
+    """Returns ({place: index}, matrix), loading or building (and saving) it on first use."""
+    global _matrix
+    with _matrix_lock:
+        if _matrix is None:
+            names, coords = _locations()
+            matrix = _load_cached_matrix(names, coords)
+            if matrix is None:
+                matrix = compute_distance_matrix(coords)
+                try:
+                    os.makedirs(os.path.dirname(ROUTE_DISTANCE_CACHE_PATH) or ".", exist_ok=True)
+                    np.savez(ROUTE_DISTANCE_CACHE_PATH, names=np.array(names), coords=coords,
+                             matrix=matrix, road_factor=ROAD_DISTANCE_FACTOR)
+                except OSError:
+                    pass  # The cache file is only an optimization
+            _matrix = ({name: i for i, name in enumerate(names)}, matrix)
+        return _matrix
+
+
+def _path_length(order, dist):
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def _nearest_neighbour(nodes, dist, start):
+    order = [start]
+    remaining = [node for node in nodes if node != start]
+    while remaining:
+        last = order[-1]
+        nearest = min(remaining, key=lambda node: dist[last, node])
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order
+
+
+def _two_opt(order, dist, first, last):
+    """Improves a path by reversing segments order[i..j] for first <= i < j <= last until no gain."""
+    improved = True
+    while improved:
+        improved = False
+        for i in range(first, last):
+            for j in range(i + 1, last + 1):
+                before = order[i - 1] if i > 0 else None
+                after = order[j + 1] if j + 1 < len(order) else None
+                old = (dist[before, order[i]] if before is not None else 0) + \
+                      (dist[order[j], after] if after is not None else 0)
+                new = (dist[before, order[j]] if before is not None else 0) + \
+                      (dist[order[i], after] if after is not None else 0)
+                if new < old - 1e-9:
+                    order[i:j + 1] = order[i:j + 1][::-1]
+                    improved = True
+    return order
+
+
+@lru_cache(maxsize=4096)
+def estimate_route_km(stores):
+    """Expected driving distance (km) for a frozenset of store names, or None if it cannot be estimated.
+
+    With a depot the route is a closed tour from and back to it; otherwise an open path, which
+    needs at least two stores with coordinates.
+    """
+    index, dist = get_distance_matrix()
+    nodes = sorted(index[store] for store in stores if store in index and store != DEPOT)
+    if not nodes or (DEPOT not in index and len(nodes) < 2):
+        return None
+    if DEPOT in index:
+        depot = index[DEPOT]
+        order = _nearest_neighbour(nodes, dist, depot) + [depot]
+        order = _two_opt(order, dist, 1, len(order) - 2)
+    else:
+        # Open path: best nearest-neighbour start, then 2-opt over the whole path
+        order = min((_nearest_neighbour(nodes, dist, start) for start in nodes),
+                    key=lambda candidate: _path_length(candidate, dist))
+        order = _two_opt(order, dist, 0, len(order) - 1)
+    return round(_path_length(order, dist), 1)
+
+
+def route_stores(route_string):
+    """The set of stores on a comma-separated route."""
+    return frozenset(store.strip() for store in str(route_string or "").split(",") if store.strip())
+
+
+def _implausible(actual_km, expected_km):
+    """Vectorized plausibility rule; returns (too_long, too_short) boolean arrays."""
+    too_long = actual_km > expected_km * ROUTE_MAX_RATIO + ROUTE_KM_SLACK
+    too_short = actual_km < expected_km * ROUTE_MIN_RATIO
+    return too_long, too_short
+
+
+def check_route_distance(route_list, start_km, end_km):
+    """Returns a warning message if the trip's KM is implausible for its stores, otherwise None."""
+    expected = estimate_route_km(frozenset(route_list))
+    if expected is None:
+        return None
+    actual = end_km - start_km
+    too_long, too_short = _implausible(np.array([actual]), np.array([expected]))
+    if too_long[0]:
+        return (f"{actual} km is much more than the roughly {expected:.0f} km expected for this route. "
+                "Please check Start KM and End KM.")
+    if too_short[0]:
+        return (f"{actual} km is less than the roughly {expected:.0f} km needed to visit these stores. "
+                "Please check Start KM and End KM.")
+    return None
+
+
+def flag_implausible_trips(trips):
+    """Checks every trip's KM against its route estimate; returns the implausible ones (ROUTE_CHECK_COLUMNS)."""
+    frame = pd.DataFrame(list(trips), columns=["id", "Date", "Vehicle", "Driver", "Start KM", "End KM", "Route"])
+    frame = frame[frame["Route"] != FLEET_CHANGE_ROUTE]
+    actual = pd.to_numeric(frame["End KM"], errors='coerce') - pd.to_numeric(frame["Start KM"], errors='coerce')
+    stores = frame["Route"].map(route_stores)
+    estimates = {route: estimate_route_km(route) for route in stores.unique()}  # One per distinct route
+    expected = stores.map(estimates).astype(float)
+
+    valid = actual.notna() & expected.notna()
+    too_long, too_short = _implausible(actual.to_numpy(dtype=float), expected.to_numpy(dtype=float))
+    flagged = valid.to_numpy() & (too_long | too_short)
+    if not flagged.any():
+        return pd.DataFrame(columns=ROUTE_CHECK_COLUMNS)
+    result = pd.DataFrame({
+        "Date": frame["Date"].to_numpy()[flagged],
+        "Vehicle": frame["Vehicle"].to_numpy()[flagged],
+        "Driver": frame["Driver"].to_numpy()[flagged],
+        "Trip ID": frame["id"].to_numpy()[flagged],
+        "Route": frame["Route"].to_numpy()[flagged],
+        "Actual KM": actual.to_numpy()[flagged].astype("int64"),
+        "Expected KM": expected.to_numpy()[flagged].round().astype("int64"),
+        "Issue": np.where(too_long[flagged], "Too Long", "Too Short"),
+    }, columns=ROUTE_CHECK_COLUMNS)
+    return result.sort_values("Date", ascending=False, kind="stable").reset_index(drop=True)
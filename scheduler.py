@@ -0,0 +1,129 @@
+# scheduler.py
+
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+
+class Job:
+    """A recurring task with its run history."""
+
+    def __init__(self, name, func, interval_seconds, error_history):
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.next_run = 0.0  # Monotonic time; 0 runs the job on the first tick
+        self.running = False
+        self.run_count = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_status = "pending"
+        self.last_message = ""
+        self.result = None  # Return value of the last successful run
+        self.errors = deque(maxlen=error_history)  # (time, message, traceback), newest last
+
+
+class JobScheduler:
+    """Runs recurring jobs one at a time on a single daemon thread, off the request path.
+
+    Job functions take no arguments and return a status message, or a (message, result) pair
+    to also keep a result for readers (see `result`). Exceptions are recorded in the job's
+    error history and the job runs again at its next interval.
+    """
+
+    def __init__(self, tick_seconds, error_history):
+        self.tick_seconds = tick_seconds
+        self.error_history = error_history
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, func, interval_seconds):
+        with self._lock:
+            self._jobs[name] = Job(name, func, interval_seconds, self.error_history)
+
+    def start(self):
+        """Starts the worker thread (once)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="job-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run_now(self, name):
+        """Schedules a job to run on the worker thread as soon as possible."""
+        with self._lock:
+            self._jobs[name].next_run = 0.0
+        self._wake.set()
+
+    def result(self, name):
+        """Returns the result of the job's last successful run, or None."""
+        with self._lock:
+            job = self._jobs.get(name)
+            return job.result if job is not None else None
+
+    def status(self):
+        """Returns one status dict per job, for display."""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "Job": job.name,
+                "Status": "running" if job.running else job.last_status,
+                "Last Run": job.last_started.strftime('%Y-%m-%d %H:%M:%S') if job.last_started else "",
+                "Duration (s)": round(job.last_duration, 2) if job.last_duration is not None else None,
+                "Next Run In (s)": max(0, int(job.next_run - now)),
+                "Runs": job.run_count,
+                "Errors": len(job.errors),
+                "Message": job.last_message,
+            } for job in self._jobs.values()]
+
+    def errors(self):
+        """Returns [(job name, time, message, traceback)], newest first."""
+        with self._lock:
+            history = [(job.name,) + error for job in self._jobs.values() for error in job.errors]
+        return sorted(history, key=lambda error: error[1], reverse=True)
+
+    def _due_jobs(self):
+        now = time.monotonic()
+        with self._lock:
+            return [job for job in self._jobs.values() if job.next_run <= now]
+
+    def _run(self, job):
+        with self._lock:
+            job.running = True
+            job.last_started = datetime.now()
+        started = time.monotonic()
+        try:
+            outcome = job.func()
+            message, result = outcome if isinstance(outcome, tuple) else (outcome, None)
+            status, error = "ok", None
+        except Exception as e:
+            result, status, message = None, "error", f"{type(e).__name__}: {e}"
+            error = (datetime.now(), message, traceback.format_exc())
+        with self._lock:
+            job.running = False
+            job.run_count += 1
+            job.last_duration = time.monotonic() - started
+            job.last_status = status
+            job.last_message = message or ""
+            job.next_run = time.monotonic() + job.interval_seconds
+            if error is None:
+                if result is not None:
+                    job.result = result
+            else:
+                job.errors.append(error)
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.clear()  # Before checking, so a run_now() during a job is not lost
+            for job in self._due_jobs():
+                if self._stopped.is_set():
+                    return
+                self._run(job)
+            self._wake.wait(self.tick_seconds)
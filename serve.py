@@ -0,0 +1,36 @@
+# serve.py
+
+import importlib
+import os
+import sys
+import time
+
+# Starts the Streamlit server for app.py after warming this process up: the app modules are
+# imported and the warm-up (see warmup.py) begins on a background thread before the server
+# accepts its first connection, so no visitor meets a cold process. Arguments are passed on to
+# `streamlit run`, e.g. python serve.py --server.port 8501
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Everything app.py imports, so its first run finds the modules loaded
+APP_MODULES = ["warmup", "admin_section", "conflicts_section", "tabs.add_trip_tab",
+               "tabs.edit_trip_tab", "tabs.view_records_tab", "tabs.driver_entry_tab"]
+
+
+def main():
+    os.chdir(APP_DIR)  # secrets.toml, the shared cache and backups are found relative to the app
+    sys.path.insert(0, APP_DIR)
+
+    started = time.perf_counter()
+    for name in APP_MODULES:
+        importlib.import_module(name)
+    warmup = sys.modules["warmup"]
+    warmup.get_startup_timings().record_import(time.perf_counter() - started)
+    warmup.start_warm_up()
+
+    from streamlit.web import cli as streamlit_cli
+    sys.argv = ["streamlit", "run", os.path.join(APP_DIR, "app.py"), *sys.argv[1:]]
+    sys.exit(streamlit_cli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# shared_cache.py
+
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import namedtuple
+from datetime import datetime
+
+from config import SHARED_CACHE_COMPACT_WRITES, SHARED_CACHE_PLATE_CHANGES
+from trip_sync import merge_remote_changes
+
+# A cache tier shared by every process on the machine that reads or writes trips (app
+# replicas, the ingest server, the CLI), kept in one SQLite file. It holds the latest full trip
+# snapshot plus a log of the writes made since, each tagged with the sheet version it moved
+# from and to. Every entry gets the next `seq`, a data version that only ever increases: a
+# process remembers the last seq it applied and fetches only newer entries, with one local
+# query when nothing changed, instead of reading Google Sheets.
+#
+# The sheet stays authoritative. A write made without the cache (e.g. a direct sheet edit)
+# shows up as a version gap that replay() will not bridge; the app then syncs from the sheet
+# as before and stores the reloaded snapshot here for the other processes.
+#
+# Plate changes are logged here too (in their own table and sequence), so a plate changed in
+# one process reaches the sessions of the others through their change feeds.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counter (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL);
+INSERT OR IGNORE INTO counter (id, seq) VALUES (1, 0);
+CREATE TABLE IF NOT EXISTS snapshot (
+    id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, sheet_version INTEGER NOT NULL,
+    journal_row_count INTEGER NOT NULL, matches_sheet_order INTEGER NOT NULL, rows BLOB NOT NULL,
+    origin TEXT, stored_at TEXT);
+CREATE TABLE IF NOT EXISTS writes (
+    seq INTEGER PRIMARY KEY, base_sheet_version INTEGER NOT NULL, sheet_version INTEGER NOT NULL,
+    journal_row_count INTEGER NOT NULL, order_preserved INTEGER NOT NULL, changes BLOB NOT NULL,
+    origin TEXT, recorded_at TEXT);
+CREATE TABLE IF NOT EXISTS plate_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, plates BLOB NOT NULL, history BLOB NOT NULL,
+    origin TEXT, recorded_at TEXT);
+"""
+
+# kind is "snapshot" (data = trip list) or "write" (data = {trip id: trip, or None if deleted})
+CacheEntry = namedtuple("CacheEntry", ["seq", "kind", "base_sheet_version", "sheet_version",
+                                       "journal_row_count", "matches_sheet_order", "data"])
+# plates is the whole plate table after the change, history the plate history rows it added
+PlateChange = namedtuple("PlateChange", ["seq", "plates", "history", "origin"])
+ReplayResult = namedtuple("ReplayResult", ["rows", "sheet_version", "journal_row_count",
+                                           "matches_sheet_order", "seq", "changes", "reloaded"])
+
+
+def _pack(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":"), default=str).encode("utf-8"), 1)
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SharedCache:
+    """The shared trip cache in the SQLite file at `path` (created on first use).
+
+    Safe to use from several threads. `applied_seq` and `follow_lock` are for the owner: the
+    last entry folded into its own snapshot, and a lock so only one thread folds at a time.
+    `applied_plate_seq` is the last plate change the owner has passed on (it starts at the
+    newest one, since sessions read the plates from the sheet when they start).
+    """
+
+    def __init__(self, path, compact_writes=SHARED_CACHE_COMPACT_WRITES,
+                 keep_plate_changes=SHARED_CACHE_PLATE_CHANGES):
+        self.path = path
+        self.compact_writes = compact_writes
+        self.keep_plate_changes = keep_plate_changes
+        self.applied_seq = 0
+        self.follow_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")  # Readers never block the writer
+        connection.executescript(_SCHEMA)
+        self.applied_plate_seq = self.latest_plate_seq()
+
+    def _connection(self):
+        """One connection per thread, in autocommit mode (transactions are explicit)."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _next_seq(self, connection):
+        connection.execute("UPDATE counter SET seq = seq + 1 WHERE id = 1")
+        return connection.execute("SELECT seq FROM counter WHERE id = 1").fetchone()[0]
+
+    def latest_seq(self):
+        """The data version: the seq of the newest entry (0 for an empty cache)."""
+        return self._connection().execute("SELECT seq FROM counter WHERE id = 1").fetchone()[0]
+
+    def store_snapshot(self, rows, sheet_version, journal_row_count, matches_sheet_order, origin=""):
+        """Stores a full trip list as the new base and drops the writes it includes. Returns its seq."""
+        blob = _pack([dict(trip) for trip in rows])
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._next_seq(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO snapshot VALUES (1, ?, ?, ?, ?, ?, ?, ?)",
+                (seq, sheet_version, journal_row_count, int(bool(matches_sheet_order)), blob, origin,
+                 datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            connection.execute("DELETE FROM writes WHERE seq < ?", (seq,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return seq
+
+    def publish_write(self, base_sheet_version, sheet_version, journal_row_count, upserts, deletes,
+                      order_preserved, origin=""):
+        """Logs a completed write that moved the sheet from `base_sheet_version` to `sheet_version`.
+
+        `order_preserved` says whether rows kept their sheet positions (appends and cell updates,
+        or a full rewrite from rows that matched the sheet order). Returns the entry's seq.
+        """
+        changes = {trip_id: dict(trip) for trip_id, trip in upserts.items()}
+        changes.update({trip_id: None for trip_id in deletes})
+        blob = _pack(changes)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._next_seq(connection)
+            connection.execute(
+                "INSERT INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (seq, base_sheet_version, sheet_version, journal_row_count, int(bool(order_preserved)),
+                 blob, origin, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return seq
+
+    def needs_compaction(self):
+        """True once more than `compact_writes` writes are logged on top of the stored snapshot."""
+        count = self._connection().execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+        return count > self.compact_writes
+
+    def read_since(self, seq):
+        """Entries newer than `seq`, oldest first; starts with the stored snapshot if that is newer."""
+        connection = self._connection()
+        connection.execute("BEGIN")  # One consistent view of both tables
+        try:
+            entries = []
+            snapshot = connection.execute(
+                "SELECT seq, sheet_version, journal_row_count, matches_sheet_order, rows "
+                "FROM snapshot WHERE id = 1").fetchone()
+            if snapshot is not None and snapshot[0] > seq:
+                entries.append(CacheEntry(snapshot[0], "snapshot", None, snapshot[1], snapshot[2],
+                                          bool(snapshot[3]), _unpack(snapshot[4])))
+                seq = snapshot[0]
+            for row in connection.execute(
+                    "SELECT seq, base_sheet_version, sheet_version, journal_row_count, order_preserved, "
+                    "changes FROM writes WHERE seq > ? ORDER BY seq", (seq,)):
+                entries.append(CacheEntry(row[0], "write", row[1], row[2], row[3], bool(row[4]),
+                                          _unpack(row[5])))
+        finally:
+            connection.execute("COMMIT")
+        return entries
+
+    def trips_at(self, sheet_version):
+        """The cached trips if they match `sheet_version` (e.g. just read from Meta), else None."""
+        result = replay(None, 0, self.read_since(0))
+        return result.rows if result.rows is not None and result.sheet_version == sheet_version else None
+
+    def publish_plate_change(self, plates, history, origin=""):
+        """Logs a plate change (the whole plate table and the new history rows). Returns its seq.
+
+        Only the newest `keep_plate_changes` changes are kept.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            seq = connection.execute(
+                "INSERT INTO plate_changes (plates, history, origin, recorded_at) VALUES (?, ?, ?, ?)",
+                (_pack(plates), _pack(history), origin, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).lastrowid
+            connection.execute("DELETE FROM plate_changes WHERE seq <= ?", (seq - self.keep_plate_changes,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return seq
+
+    def latest_plate_seq(self):
+        """The seq of the newest plate change (0 before the first one)."""
+        return self._connection().execute("SELECT COALESCE(MAX(seq), 0) FROM plate_changes").fetchone()[0]
+
+    def plate_changes_since(self, seq):
+        """Plate changes newer than `seq`, oldest first; None if some of them are no longer kept."""
+        rows = self._connection().execute(
+            "SELECT seq, plates, history, origin FROM plate_changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        if rows and rows[0][0] > seq + 1:
+            return None
+        return [PlateChange(row[0], _unpack(row[1]), _unpack(row[2]), row[3]) for row in rows]
+
+    def close(self):
+        """Closes this thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def replay(snapshot, seq, entries):
+    """Folds cache entries into a snapshot (a TripSnapshot, or None if nothing is loaded yet).
+
+    A stored snapshot replaces the rows if it is newer; a write is applied if it starts from the
+    current sheet version and skipped if that version already includes it. Replay stops at a
+    write that starts from a later version, since a change made outside the cache is missing.
+    Returns a ReplayResult; `changes` maps the trip ids changed by applied writes to their new
+    version (None if deleted) and `reloaded` is True if a stored snapshot was taken.
+    """
+    if snapshot is None:
+        rows, sheet_version, journal_row_count, matches = None, None, None, False
+    else:
+        rows, sheet_version = snapshot.rows, snapshot.sheet_version
+        journal_row_count, matches = snapshot.journal_row_count, snapshot.matches_sheet_order
+    changes = {}
+    reloaded = False
+    for entry in entries:
+        if entry.kind == "snapshot":
+            if rows is None or entry.sheet_version > sheet_version or \
+                    (entry.sheet_version == sheet_version and entry.matches_sheet_order and not matches):
+                rows, changes, reloaded = entry.data, {}, True
+                sheet_version, journal_row_count = entry.sheet_version, entry.journal_row_count
+                matches = entry.matches_sheet_order
+        elif rows is not None and entry.sheet_version <= sheet_version:
+            pass  # Already included (e.g. this process's own write)
+        elif rows is not None and entry.base_sheet_version == sheet_version:
+            changes.update(entry.data)
+            sheet_version, journal_row_count = entry.sheet_version, entry.journal_row_count
+            matches = matches and entry.matches_sheet_order
+        else:
+            break  # Version gap: only the sheet can fill it
+        seq = entry.seq
+
+    if changes:
+        # Applied in one pass; later writes to the same trip have already replaced earlier ones
+        rows, _, _ = merge_remote_changes(rows, {}, set(), changes)
+    return ReplayResult(rows, sheet_version, journal_row_count, matches, seq, changes, reloaded)
@@ -0,0 +1,336 @@
+# storage.py
+
+import json
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import zip_longest
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    GSHEETS_TRIPS_COLUMNS, GSHEETS_CATALOG_COLUMNS, TRIP_READ_CHUNK_ROWS,
+    WRITE_LEASE_SECONDS, WRITE_LEASE_WAIT_SECONDS, WRITE_LEASE_SETTLE_SECONDS
+)
+from catalog import parse_catalog_rows, catalog_rows
+from odometer_index import (
+    ODOMETER_INDEX_COLUMNS, summary_rows, parse_summary_rows, parse_summary_details
+)
+from trip_sync import journal_rows
+
+# Google Sheets access without Streamlit: plain functions on gspread objects that raise on
+# failure. utils.py wraps them with cached handles and st.error messages for the app, and
+# cli.py calls them directly. gspread and google-auth are imported on first use: they take
+# longer to import than the rest of the app, and the page can render before any sheet access.
+
+SHEETS_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+
+def authorize_client(credentials_json):
+    """Returns a gspread client for a service account key given as a JSON string."""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    credentials = Credentials.from_service_account_info(
+        json.loads(credentials_json), scopes=SHEETS_SCOPES)
+    return gspread.authorize(credentials)
+
+
+def open_or_create_worksheet(spreadsheet, worksheet_name, columns):
+    """Returns a worksheet, creating it with a header row if it does not exist yet."""
+    import gspread
+
+    try:
+        return spreadsheet.worksheet(worksheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(
+            title=worksheet_name, rows=100, cols=len(columns))
+        worksheet.append_row(columns)
+        return worksheet
+
+
+# --- Trips ---
+
+
+def parse_trip_records(records):
+    """Turns worksheet records into trip dicts with every expected column and a unique id."""
+    df = pd.DataFrame(records)
+
+    # Ensure all expected columns are present, add if missing
+    for col in GSHEETS_TRIPS_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+
+    # Use .where(pd.notna, None) to replace NaN with None for cleaner dicts
+    trips = df.where(pd.notna(df), None).to_dict('records')
+
+    # Ensure each trip has a unique ID if loading older data without IDs
+    for trip in trips:
+        if trip.get('id') is None or trip.get('id') == '':
+            trip['id'] = str(uuid.uuid4())
+    return trips
+
+
+# Sheets serial dates count days from this date
+SHEETS_EPOCH = pd.Timestamp("1899-12-30")
+# Columns decoded as numbers (numeric text such as "1,200" is converted too)
+TRIP_NUMBER_COLUMNS = ("Start KM", "End KM", "Accumulated KM")
+
+
+def new_trip_ids(count):
+    """`count` random (version 4) trip ids, from one block of random bytes."""
+    block = os.urandom(16 * count)
+    return [str(uuid.UUID(bytes=block[i:i + 16], version=4)) for i in range(0, 16 * count, 16)]
+
+
+def _decode_dates(column):
+    """Serial dates (cells holding real dates) become YYYY-MM-DD; text dates are kept."""
+    values = pd.Series(column, dtype=object)
+    serials = pd.to_numeric(values.where(values.map(type) != str), errors="coerce")
+    serial = serials.notna()
+    if serial.any():
+        days = pd.to_timedelta(np.floor(serials[serial].to_numpy()), unit="D")
+        values[serial] = (SHEETS_EPOCH + days).strftime("%Y-%m-%d")
+    return values.to_numpy()
+
+
+def _decode_numbers(column):
+    """Numbers stay as sent; numeric text becomes int (or float); other values are kept."""
+    values = pd.Series(column, dtype=object)
+    text = values.map(type) == str
+    if text.any():
+        parsed = pd.to_numeric(values[text].str.replace(",", "", regex=False).str.strip(), errors="coerce")
+        parsed = parsed[np.isfinite(parsed)]  # "nan", "inf" and non-numbers stay as text
+        # All-integer text parses as an int64 Series, whose items are ints (no is_integer)
+        values[parsed.index] = [int(x) if float(x).is_integer() else x for x in parsed.tolist()]
+    return values.to_numpy()
+
+
+def decode_trip_rows(header, rows):
+    """Turns unformatted worksheet rows into trip dicts with every expected column and a unique id.
+
+    Works column by column: rows are transposed once (short rows padded with ""), dates and KM
+    columns are decoded in bulk, and missing ids are generated in one step.
+    """
+    if not rows:
+        return []
+    columns = list(zip_longest(*rows, fillvalue=""))[:len(header)]
+    columns += [("",) * len(rows)] * (len(header) - len(columns))
+    keys = list(header)
+    for position, key in enumerate(keys):
+        if key == "Date":
+            columns[position] = _decode_dates(columns[position])
+        elif key in TRIP_NUMBER_COLUMNS:
+            columns[position] = _decode_numbers(columns[position])
+
+    missing_columns = [col for col in GSHEETS_TRIPS_COLUMNS if col not in keys]
+    keys += missing_columns
+    columns += [(None,) * len(rows)] * len(missing_columns)
+    if "id" in missing_columns:
+        columns[keys.index("id")] = new_trip_ids(len(rows))
+    else:
+        ids = np.array(columns[keys.index("id")], dtype=object)
+        missing = np.flatnonzero((ids == "") | pd.isna(ids))
+        if len(missing):
+            ids[missing] = new_trip_ids(len(missing))
+        columns[keys.index("id")] = ids
+    return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def read_trips(worksheet, chunk_rows=TRIP_READ_CHUNK_ROWS):
+    """Reads every trip from the trips worksheet as typed values, `chunk_rows` rows per request.
+
+    Cells come unformatted (numbers as numbers, real dates as serials), so display formatting
+    in the sheet cannot change what is loaded, and each chunk is decoded before the next one is
+    fetched.
+    """
+    from gspread.utils import ValueRenderOption, DateTimeOption
+
+    trips = []
+    header = None
+    first_row = 1
+    while True:
+        rows = worksheet.get(f"{first_row}:{first_row + chunk_rows - 1}",
+                             value_render_option=ValueRenderOption.unformatted,
+                             date_time_render_option=DateTimeOption.serial_number)
+        complete_chunk = len(rows) == chunk_rows
+        if header is None:
+            if not rows:
+                return []
+            header, rows = [str(key) for key in rows[0]], rows[1:]
+        trips.extend(decode_trip_rows(header, rows))
+        if not complete_chunk:
+            return trips  # The API leaves out trailing empty rows, so a short chunk is the last one
+        first_row += chunk_rows
+
+
+def trip_sheet_values(trips):
+    """Returns the trips as worksheet rows (header first) in GSHEETS_TRIPS_COLUMNS order."""
+    if not trips:
+        return [list(GSHEETS_TRIPS_COLUMNS)]
+    df = pd.DataFrame(list(trips))
+    for col in GSHEETS_TRIPS_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df[GSHEETS_TRIPS_COLUMNS]
+    return [df.columns.tolist()] + df.values.tolist()
+
+
+def write_trips(worksheet, trips):
+    """Rewrites the whole trips worksheet (header plus one row per trip, in list order)."""
+    worksheet.clear()
+    worksheet.append_rows(trip_sheet_values(trips))
+
+
+def append_trips(worksheet, trips):
+    """Appends trips as new rows at the end of the trips worksheet, in one request."""
+    worksheet.append_rows(trip_sheet_values(trips)[1:])
+
+
+# --- Version and Change Journal ---
+# See "Optimistic Concurrency" in utils.py for how the app uses these.
+
+
+def read_version(meta_worksheet):
+    """Returns (trips version, journal row count) from the Meta worksheet in one read."""
+    values = meta_worksheet.get("B2:B3")
+    try:
+        return int(values[0][0]), int(values[1][0])
+    except (IndexError, ValueError, TypeError):
+        return 0, 1  # Fresh sheet: only the journal header row
+
+
+def write_version(meta_worksheet, version, journal_row_count):
+    """Stores the trips version and journal row count in the Meta worksheet."""
+    meta_worksheet.update(range_name="A2:B3", values=[["Trips Version", version],
+                                                      ["Journal Rows", journal_row_count]])
+
+
+def read_journal(journal_worksheet, first_row, last_row):
+    """Reads journal rows first_row..last_row (1-based, inclusive)."""
+    return journal_worksheet.get(f"A{first_row}:E{last_row}")
+
+
+class VersionConflict(Exception):
+    """The trips version moved between a writer's read and its write (another writer got in)."""
+
+
+def record_trip_write(meta_worksheet, journal_worksheet, version, journal_row_count,
+                      upserts, deletes, recorded_at):
+    """Journals a completed trips write and bumps the version. Returns the new (version, journal row count).
+
+    `version` / `journal_row_count` are what the writer read before writing; they are read
+    again first, and VersionConflict is raised rather than journal over another writer's rows.
+    """
+    if read_version(meta_worksheet) != (version, journal_row_count):
+        raise VersionConflict("The trips sheet was changed by another writer during this write.")
+    rows = journal_rows(version + 1, upserts, deletes, recorded_at)
+    if rows:
+        journal_worksheet.append_rows(rows)
+    write_version(meta_worksheet, version + 1, journal_row_count + len(rows))
+    return version + 1, journal_row_count + len(rows)
+
+
+# --- Write Lease ---
+# Sheets has no compare-and-swap, so trips writers in different processes take turns through a
+# lease row in Meta (A4:C4: "Write Lease", holder, expiry as a Unix time). A writer claims a
+# free or expired lease, pauses and reads it back: of two claims made at once the later one
+# wins, and the other writer backs off and tries again. The version is read under the lease,
+# so the version a writer records is never stale.
+
+
+class WriteLeaseBusy(Exception):
+    """Another writer held the write lease for longer than the writer was willing to wait."""
+
+
+def _read_lease(meta_worksheet):
+    values = meta_worksheet.get("B4:C4")
+    try:
+        return str(values[0][0]), float(values[0][1])
+    except (IndexError, ValueError, TypeError):
+        return "", 0.0
+
+
+def acquire_write_lease(meta_worksheet, holder, wait_seconds=WRITE_LEASE_WAIT_SECONDS):
+    """Claims the write lease for `holder`, waiting up to `wait_seconds` for a busy one."""
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        current, expires = _read_lease(meta_worksheet)
+        if not current or current == holder or expires < time.time():
+            meta_worksheet.update(range_name="A4:C4",
+                                  values=[["Write Lease", holder, time.time() + WRITE_LEASE_SECONDS]])
+            time.sleep(WRITE_LEASE_SETTLE_SECONDS)
+            current, _ = _read_lease(meta_worksheet)
+            if current == holder:
+                return
+        if time.monotonic() >= deadline:
+            raise WriteLeaseBusy("Another writer is saving trips; try again in a moment.")
+        time.sleep(random.uniform(0.2, 1.0))  # Spread retries out, so claims rarely collide twice
+
+
+def release_write_lease(meta_worksheet, holder):
+    """Frees the write lease if `holder` still has it."""
+    if _read_lease(meta_worksheet)[0] == holder:
+        meta_worksheet.update(range_name="A4:C4", values=[["Write Lease", "", 0]])
+
+
+@contextmanager
+def write_lease(meta_worksheet, holder):
+    """Holds the write lease for the enclosed trips write."""
+    acquire_write_lease(meta_worksheet, holder)
+    try:
+        yield
+    finally:
+        release_write_lease(meta_worksheet, holder)
+
+
+# --- Latest Odometer Summary ---
+
+
+def write_odometer_rows(odometer_worksheet, summary, vehicles, updated_at):
+    """Rewrites the per-vehicle latest odometer summary in one request."""
+    rows = summary_rows(summary, vehicles, updated_at)
+    # The header is rewritten too, so sheets created before a column was added pick it up
+    odometer_worksheet.update(range_name=f"A1:F{len(rows) + 1}", values=[ODOMETER_INDEX_COLUMNS] + rows)
+
+
+def write_odometer_row(odometer_worksheet, vehicle, entry, updated_at):
+    """Rewrites one vehicle's summary row, found by name (appended if the vehicle has none yet).
+
+    The rows follow the catalog order of the last full rewrite, which the catalog may have
+    changed since, so the row is looked up rather than taken from the vehicle's position.
+    """
+    names = odometer_worksheet.col_values(1)
+    row_number = names.index(vehicle, 1) + 1 if vehicle in names[1:] else max(len(names), 1) + 1
+    row = summary_rows({vehicle: entry}, [vehicle], updated_at)[0]
+    odometer_worksheet.update(range_name=f"A{row_number}:F{row_number}", values=[row])
+
+
+def read_odometer_rows(odometer_worksheet):
+    """Reads {vehicle: (latest End KM, latest date)} from the odometer summary in one request."""
+    return parse_summary_rows(odometer_worksheet.get("A2:C"))
+
+
+def read_odometer_details(odometer_worksheet):
+    """Reads {vehicle: (latest End KM, latest date, trip id, Accumulated KM)} in one request."""
+    return parse_summary_details(odometer_worksheet.get("A2:F"))
+
+
+# --- Catalog ---
+
+
+def read_catalog(catalog_worksheet):
+    """Reads the Catalog worksheet into a Catalog (config.py lists for kinds it does not list)."""
+    return parse_catalog_rows(catalog_worksheet.get_all_records())
+
+
+def write_catalog(catalog_worksheet, catalog):
+    """Replaces the Catalog worksheet contents with a catalog's entries."""
+    catalog_worksheet.clear()
+    catalog_worksheet.update(range_name="A1", values=[GSHEETS_CATALOG_COLUMNS] + catalog_rows(catalog))
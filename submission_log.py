@@ -0,0 +1,48 @@
+# submission_log.py
+
+import threading
+from collections import OrderedDict
+
+from config import SUBMISSION_TOKEN_HISTORY
+
+# Idempotency tokens for trip submissions. Each form render (or API request) carries a token;
+# the first submission with it claims the token and stores what it produced, so a double click,
+# a rerun or a client retry that sends the same token again gets that result back instead of
+# writing the trip a second time.
+
+_PENDING = object()
+
+
+class SubmissionLog:
+    """Remembers the outcome of the last `history` submissions by token (thread-safe)."""
+
+    def __init__(self, history=SUBMISSION_TOKEN_HISTORY):
+        self.history = history
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, token):
+        """Reserves `token` for a new submission.
+
+        Returns (True, None) if the token is new, otherwise (False, result) with the stored
+        result of the earlier submission (None while that one is still running).
+        """
+        with self._lock:
+            if token in self._results:
+                result = self._results[token]
+                return False, None if result is _PENDING else result
+            self._results[token] = _PENDING
+            while len(self._results) > self.history:
+                self._results.popitem(last=False)
+            return True, None
+
+    def complete(self, token, result=True):
+        """Stores the result of a claimed submission; later claims of the token return it."""
+        with self._lock:
+            self._results[token] = result
+
+    def release(self, token):
+        """Forgets a claimed token whose submission failed, so it can be submitted again."""
+        with self._lock:
+            if self._results.get(token) is _PENDING:
+                del self._results[token]
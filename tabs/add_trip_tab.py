@@ -1,9 +1,13 @@
 # tabs/add_trip_tab.py
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta  # Added timedelta
-from utils import get_drivers_list, add_trip
-from config import VEHICLE_OPTIONS, STORE_REGION_MAPPING
+from utils import (get_catalog, add_trip, get_authoritative_latest_end_km, check_km_anomaly,
+                   feed_seq, changed_since, refresh_live_data, new_submission_token)
+from change_feed import CHANGE_TRIPS
+from config import CHANGE_FEED_POLL_SECONDS
+from route_distance import check_route_distance
+from trip_core import latest_end_km
+from trip_validation import basic_trip_errors
 import time
 
 
@@ -11,47 +15,36 @@ def get_latest_end_km(vehicle):
     """Finds the End KM of the latest trip for a given vehicle."""
     if not vehicle or vehicle == "" or 'trips' not in st.session_state or not st.session_state.trips:
         return 0
-    latest_trip_for_vehicle = None
     try:
-        valid_trips = [
-            trip for trip in st.session_state.trips
-            if isinstance(trip.get("Date"), str) and trip.get("Date")
-        ]
-        parsed_trips = []
-        for trip in valid_trips:
-            try:
-                datetime.strptime(trip["Date"], '%Y-%m-%d')
-                parsed_trips.append(trip)
-            except ValueError:
-                pass
-        sorted_trips = sorted(
-            parsed_trips,
-            key=lambda x: datetime.strptime(x["Date"], '%Y-%m-%d'),
-            reverse=True
-        )
+        return latest_end_km(st.session_state.trips, vehicle)
     except TypeError as e:
         st.error(f"Error processing trip data structure: {e}.")
         return 0
 
-    for trip in sorted_trips:
-        if trip.get("Vehicle") == vehicle:
-            latest_trip_for_vehicle = trip
-            break
-    if latest_trip_for_vehicle:
-        end_km = latest_trip_for_vehicle.get("End KM", 0)
-        try:
-            if pd.notna(end_km):
-                end_km_str = str(end_km).strip()
-                if end_km_str.replace('.', '', 1).isdigit():
-                    return int(float(end_km_str))
-                else:
-                    return 0
-            else:
-                return 0
-        except (ValueError, TypeError):
-            return 0
+
+@st.fragment(run_every=CHANGE_FEED_POLL_SECONDS)
+def display_latest_end_km():
+    """The latest End KM line; redrawn on its own when another session saves a trip for the vehicle."""
+    refresh_live_data()
+    vehicle, latest_end_km_value, form_end_km, seen = st.session_state.add_trip_latest_km
+    if vehicle and changed_since(seen, CHANGE_TRIPS, {vehicle}):
+        seen = feed_seq()
+        latest_end_km_value = get_latest_end_km(vehicle)
+        st.session_state.add_trip_latest_km = (vehicle, latest_end_km_value, form_end_km, seen)
+
+    if vehicle:
+        if latest_end_km_value > 0:
+            st.markdown(
+                f"The latest End KM recorded for **{vehicle}** is: **{latest_end_km_value}**")
+        else:
+            st.markdown(
+                f"No previous End KM found for **{vehicle}**.")
+        if latest_end_km_value != form_end_km:
+            st.info(f"A trip for {vehicle} was just saved in another session; "
+                    f"Start KM should now be {latest_end_km_value}.")
     else:
-        return 0
+        st.markdown(
+            "*(Select a Vehicle above to see its latest recorded End KM)*")
 
 
 def display_add_trip_tab():
@@ -61,10 +54,13 @@ def display_add_trip_tab():
     if 'trip_added' in st.session_state and st.session_state.trip_added:
         st.session_state.add_trip_vehicle_select = ""
         st.session_state.trip_added = False
+        st.session_state.add_trip_token = new_submission_token()  # The next form is a new submission
         # Clean up any bypass flags related to previous attempts
         for key in list(st.session_state.keys()):
-            if key.startswith('bypass_warning_'):
+            if key.startswith(('bypass_warning_', 'bypass_distance_', 'bypass_anomaly_')):
                 del st.session_state[key]
+    if 'add_trip_token' not in st.session_state:
+        st.session_state.add_trip_token = new_submission_token()
     # --------------------------------------------------
 
     st.header("Add New Trip")
@@ -72,31 +68,24 @@ def display_add_trip_tab():
     #st.warning(
         #"🔴 Always cross check the start kms matches the previous trip of the corresponding Vehicle type")
 
-    drivers = get_drivers_list()
-    store_mapping = STORE_REGION_MAPPING
-    all_stores_flat = sorted(
-        [store for region_stores in store_mapping.values() for store in region_stores])
+    catalog = get_catalog()  # Presorted, shared option lists
+    drivers = catalog.driver_options
+    store_mapping = catalog.regions
 
     selected_vehicle = st.selectbox(
         "Vehicle:",
-        options=VEHICLE_OPTIONS,
+        options=catalog.vehicle_options,
         key="add_trip_vehicle_select",
         index=0,
         format_func=lambda x: "Select Vehicle..." if x == "" else x
     )
 
     latest_end_km_value = 0
+    seen = feed_seq()  # Taken first, so a save during the lookup still shows up
     if selected_vehicle and selected_vehicle != "":
         latest_end_km_value = get_latest_end_km(selected_vehicle)
-        if latest_end_km_value > 0:
-            st.markdown(
-                f"The latest End KM recorded for **{selected_vehicle}** is: **{latest_end_km_value}**")
-        else:
-            st.markdown(
-                f"No previous End KM found for **{selected_vehicle}**.")
-    else:
-        st.markdown(
-            "*(Select a Vehicle above to see its latest recorded End KM)*")
+    st.session_state.add_trip_latest_km = (selected_vehicle, latest_end_km_value, latest_end_km_value, seen)
+    display_latest_end_km()
 
     start_km_default = latest_end_km_value if latest_end_km_value > 0 else 0
 
@@ -138,7 +127,6 @@ def display_add_trip_tab():
         st.subheader("Route (Select Stores by Region)")
         selected_stores = []
         for region, stores in store_mapping.items():
-            stores.sort()
             selected_region_stores = st.multiselect(
                 f"{region}:", options=stores, key=f"add_route_select_{region}")
             selected_stores.extend(selected_region_stores)
@@ -155,21 +143,10 @@ def display_add_trip_tab():
                 st.error("Please enter valid numbers for Start KM and End KM.")
                 st.stop()
 
-            error_messages = []
             final_selected_vehicle = st.session_state.add_trip_vehicle_select
             final_selected_driver = st.session_state.add_trip_driver_select
-
-            if not final_selected_vehicle or final_selected_vehicle == "":
-                error_messages.append("Vehicle is required.")
-            if start_km_value < 0:
-                error_messages.append("Start KM cannot be negative.")
-            if end_km_value < start_km_value:
-                error_messages.append("End KM cannot be less than Start KM.")
-            if not final_selected_driver or final_selected_driver == "":
-                error_messages.append("Driver Name is required.")
-            if not add_route_list:
-                error_messages.append(
-                    "Please select at least one Store for the Route.")
+            error_messages = basic_trip_errors(final_selected_vehicle, final_selected_driver,
+                                               start_km_value, end_km_value, add_route_list)
 
             # --- NEW: Previous Day Check ---
             previous_day_not_filled_warning_triggered = False
@@ -200,12 +177,35 @@ def display_add_trip_tab():
 
             final_latest_end_km = 0  # Recalculate for current vehicle just in case
             if final_selected_vehicle and final_selected_vehicle != "":
-                final_latest_end_km = get_latest_end_km(final_selected_vehicle)
+                # Check against the sheet's latest odometer summary (one small read), since
+                # another driver may have logged a trip after this session loaded its data
+                final_latest_end_km = get_authoritative_latest_end_km(
+                    final_selected_vehicle, fallback=get_latest_end_km(final_selected_vehicle))
 
             if final_selected_vehicle and final_latest_end_km > 0 and start_km_value != final_latest_end_km:
                 error_messages.append(
                     f"Start KM ({start_km_value}) must match the latest recorded End KM ({final_latest_end_km}) for {final_selected_vehicle}.")
 
+            # --- Route distance plausibility (warning, can be bypassed like the previous-day check) ---
+            if not error_messages:
+                distance_warning = check_route_distance(add_route_list, start_km_value, end_km_value)
+                distance_bypass_key = f'bypass_distance_{final_selected_vehicle}_{add_date.strftime("%Y%m%d")}_{start_km_value}_{end_km_value}'
+                if distance_warning and not st.session_state.get(distance_bypass_key, False):
+                    st.warning(distance_warning + " Click 'Add Trip' again to submit anyway.")
+                    st.session_state[distance_bypass_key] = True
+                    st.stop()
+
+                # --- Daily KM outlier for this vehicle or driver (same bypass pattern) ---
+                anomaly_warnings = check_km_anomaly(add_date, final_selected_vehicle, final_selected_driver,
+                                                    start_km_value, end_km_value)
+                anomaly_bypass_key = f'bypass_anomaly_{final_selected_vehicle}_{add_date.strftime("%Y%m%d")}_{start_km_value}_{end_km_value}'
+                if anomaly_warnings and not st.session_state.get(anomaly_bypass_key, False):
+                    for warning in anomaly_warnings:
+                        st.warning(warning)
+                    st.warning("Click 'Add Trip' again to submit anyway.")
+                    st.session_state[anomaly_bypass_key] = True
+                    st.stop()
+
             if error_messages:
                 for msg in error_messages:
                     st.error(msg)
@@ -213,7 +213,8 @@ def display_add_trip_tab():
                 # we might want to unset it to force re-acknowledgment if those other errors are fixed.
                 # However, for simplicity, we'll let it persist as the user already acknowledged it once.
             else:
-                if add_trip(add_date, final_selected_vehicle, start_km_value, end_km_value, final_selected_driver, add_route_list, add_remarks):
+                if add_trip(add_date, final_selected_vehicle, start_km_value, end_km_value, final_selected_driver, add_route_list, add_remarks,
+                            token=st.session_state.add_trip_token):
                     st.session_state.trip_added = True  # This will trigger cleanup at the top
                     # Explicitly clean the specific bypass flag that was used for this successful submission
                     if bypass_flag_key in st.session_state:
@@ -0,0 +1,141 @@
+# tabs/driver_entry_tab.py
+import streamlit as st
+from datetime import datetime, timedelta
+from utils import (get_catalog, initialize_session_defaults, initialize_state, load_reference_data,
+                   read_odometer_details, append_trip_without_history, add_trip, check_km_anomaly,
+                   feed_seq, changed_since, new_submission_token)
+from change_feed import CHANGE_TRIPS
+from config import CHANGE_FEED_POLL_SECONDS
+from route_distance import check_route_distance
+from trip_validation import basic_trip_errors
+import time
+
+
+def confirm_warnings(key, messages):
+    """Shows warnings once and stops; the same submission goes through on the next click."""
+    if messages and not st.session_state.get(key, False):
+        for message in messages:
+            st.warning(message)
+        st.warning("Click 'Add Trip' again to submit anyway.")
+        st.session_state[key] = True
+        st.stop()
+
+
+@st.fragment(run_every=CHANGE_FEED_POLL_SECONDS)
+def display_latest_reading(vehicle, form_end_km):
+    """The vehicle's latest reading; re-read only when another session of this server saves a trip for it."""
+    if vehicle and changed_since(st.session_state.driver_odometer_seq, CHANGE_TRIPS, {vehicle}):
+        st.session_state.driver_odometer_seq = feed_seq()
+        try:
+            st.session_state.driver_odometer = read_odometer_details()
+        except Exception:
+            pass  # Checked again on submit
+    latest_end_km, latest_date, _, _ = st.session_state.driver_odometer.get(vehicle, (None, "", "", None))
+    if vehicle and latest_end_km is not None:
+        st.markdown(f"The latest End KM recorded for **{vehicle}** is: **{latest_end_km}** ({latest_date})")
+        if latest_end_km != form_end_km:
+            st.info(f"Another trip for {vehicle} was just saved; Start KM should now be {latest_end_km}.")
+    elif vehicle:
+        st.markdown(f"No previous End KM found for **{vehicle}**.")
+
+
+def display_driver_entry():
+    """Quick trip entry for drivers: reads only the odometer summary and catalog, appends one row."""
+    initialize_session_defaults()
+
+    if st.session_state.get('driver_trip_added'):
+        st.session_state.driver_vehicle_select = ""
+        st.session_state.driver_trip_added = False
+        st.session_state.driver_trip_token = new_submission_token()
+        for key in list(st.session_state.keys()):
+            if key.startswith('bypass_driver_'):
+                del st.session_state[key]
+
+    if 'driver_trip_token' not in st.session_state:
+        st.session_state.driver_trip_token = new_submission_token()
+
+    st.header("Log a Trip")
+    catalog = get_catalog()
+
+    # One small read per visit; refreshed on submit so another driver's trip is not missed
+    if st.session_state.get('driver_odometer') is None:
+        st.session_state.driver_odometer_seq = feed_seq()
+        try:
+            st.session_state.driver_odometer = read_odometer_details()
+        except Exception as e:
+            st.error(f"Could not read the latest odometer readings: {e}")
+            st.session_state.driver_odometer = {}
+
+    vehicle = st.selectbox("Vehicle:", options=catalog.vehicle_options, key="driver_vehicle_select",
+                           format_func=lambda x: "Select Vehicle..." if x == "" else x)
+    latest_end_km, _, _, _ = st.session_state.driver_odometer.get(vehicle, (None, "", "", None))
+    display_latest_reading(vehicle, latest_end_km)
+
+    with st.form("driver_trip_form"):
+        trip_date = st.date_input("Date:", datetime.now().date(), key="driver_trip_date")
+        start_km_value = int(st.number_input("Start KM:", min_value=0, value=latest_end_km or 0, step=1,
+                                             key="driver_start_km"))
+        end_km_value = int(st.number_input("End KM:", min_value=0, value=latest_end_km or 0, step=1,
+                                           key="driver_end_km"))
+        driver = st.selectbox("Driver Name:", options=catalog.driver_options, key="driver_name_select",
+                              format_func=lambda x: "Select Driver..." if x == "" else x)
+        st.subheader("Route")
+        route_list = []
+        for region, stores in catalog.regions.items():
+            route_list.extend(st.multiselect(f"{region}:", options=stores, key=f"driver_route_{region}"))
+        remarks = st.text_area("Remarks:", key="driver_remarks")
+        submitted = st.form_submit_button("Add Trip", use_container_width=True)
+
+    if not submitted:
+        return
+
+    error_messages = basic_trip_errors(vehicle, driver, start_km_value, end_km_value, route_list)
+    if error_messages:
+        for msg in error_messages:
+            st.error(msg)
+        return
+
+    # Same checks as the Add Trip tab, answered from the odometer summary instead of the history
+    try:
+        st.session_state.driver_odometer_seq = feed_seq()
+        st.session_state.driver_odometer = read_odometer_details()
+    except Exception as e:
+        st.error(f"Could not read the latest odometer readings: {e}")
+        return
+    latest = st.session_state.driver_odometer.get(vehicle)
+    latest_end_km, latest_date = (latest[0], latest[1]) if latest else (None, "")
+    if latest_end_km is not None and latest_end_km > 0 and start_km_value != latest_end_km:
+        st.error(f"Start KM ({start_km_value}) must match the latest recorded End KM ({latest_end_km}) for {vehicle}.")
+        return
+
+    date_key = trip_date.strftime("%Y%m%d")
+    previous_day = (trip_date - timedelta(days=1)).strftime('%Y-%m-%d')
+    if latest_date and latest_date < previous_day:
+        confirm_warnings(f'bypass_driver_previous_{vehicle}_{date_key}', [
+            f"Previous day ({previous_day}) has not been filled for Vehicle {vehicle} "
+            f"(latest trip: {latest_date}). Ensure the date is correct."])
+    distance_warning = check_route_distance(route_list, start_km_value, end_km_value)
+    confirm_warnings(f'bypass_driver_distance_{vehicle}_{date_key}_{start_km_value}_{end_km_value}',
+                     [distance_warning] if distance_warning else [])
+    confirm_warnings(f'bypass_driver_anomaly_{vehicle}_{date_key}_{start_km_value}_{end_km_value}',
+                     check_km_anomaly(trip_date, vehicle, driver, start_km_value, end_km_value))
+
+    load_reference_data()  # Plates, for the plate the vehicle carried on the trip date
+    # Usually the trip follows the vehicle's latest one and Accumulated KM simply continues from it
+    follows_latest = latest is None or latest_end_km is None or \
+        (latest_date <= trip_date.strftime('%Y-%m-%d') and latest[3] is not None)
+    if follows_latest:
+        added = append_trip_without_history(trip_date, vehicle, start_km_value, end_km_value, driver,
+                                            route_list, remarks, latest,
+                                            token=st.session_state.driver_trip_token)
+    else:
+        # A trip dated before the vehicle's latest one shifts later Accumulated KM values,
+        # so only this case needs the full history
+        initialize_state()
+        added = add_trip(trip_date, vehicle, start_km_value, end_km_value, driver, route_list, remarks,
+                         token=st.session_state.driver_trip_token)
+    if added:
+        st.session_state.driver_trip_added = True
+        st.session_state.driver_odometer = None
+        time.sleep(1)
+        st.rerun()
@@ -1,18 +1,17 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from utils import get_drivers_list, update_trip, delete_trip
-from config import VEHICLE_OPTIONS, STORE_REGION_MAPPING
+from utils import get_catalog, update_trip, delete_trip, get_data_version, check_km_anomaly
+from trip_query import TripQuery, run_trip_query
+from route_distance import check_route_distance
 
 
 def display_edit_trip_tab():
     st.header("Edit Existing Trip")
 
     # Sort trips by date in descending order (latest first)
-    sorted_trips = sorted(st.session_state.trips,
-                          key=lambda x: datetime.strptime(
-                              x['Date'], '%Y-%m-%d'),
-                          reverse=True)
+    sorted_trips = run_trip_query(get_data_version(), st.session_state.trips.rows(),
+                                  TripQuery(sort=(("Date", True),)))
 
     # Create options list for selectbox
     edit_options = ["-- Select a Trip --"] + [
@@ -32,8 +31,9 @@ def display_edit_trip_tab():
                 break
 
     if selected_trip:
-        store_mapping = STORE_REGION_MAPPING
-        drivers = get_drivers_list()
+        catalog = get_catalog()  # Presorted, shared option lists
+        store_mapping = catalog.regions
+        drivers = catalog.driver_options
 
         # Create two columns - form and delete button
         form_col, delete_col = st.columns([3, 1])
@@ -50,7 +50,7 @@ def display_edit_trip_tab():
 
                 # Vehicle selection
                 try:
-                    vehicle_options_clean = [v for v in VEHICLE_OPTIONS if v]
+                    vehicle_options_clean = catalog.vehicles
                     vehicle_index = vehicle_options_clean.index(
                         selected_trip["Vehicle"])
                 except ValueError:
@@ -92,7 +92,6 @@ def display_edit_trip_tab():
                     store.strip() for store in selected_trip["Route"].split(',') if store.strip()]
 
                 for region, stores in store_mapping.items():
-                    stores.sort()
                     default_selection = [
                         store for store in stores if store in current_route_list]
                     selected_region_stores = st.multiselect(
@@ -147,11 +146,28 @@ def display_edit_trip_tab():
                 st.stop()
 
             if edit_vehicle and edit_driver and edit_route_list:
-                update_trip(edit_trip_id, edit_date, edit_vehicle, start_km_value, end_km_value,
-                            edit_driver, edit_route_list, edit_remarks, edit_edited_by, edit_fleet_change)
-                if f'confirm_delete_{edit_trip_id}' in st.session_state:
-                    del st.session_state[f'confirm_delete_{edit_trip_id}']
-                st.rerun()
+                # Warn once about a KM implausible for the selected stores; saving again confirms
+                distance_warning = check_route_distance(edit_route_list, start_km_value, end_km_value)
+                distance_bypass_key = f'bypass_distance_{edit_trip_id}_{start_km_value}_{end_km_value}'
+                if distance_warning and not st.session_state.get(distance_bypass_key, False):
+                    st.warning(distance_warning + " Click 'Save Changes' again to save anyway.")
+                    st.session_state[distance_bypass_key] = True
+                    st.stop()
+                # Same for a day KM that is an outlier for the vehicle or driver
+                anomaly_warnings = check_km_anomaly(edit_date, edit_vehicle, edit_driver,
+                                                    start_km_value, end_km_value, edit_trip_id)
+                anomaly_bypass_key = f'bypass_anomaly_{edit_trip_id}_{start_km_value}_{end_km_value}'
+                if anomaly_warnings and not st.session_state.get(anomaly_bypass_key, False):
+                    for warning in anomaly_warnings:
+                        st.warning(warning)
+                    st.warning("Click 'Save Changes' again to save anyway.")
+                    st.session_state[anomaly_bypass_key] = True
+                    st.stop()
+                if update_trip(edit_trip_id, edit_date, edit_vehicle, start_km_value, end_km_value,
+                               edit_driver, edit_route_list, edit_remarks, edit_edited_by, edit_fleet_change):
+                    if f'confirm_delete_{edit_trip_id}' in st.session_state:
+                        del st.session_state[f'confirm_delete_{edit_trip_id}']
+                    st.rerun()
             else:
                 st.error(
                     "Please fill in all required fields (Vehicle, Driver Name, and select at least one Store for Route).")
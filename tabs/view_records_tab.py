@@ -3,140 +3,60 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-# count_stores_in_route is not used for this specific change
-from utils import filter_trips,load_vehicle_plates_from_gsheets
-from config import VEHICLE_OPTIONS
-
-
-def display_view_records_tab():
-    """Displays the UI and handles logic for the View Records tab."""
-    st.header("KM Records")
-    vehicle_details = pd.DataFrame(load_vehicle_plates_from_gsheets())
-    vehicle_details= vehicle_details.drop('Comments', axis=1)
-    st.header("Vehicle Details")
-    st.dataframe(vehicle_details, hide_index=True, use_container_width=True)
-
-    st.markdown
-    # --- Filters ---
-    st.subheader("Filter Records")
-    col_date1, col_date2 = st.columns(2)
-    with col_date1:
-        filter_start_date = st.date_input("Start Date:", datetime.now().replace(
-            day=1), key="filter_start_date")
-    with col_date2:
-        filter_end_date = st.date_input(
-            "End Date:", datetime.now(), key="filter_end_date")
-
-    filter_vehicle_selectbox = st.selectbox("Filter by Vehicle:", VEHICLE_OPTIONS + [
-        "All"], index=len(VEHICLE_OPTIONS), key="filter_vehicle_select")
-
-    filtered_trips_list = filter_trips(
-        st.session_state.trips, filter_start_date, filter_end_date, filter_vehicle_selectbox
-    )
-
-    # --- Sorting Options ---
-    st.subheader("Sort Records")
-    sort_options = {
-        "Date (Latest First)": ("Date", True),
-        "Date (Oldest First)": ("Date", False),
-        # Secondary sort (Date) Ascending
-        "Vehicle then Date (A-Z)": ("Vehicle", False, "Date", True),
-        # Secondary sort (Date) Ascending
-        "Vehicle then Date (Z-A)": ("Vehicle", True, "Date", True),
-    }
-    sort_by = st.selectbox("Sort By:", options=list(
-        sort_options.keys()), key="view_records_sort_by")
-
-    # Make a mutable copy for sorting and modification
-    processed_trips_for_display = list(filtered_trips_list)
-
-    sort_params = sort_options[sort_by]
-    if len(sort_params) == 2:
-        try:
-            # Ensure date conversion for sorting
-            processed_trips_for_display.sort(
-                key=lambda x: datetime.strptime(
-                    x.get(sort_params[0], '1900-01-01'), '%Y-%m-%d')
-                # Handle None dates
-                if x.get(sort_params[0]) else datetime.min,
-                reverse=sort_params[1]
-            )
-        except (ValueError, TypeError) as e:
-            st.warning(
-                f"Could not sort by {sort_params[0]}. Ensure date format is YYYY-MM-DD. Error: {e}")
-    elif len(sort_params) == 4:  # Multi-level sort
-        try:
-            # Sort by secondary key (Date) first
-            processed_trips_for_display.sort(
-                key=lambda x: datetime.strptime(
-                    x.get(sort_params[2], '1900-01-01'), '%Y-%m-%d')
-                # Handle None dates
-                if x.get(sort_params[2]) else datetime.min,
-                reverse=sort_params[3]  # Date direction as per user choice
-            )
-            # Then sort by primary key (Vehicle)
-            processed_trips_for_display.sort(
-                # Handle None vehicle names
-                key=lambda x: x.get(sort_params[0], ''),
-                reverse=sort_params[1]
-            )
-        except (ValueError, TypeError) as e:
-            st.warning(
-                f"Could not perform multi-level sort. Ensure data integrity. Error: {e}")
+from utils import (get_data_version, get_plate_timeline, get_catalog, feed_seq, changed_since,
+                   refresh_live_data, depot_trips_in_range)
+from change_feed import CHANGE_TRIPS
+from config import GSHEETS_TRIPS_COLUMNS, CHANGE_FEED_POLL_SECONDS
+from exports import EXPORT_FORMATS, ENCODERS, iter_export_frames, lazy_trip_export, export_file_name, export_mime
+from batch_reports import REPORT_FORMATS, EXCEL_AVAILABLE, generate_batch_reports
+from background_jobs import (
+    get_derived_result, MONTHLY_AGGREGATES_JOB, AUDIT_JOB, ROUTE_CHECK_JOB,
+    ANOMALY_JOB, DUPLICATES_JOB
+)
+from trip_query import TripQuery, TripTable, run_trip_query, run_store_count_query
+from trip_core import period_accumulated_km, monthly_vehicle_summary
+from depots import MULTI_DEPOT, merge_depot_frames, merge_depot_trips
+
+# The filtered export carries the period accumulator alongside the stored columns
+FILTERED_EXPORT_COLUMNS = GSHEETS_TRIPS_COLUMNS + ["Accumulated KM (Filtered)"]
+
+
+def derived_caption(result):
+    """Caption saying when background-computed data was built."""
+    return f"Computed in the background at {result['computed_at'].strftime('%Y-%m-%d %H:%M:%S')}."
+
+
+def query_records(records_query):
+    """Runs the records query and adds the display-only "Accumulated KM (Filtered)" column."""
+    # Served from the shared query cache when the data and filters have not changed
+    processed_trips_for_display = list(run_trip_query(
+        get_data_version(), st.session_state.trips.rows(), records_query))
 
     # --- NEW: Calculate Accumulated KM for Filtered Period ---
     if processed_trips_for_display:
-        # Create a temporary list of trips sorted by Vehicle (asc), then Date (asc) for accurate calculation
-        # This ensures chronological processing per vehicle regardless of display sort.
-        trips_for_calc = sorted(
-            processed_trips_for_display,
-            key=lambda x: (
-                x.get('Vehicle', ''),
-                datetime.strptime(x.get('Date', '1900-01-01'),
-                                  '%Y-%m-%d') if x.get('Date') else datetime.min
-            )
-        )
-
-        vehicle_last_filtered_accum_km = {}
-        trip_id_to_filtered_accum_km = {}  # Using trip ID as a robust key
+        # Chronological per vehicle regardless of display sort (see trip_core.period_accumulated_km)
+        trip_id_to_filtered_accum_km = period_accumulated_km(processed_trips_for_display)
+
+        # Add the calculated "Accumulated KM (Filtered)" to a copy of each trip in the display list,
+        # so the display-only column never ends up in the stored trips or the full export
+        processed_trips_for_display = [
+            {**trip_in_display_list,
+             "Accumulated KM (Filtered)": trip_id_to_filtered_accum_km.get(trip_in_display_list.get("id")) or 0}
+            for trip_in_display_list in processed_trips_for_display
+        ]
+    # --- END NEW ---
+    return processed_trips_for_display
 
-        for trip in trips_for_calc:
-            trip_id = trip.get("id")
-            if not trip_id:  # Should not happen if IDs are always generated
-                continue
 
-            vehicle = trip.get("Vehicle")
-            start_km_val = trip.get("Start KM", 0)
-            end_km_val = trip.get("End KM", 0)
-
-            try:
-                # Ensure KM values are numeric, defaulting to 0 if problematic
-                current_start_km = int(float(start_km_val)) if pd.notna(
-                    start_km_val) and str(start_km_val).replace('.', '', 1).isdigit() else 0
-                current_end_km = int(float(end_km_val)) if pd.notna(
-                    end_km_val) and str(end_km_val).replace('.', '', 1).isdigit() else 0
-            except (ValueError, TypeError):
-                current_start_km = 0
-                current_end_km = 0
-                # st.warning(f"Invalid KM data for trip ID {trip_id} on {trip.get('Date')}. Using 0 for calculation.")
-
-            daily_km_delta = current_end_km - current_start_km
-
-            if vehicle not in vehicle_last_filtered_accum_km:
-                trip_filtered_accum_km = daily_km_delta
-            else:
-                trip_filtered_accum_km = vehicle_last_filtered_accum_km[vehicle] + \
-                    daily_km_delta
-
-            vehicle_last_filtered_accum_km[vehicle] = trip_filtered_accum_km
-            trip_id_to_filtered_accum_km[trip_id] = trip_filtered_accum_km
-
-        # Add the calculated "Accumulated KM (Filtered)" to each trip in the display list
-        for trip_in_display_list in processed_trips_for_display:
-            calc_km = trip_id_to_filtered_accum_km.get(
-                trip_in_display_list.get("id"))
-            trip_in_display_list["Accumulated KM (Filtered)"] = calc_km if calc_km is not None else 0
-    # --- END NEW ---
+@st.fragment(run_every=CHANGE_FEED_POLL_SECONDS)
+def display_latest_trips():
+    """The latest filtered trips; re-queried on its own when another session saves a matching trip."""
+    refresh_live_data()
+    records_query, processed_trips_for_display, seen = st.session_state.records_view
+    if changed_since(seen, CHANGE_TRIPS, records_query.vehicles):
+        seen = feed_seq()
+        processed_trips_for_display = query_records(records_query)
+        st.session_state.records_view = (records_query, processed_trips_for_display, seen)
 
     latest_10_trips_display = processed_trips_for_display[:10]
 
@@ -174,34 +94,141 @@ def display_view_records_tab():
     else:
         st.info("No trip records found matching the filters.")
 
+
+@st.fragment(run_every=CHANGE_FEED_POLL_SECONDS)
+def display_vehicle_details():
+    """Current plates from the session, kept up to date by the change feed and the shared cache (no sheet read per rerun)."""
+    refresh_live_data()
+    vehicle_details = st.session_state.df_vehicles.drop(columns='Comments', errors='ignore')
+    st.dataframe(vehicle_details, hide_index=True, use_container_width=True)
+
+
+def display_all_depots_section(export_format):
+    """Monthly summary, store counts and a trip export over every depot, loaded in parallel."""
+    st.subheader("All Depots")
+    st.caption("Saved trips of every depot; this session still works on its own depot only.")
+    depots_col1, depots_col2 = st.columns(2)
+    with depots_col1:
+        depots_start_date = st.date_input("Start Date (all depots):", datetime.now().replace(day=1),
+                                          key="depots_start_date")
+    with depots_col2:
+        depots_end_date = st.date_input("End Date (all depots):", datetime.now(), key="depots_end_date")
+
+    if st.button("Build All-Depot Report", key="depots_report_btn"):
+        with st.spinner("Loading every depot..."):
+            try:
+                trips_by_depot = depot_trips_in_range(depots_start_date, depots_end_date)
+            except Exception as e:
+                st.error(f"Could not load every depot: {e}")
+                return
+        summary = merge_depot_frames({key: monthly_vehicle_summary(trips) for key, trips in trips_by_depot.items()})
+        st.dataframe(summary, hide_index=True, use_container_width=True)
+
+        store_frames = {}
+        for key, trips in trips_by_depot.items():
+            table = TripTable(trips)
+            store_frames[key] = pd.DataFrame(table.store_counts(table.select(TripQuery())), columns=["Store", "Count"])
+        date_label = f"{depots_start_date.strftime('%Y%m%d')}_to_{depots_end_date.strftime('%Y%m%d')}"
+        all_trips = merge_depot_trips(trips_by_depot)
+        st.download_button(
+            label=f"Download {len(all_trips)} Trip(s) from All Depots",
+            data=ENCODERS[export_format](iter_export_frames(all_trips, ["Depot"] + GSHEETS_TRIPS_COLUMNS)),
+            file_name=export_file_name(f"rotiroute_all_depots_{date_label}", export_format),
+            mime=export_mime(export_format),
+            key="download_all_depots_trips"
+        )
+        st.download_button(
+            label="Download Store Counts from All Depots",
+            data=merge_depot_frames(store_frames).to_csv(index=False).encode('utf-8'),
+            file_name=f"rotiroute_all_depots_store_counts_{date_label}.csv",
+            mime="text/csv",
+            key="download_all_depots_store_counts"
+        )
+
+
+def display_view_records_tab():
+    """Displays the UI and handles logic for the View Records tab."""
+    st.header("KM Records")
+    st.header("Vehicle Details")
+    display_vehicle_details()
+
+    st.markdown
+    # --- Filters ---
+    st.subheader("Filter Records")
+    col_date1, col_date2 = st.columns(2)
+    with col_date1:
+        filter_start_date = st.date_input("Start Date:", datetime.now().replace(
+            day=1), key="filter_start_date")
+    with col_date2:
+        filter_end_date = st.date_input(
+            "End Date:", datetime.now(), key="filter_end_date")
+
+    vehicle_options = get_catalog().vehicle_options
+    filter_vehicle_selectbox = st.selectbox("Filter by Vehicle:", vehicle_options + (
+        "All",), index=len(vehicle_options), key="filter_vehicle_select")
+
+    # --- Sorting Options ---
+    st.subheader("Sort Records")
+    # Each option is a TripQuery sort: (column, descending) pairs, primary first
+    sort_options = {
+        "Date (Latest First)": (("Date", True),),
+        "Date (Oldest First)": (("Date", False),),
+        # Secondary sort (Date) Latest First
+        "Vehicle then Date (A-Z)": (("Vehicle", False), ("Date", True)),
+        # Secondary sort (Date) Latest First
+        "Vehicle then Date (Z-A)": (("Vehicle", True), ("Date", True)),
+    }
+    sort_by = st.selectbox("Sort By:", options=list(
+        sort_options.keys()), key="view_records_sort_by")
+
+    records_query = TripQuery(
+        start_date=filter_start_date,
+        end_date=filter_end_date,
+        vehicles=None if filter_vehicle_selectbox == "All" else (filter_vehicle_selectbox,),
+        sort=sort_options[sort_by],
+    )
+    seen = feed_seq()  # Taken first, so a save during the query still shows up
+    processed_trips_for_display = query_records(records_query)
+    st.session_state.records_view = (records_query, processed_trips_for_display, seen)
+    display_latest_trips()
+
     # --- Download Options ---
+    # Files are only encoded when a download button is clicked, and cached per
+    # data version and filter, so ordinary reruns never pay the export cost.
     st.subheader("Download Options")
 
-    if processed_trips_for_display:  # Use the full filtered and processed list for download
-        df_filtered_download = pd.DataFrame(processed_trips_for_display)
-        # Ensure the new column is in the CSV; it should be from the processing above
+    export_format = st.selectbox(
+        "File Format:", options=list(EXPORT_FORMATS.keys()), key="download_format_select")
+    data_version = get_data_version()
 
-        csv_data_filtered = df_filtered_download.to_csv(
-            index=False).encode('utf-8')
+    if processed_trips_for_display:  # Use the full filtered and processed list for download
+        filter_params = (filter_start_date.isoformat(), filter_end_date.isoformat(),
+                         filter_vehicle_selectbox, sort_by)
         st.download_button(
-            label="Download Filtered Trip Records CSV",
-            data=csv_data_filtered,
-            file_name=f"rotiroute_filtered_records_{filter_start_date.strftime('%Y%m%d')}_to_{filter_end_date.strftime('%Y%m%d')}.csv",
-            mime="text/csv",
+            label="Download Filtered Trip Records",
+            data=lazy_trip_export(data_version, "filtered", export_format, filter_params,
+                                  FILTERED_EXPORT_COLUMNS, processed_trips_for_display,
+                                  plate_timeline=get_plate_timeline()),
+            file_name=export_file_name(
+                f"rotiroute_filtered_records_{filter_start_date.strftime('%Y%m%d')}_to_{filter_end_date.strftime('%Y%m%d')}", export_format),
+            mime=export_mime(export_format),
+            on_click="ignore",
             key="download_filtered_csv"
         )
     else:
         st.info("No filtered trips to download.")
 
-    # Full Trip Records CSV Download (uses the complete trips list from session state)
+    # Full Trip Records Download (uses the complete trips list from session state)
     if st.session_state.trips:
-        df_full_download = pd.DataFrame(st.session_state.trips)
-        csv_data_full = df_full_download.to_csv(index=False).encode('utf-8')
         st.download_button(
-            label="Download Full Trip Records CSV (All Data)",
-            data=csv_data_full,
-            file_name="rotiroute_full_records.csv",
-            mime="text/csv",
+            label="Download Full Trip Records (All Data)",
+            data=lazy_trip_export(data_version, "full", export_format, None,
+                                  GSHEETS_TRIPS_COLUMNS, st.session_state.trips.rows(),
+                                  plate_timeline=get_plate_timeline()),
+            file_name=export_file_name(
+                "rotiroute_full_records", export_format),
+            mime=export_mime(export_format),
+            on_click="ignore",
             key="download_full_csv"
         )
 
@@ -218,22 +245,14 @@ def display_view_records_tab():
             "End Date for Store Count:", datetime.now(), key="store_count_end_date")
 
     if st.button("Generate and Download Store Count CSV"):  # Key for this button implicit
-        trips_in_range_for_store_count = filter_trips(st.session_state.trips, store_count_start_date,
-                                                      store_count_end_date, "All")
-
-        store_counts = {}
-        for trip in trips_in_range_for_store_count:
-            route_string = trip.get("Route", "")
-            stores = [store.strip()
-                      for store in route_string.split(',') if store.strip()]
-            for store in stores:
-                store_counts[store] = store_counts.get(store, 0) + 1
+        store_count_query = TripQuery(start_date=store_count_start_date, end_date=store_count_end_date)
+        store_counts = dict(run_store_count_query(
+            get_data_version(), st.session_state.trips.rows(), store_count_query))
 
         if store_counts:
             df_store_counts = pd.DataFrame(
                 list(store_counts.items()), columns=['Store', 'Count'])
-            df_store_counts = df_store_counts.sort_values(
-                by='Count', ascending=False)
+            # Already ordered by count, most visited first
 
             csv_data_stores = df_store_counts.to_csv(
                 index=False).encode('utf-8')
@@ -247,3 +266,124 @@ def display_view_records_tab():
             )
         else:
             st.info("No trips found in the selected date range to count stores.")
+
+    st.markdown("---")
+
+    # --- Month-End Reports ---
+    st.subheader("Month-End Reports")
+    report_col1, report_col2 = st.columns(2)
+    with report_col1:
+        report_start_date = st.date_input("Report Start Date:", datetime.now().replace(day=1),
+                                          key="report_start_date")
+        report_by_driver = st.checkbox("One report per vehicle and driver", key="report_by_driver")
+    with report_col2:
+        report_end_date = st.date_input("Report End Date:", datetime.now(), key="report_end_date")
+        report_formats = REPORT_FORMATS if EXCEL_AVAILABLE else ["CSV"]
+        report_format = st.selectbox("Report format:", report_formats, key="report_format")
+
+    if st.button("Generate Reports (ZIP)"):
+        report_query = TripQuery(start_date=report_start_date, end_date=report_end_date)
+        report_trips = run_trip_query(get_data_version(), st.session_state.trips.rows(), report_query)
+        if report_trips:
+            with st.spinner("Building reports..."):
+                report_zip, report_count = generate_batch_reports(
+                    report_trips, report_start_date, report_end_date,
+                    by_driver=report_by_driver, file_format=report_format)
+            st.download_button(
+                label=f"Click here to download {report_count} report(s)",
+                data=report_zip,
+                file_name=f"rotiroute_reports_{report_start_date.strftime('%Y%m%d')}_to_{report_end_date.strftime('%Y%m%d')}.zip",
+                mime="application/zip",
+                key="download_reports_zip_generated"
+            )
+        else:
+            st.info("No trips found in the selected date range.")
+
+    st.markdown("---")
+
+    # --- All Depots (fanned out over every depot's shared snapshot) ---
+    if MULTI_DEPOT:
+        display_all_depots_section(export_format)
+        st.markdown("---")
+
+    # --- Monthly Summary (built by the background scheduler) ---
+    st.subheader("Monthly Summary per Vehicle")
+    aggregates = get_derived_result(MONTHLY_AGGREGATES_JOB)
+    if aggregates is None:
+        st.info("The monthly summary is being prepared in the background; check back shortly.")
+    else:
+        st.caption(derived_caption(aggregates))
+        st.dataframe(aggregates["summary"], hide_index=True, use_container_width=True)
+
+    st.markdown("---")
+
+    # --- Route Distance Check (built by the background scheduler) ---
+    st.subheader("Route Distance Check")
+    route_check = get_derived_result(ROUTE_CHECK_JOB)
+    if route_check is None:
+        st.info("The route distance check is being prepared in the background; check back shortly.")
+    else:
+        st.caption(derived_caption(route_check))
+        if route_check["report"].empty:
+            st.success("Every trip's KM is plausible for the stores on its route.")
+        else:
+            st.write(f"{len(route_check['report'])} trip(s) with KM implausible for their route.")
+            st.dataframe(route_check["report"].head(50), hide_index=True, use_container_width=True)
+
+    st.markdown("---")
+
+    # --- KM Anomalies (built by the background scheduler) ---
+    st.subheader("KM Anomalies")
+    anomalies = get_derived_result(ANOMALY_JOB)
+    if anomalies is None:
+        st.info("The KM anomaly check is being prepared in the background; check back shortly.")
+    else:
+        st.caption(derived_caption(anomalies))
+        if anomalies["report"].empty:
+            st.success("No day's KM is unusual for its vehicle or driver.")
+        else:
+            st.write(f"{len(anomalies['report'])} day(s) with KM far outside the vehicle's or driver's usual range "
+                     "(largest deviation first).")
+            st.dataframe(anomalies["report"].head(50), hide_index=True, use_container_width=True)
+
+    st.markdown("---")
+
+    # --- Duplicate Trips (built by the background scheduler) ---
+    st.subheader("Duplicate Trips")
+    duplicates = get_derived_result(DUPLICATES_JOB)
+    if duplicates is None:
+        st.info("The duplicate check is being prepared in the background; check back shortly.")
+    else:
+        st.caption(derived_caption(duplicates))
+        if duplicates["report"].empty:
+            st.success("No trip is recorded more than once.")
+        else:
+            st.write(f"{len(duplicates['report'])} trip(s) recorded more than once "
+                     "(same vehicle, date, Start KM, End KM and stores).")
+            st.dataframe(duplicates["report"].head(50), hide_index=True, use_container_width=True)
+
+    st.markdown("---")
+
+    # --- Odometer Continuity Audit (built by the background scheduler) ---
+    st.subheader("Odometer Continuity Audit")
+    audit_result = get_derived_result(AUDIT_JOB)
+    if audit_result is None:
+        st.info("The audit is being prepared in the background; check back shortly.")
+        return
+    st.caption(derived_caption(audit_result))
+    audit_report = audit_result["report"]
+    if audit_report.empty:
+        st.success("No odometer gaps, overlaps, backdated entries or duplicates found.")
+    else:
+        severity_counts = audit_report["Severity"].value_counts()
+        st.write(", ".join(f"{severity_counts.get(level, 0)} {level}" for level in ["High", "Medium", "Low"])
+                 + " severity issue(s) found across all trips.")
+        st.dataframe(audit_report.head(50), hide_index=True, use_container_width=True)
+        st.download_button(
+            label="Download Audit Report CSV",
+            data=lambda: audit_report.to_csv(index=False).encode('utf-8'),
+            file_name="rotiroute_odometer_audit.csv",
+            mime="text/csv",
+            on_click="ignore",
+            key="download_audit_csv"
+        )
@@ -0,0 +1,181 @@
+# telematics.py
+
+import pandas as pd
+
+from config import (
+    FLEET_CHANGE_ROUTE, TELEMATICS_COLUMNS, TELEMATICS_CHUNK_ROWS,
+    TELEMATICS_KM_TOLERANCE, TELEMATICS_MIN_MOVEMENT_KM
+)
+
+# Odometer logs exported by the vehicles are read in chunks of TELEMATICS_CHUNK_ROWS rows and
+# reduced to one row per vehicle per day (first/last reading), so memory depends on the number of
+# vehicle-days, not on the size of the file. The daily readings are then reconciled with the trips.
+
+DAILY_READING_COLUMNS = ["Vehicle", "Date", "Logged Start KM", "Logged End KM", "Readings"]
+
+RECONCILIATION_COLUMNS = [
+    "Vehicle", "Date", "Issue", "Trip IDs", "Trip Start KM", "Trip End KM",
+    "Logged Start KM", "Logged End KM", "Difference KM", "Suggested Start KM", "Suggested End KM"
+]
+
+CORRECTION_COLUMNS = ["Trip ID", "Vehicle", "Date", "Field", "Current", "Suggested"]
+
+# Merge the per-chunk daily aggregates once this many are pending
+_PENDING_CHUNKS = 16
+
+
+class DailyOdometerAggregator:
+    """Folds chunks of raw odometer readings into first/last reading per vehicle per day."""
+
+    def __init__(self, vehicle_aliases=None):
+        self.vehicle_aliases = vehicle_aliases or {}
+        self.rows_read = 0
+        self.rows_skipped = 0
+        self._daily = None
+        self._pending = []
+
+    def add_chunk(self, chunk):
+        """Adds a chunk with the columns named in TELEMATICS_COLUMNS."""
+        self.rows_read += len(chunk)
+        vehicle = chunk[TELEMATICS_COLUMNS["vehicle"]].astype(str).str.strip()
+        if self.vehicle_aliases:
+            vehicle = vehicle.map(lambda v: self.vehicle_aliases.get(v, v))
+        readings = pd.DataFrame({
+            "Vehicle": vehicle,
+            "_day": pd.to_datetime(chunk[TELEMATICS_COLUMNS["timestamp"]], errors='coerce').dt.normalize(),
+            "_km": pd.to_numeric(chunk[TELEMATICS_COLUMNS["odometer"]], errors='coerce'),
+        })
+        valid = readings["_day"].notna() & readings["_km"].notna() & (readings["Vehicle"] != "")
+        self.rows_skipped += int((~valid).sum())
+        self._pending.append(readings[valid].groupby(["Vehicle", "_day"], sort=False).agg(
+            _start=("_km", "min"), _end=("_km", "max"), _readings=("_km", "size")))
+        if len(self._pending) >= _PENDING_CHUNKS:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        parts = ([self._daily] if self._daily is not None else []) + self._pending
+        self._pending = []
+        self._daily = pd.concat(parts).groupby(level=["Vehicle", "_day"], sort=False).agg(
+            _start=("_start", "min"), _end=("_end", "max"), _readings=("_readings", "sum"))
+
+    def daily_readings(self):
+        """Returns the DAILY_READING_COLUMNS frame, sorted by vehicle and date."""
+        if self._pending:
+            self._merge_pending()
+        if self._daily is None or self._daily.empty:
+            return pd.DataFrame(columns=DAILY_READING_COLUMNS)
+        daily = self._daily.reset_index().sort_values(["Vehicle", "_day"])
+        return pd.DataFrame({
+            "Vehicle": daily["Vehicle"].values,
+            "Date": daily["_day"].dt.strftime('%Y-%m-%d').values,
+            "Logged Start KM": daily["_start"].round().astype("int64").values,
+            "Logged End KM": daily["_end"].round().astype("int64").values,
+            "Readings": daily["_readings"].astype("int64").values,
+        }, columns=DAILY_READING_COLUMNS)
+
+
+def plate_aliases(vehicle_records):
+    """Maps license plates to vehicle names, so logs that identify vehicles by plate are understood."""
+    return {str(record.get("License Plate")).strip(): record.get("Vehicle")
+            for record in vehicle_records
+            if record.get("License Plate") and record.get("Vehicle")}
+
+
+def read_odometer_log(source, vehicle_aliases=None, chunk_rows=TELEMATICS_CHUNK_ROWS):
+    """Streams an odometer log CSV (path or file object) and returns (daily readings, aggregator)."""
+    aggregator = DailyOdometerAggregator(vehicle_aliases)
+    columns = list(TELEMATICS_COLUMNS.values())
+    for chunk in pd.read_csv(source, usecols=columns, dtype=str, chunksize=chunk_rows):
+        aggregator.add_chunk(chunk)
+    return aggregator.daily_readings(), aggregator
+
+
+def daily_trip_ranges(trips):
+    """Returns per vehicle per day: first Start KM, last End KM and the trip ids (fleet change rows excluded)."""
+    frame = pd.DataFrame(list(trips), columns=["id", "Date", "Vehicle", "Start KM", "End KM", "Route"])
+    frame = frame[frame["Route"] != FLEET_CHANGE_ROUTE]
+    frame["Start KM"] = pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame["End KM"] = pd.to_numeric(frame["End KM"], errors='coerce')
+    frame = frame.dropna(subset=["Start KM", "End KM"])
+    frame = frame[pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce').notna()]
+    frame = frame.sort_values(["Vehicle", "Date", "Start KM"], kind="stable")
+    return frame.groupby(["Vehicle", "Date"], sort=True).agg(**{
+        "Trip Start KM": ("Start KM", "first"),
+        "Trip End KM": ("End KM", "last"),
+        "Trip IDs": ("id", lambda ids: ", ".join(str(i) for i in ids)),
+        "_first_id": ("id", "first"),
+        "_last_id": ("id", "last"),
+    }).reset_index()
+
+
+def reconcile_trips(daily_readings, trips, tolerance_km=TELEMATICS_KM_TOLERANCE,
+                    min_movement_km=TELEMATICS_MIN_MOVEMENT_KM):
+    """Compares logged daily odometer ranges with the trips of the logged vehicles.
+
+    Returns (report, corrections). The report lists KM Mismatch (the trips' first Start KM or last
+    End KM differs from the log by more than the tolerance), Missing Trips (the log shows movement
+    but no trip was entered), Odometer Overlap (a day's trips start below the previous logged day's
+    last reading) and No Log Data (a trip on a day without readings, within the logged period).
+    Corrections suggest the logged values for mismatched Start / End KM fields.
+    """
+    if daily_readings.empty:
+        return (pd.DataFrame(columns=RECONCILIATION_COLUMNS), pd.DataFrame(columns=CORRECTION_COLUMNS))
+
+    logged_vehicles = daily_readings["Vehicle"].unique()
+    ranges = daily_trip_ranges(trips)
+    ranges = ranges[ranges["Vehicle"].isin(logged_vehicles)]
+
+    merged = daily_readings.merge(ranges, on=["Vehicle", "Date"], how="outer", indicator=True)
+    merged = merged.sort_values(["Vehicle", "Date"]).reset_index(drop=True)
+    # Only look at trip days inside each vehicle's logged period
+    period = daily_readings.groupby("Vehicle")["Date"].agg(["min", "max"])
+    in_period = (merged["Date"] >= merged["Vehicle"].map(period["min"])) & \
+                (merged["Date"] <= merged["Vehicle"].map(period["max"]))
+    merged = merged[in_period].reset_index(drop=True)
+    merged["_prev_logged_end"] = merged.groupby("Vehicle")["Logged End KM"].transform(
+        lambda s: s.ffill().shift())
+
+    both = merged["_merge"] == "both"
+    start_diff = merged["Trip Start KM"] - merged["Logged Start KM"]
+    end_diff = merged["Trip End KM"] - merged["Logged End KM"]
+    mismatch = both & ((start_diff.abs() > tolerance_km) | (end_diff.abs() > tolerance_km))
+    moved = merged["Logged End KM"] - merged["Logged Start KM"]
+    missing = (merged["_merge"] == "left_only") & (moved >= min_movement_km)
+    no_log = merged["_merge"] == "right_only"
+    overlap = merged["Trip Start KM"].notna() & merged["_prev_logged_end"].notna() & \
+        (merged["_prev_logged_end"] - merged["Trip Start KM"] > tolerance_km)
+
+    issues = []
+    for mask, issue, difference in [
+        (mismatch, "KM Mismatch", end_diff.where(end_diff.abs() >= start_diff.abs(), start_diff)),
+        (missing, "Missing Trip", moved),
+        (overlap, "Odometer Overlap", merged["_prev_logged_end"] - merged["Trip Start KM"]),
+        (no_log, "No Log Data", pd.Series(pd.NA, index=merged.index)),
+    ]:
+        if mask.any():
+            rows = merged[mask].copy()
+            rows["Issue"] = issue
+            rows["Difference KM"] = difference[mask]
+            issues.append(rows)
+    if not issues:
+        return (pd.DataFrame(columns=RECONCILIATION_COLUMNS), pd.DataFrame(columns=CORRECTION_COLUMNS))
+
+    report = pd.concat(issues, ignore_index=True)
+    suggest = report["Issue"].isin(["KM Mismatch", "Missing Trip"])
+    report["Suggested Start KM"] = report["Logged Start KM"].where(suggest)
+    report["Suggested End KM"] = report["Logged End KM"].where(suggest)
+    report = report.sort_values(["Vehicle", "Date", "Issue"], kind="stable").reset_index(drop=True)
+    for col in ["Trip Start KM", "Trip End KM", "Logged Start KM", "Logged End KM",
+                "Difference KM", "Suggested Start KM", "Suggested End KM"]:
+        report[col] = pd.to_numeric(report[col], errors='coerce').round().astype("Int64")
+
+    mismatched = report[report["Issue"] == "KM Mismatch"]
+    corrections = []
+    for _, row in mismatched.iterrows():
+        if abs(row["Trip Start KM"] - row["Logged Start KM"]) > tolerance_km:
+            corrections.append([row["_first_id"], row["Vehicle"], row["Date"], "Start KM",
+                                int(row["Trip Start KM"]), int(row["Logged Start KM"])])
+        if abs(row["Trip End KM"] - row["Logged End KM"]) > tolerance_km:
+            corrections.append([row["_last_id"], row["Vehicle"], row["Date"], "End KM",
+                                int(row["Trip End KM"]), int(row["Logged End KM"])])
+    return report[RECONCILIATION_COLUMNS], pd.DataFrame(corrections, columns=CORRECTION_COLUMNS)
@@ -0,0 +1,205 @@
+# trip_core.py
+
+from datetime import datetime
+
+import pandas as pd
+
+from config import FLEET_CHANGE_ROUTE
+
+# Trip logic that works on plain trip lists: no Streamlit, no session state, no sheet access.
+# The app (utils.py) and the command line (cli.py) share these functions.
+
+MONTHLY_SUMMARY_COLUMNS = ["Month", "Vehicle", "Trips", "Total KM",
+                           "First Start KM", "Last End KM", "Store Visits"]
+DUPLICATE_REPORT_COLUMNS = ["Vehicle", "Date", "Start KM", "End KM", "Route",
+                            "Copies", "Kept Trip ID", "Duplicate Trip IDs"]
+
+
+def count_stores_in_route(route_string):
+    """Counts the number of stores in a comma-separated route string."""
+    if not route_string:
+        return 0
+    # Simple approach: split by comma and count non-empty parts
+    return len([store.strip() for store in route_string.split(',') if store.strip()])
+
+
+def filter_trips(trips, start_date, end_date, vehicle):
+    """Filters a list of trips by date range and vehicle."""
+    filtered = [
+        trip for trip in trips
+        if datetime.strptime(trip["Date"], '%Y-%m-%d').date() >= start_date and
+        datetime.strptime(trip["Date"], '%Y-%m-%d').date() <= end_date
+    ]
+    if vehicle != "All":
+        filtered = [trip for trip in filtered if trip["Vehicle"] == vehicle]
+    return filtered
+
+
+def _whole_km(value):
+    """A KM value as a whole number, or 0 if it is missing or not a plain non-negative number."""
+    try:
+        if pd.notna(value):
+            value_str = str(value).strip()
+            if value_str.replace('.', '', 1).isdigit():
+                return int(float(value_str))
+        return 0
+    except (ValueError, TypeError):
+        return 0
+
+
+def _plain_km(value):
+    """A KM value written as a plain non-negative number, as a whole number; 0 otherwise."""
+    return int(float(value)) if pd.notna(value) and str(value).replace('.', '', 1).isdigit() else 0
+
+
+def latest_end_km(trips, vehicle):
+    """End KM of the vehicle's latest trip by date (the first such trip in list order), or 0.
+
+    Trips without a valid YYYY-MM-DD date are ignored.
+    """
+    parsed_trips = []
+    for trip in trips:
+        if isinstance(trip.get("Date"), str) and trip.get("Date"):
+            try:
+                parsed_trips.append((datetime.strptime(trip["Date"], '%Y-%m-%d'), trip))
+            except ValueError:
+                pass
+    latest = None
+    for trip_date, trip in parsed_trips:
+        # Strictly later only, so the first trip of the latest date wins (as with a stable sort)
+        if trip.get("Vehicle") == vehicle and (latest is None or trip_date > latest[0]):
+            latest = (trip_date, trip)
+    return _whole_km(latest[1].get("End KM", 0)) if latest else 0
+
+
+def period_accumulated_km(trips):
+    """Running KM per vehicle over the given trips only, in date order: {trip id: KM so far}.
+
+    Used for the "Accumulated KM (Filtered)" column. KM values that are not plain numbers count
+    as 0 (both of a trip's values if either cannot be read).
+    """
+    trips_for_calc = sorted(
+        trips,
+        key=lambda x: (
+            x.get('Vehicle', ''),
+            datetime.strptime(x.get('Date', '1900-01-01'), '%Y-%m-%d') if x.get('Date') else datetime.min
+        )
+    )
+    vehicle_totals = {}
+    accumulated = {}
+    for trip in trips_for_calc:
+        trip_id = trip.get("id")
+        if not trip_id:
+            continue
+        vehicle = trip.get("Vehicle")
+        try:
+            start_km = _plain_km(trip.get("Start KM", 0))
+            end_km = _plain_km(trip.get("End KM", 0))
+        except (ValueError, TypeError):
+            start_km = end_km = 0
+        total = vehicle_totals.get(vehicle, 0) + end_km - start_km
+        vehicle_totals[vehicle] = total
+        accumulated[trip_id] = total
+    return accumulated
+
+
+def accumulated_km(trips, vehicle):
+    """Returns [(trip, Accumulated KM)] for one vehicle's trips in chronological order."""
+    vehicle_trips = [trip for trip in trips if trip.get("Vehicle") == vehicle]
+
+    # Sort trips by date
+    trips_sorted = sorted(
+        vehicle_trips,
+        key=lambda x: datetime.strptime(x["Date"], '%Y-%m-%d')
+    )
+
+    total_km = 0
+    result = []
+    for trip in trips_sorted:
+        start_km = trip.get("Start KM", 0)
+        end_km = trip.get("End KM", 0)
+        total_km += end_km - start_km
+        result.append((trip, total_km))
+    return result
+
+
+def recompute_accumulated_km(trips):
+    """Recomputes Accumulated KM for every vehicle.
+
+    Returns (trips, changed) where `trips` is a new list in the same order with corrected copies
+    of the changed trips, and `changed` is {trip id: corrected trip}.
+    """
+    changed = {}
+    for vehicle in sorted({trip.get("Vehicle") for trip in trips if trip.get("Vehicle")}):
+        for trip, total_km in accumulated_km(trips, vehicle):
+            if trip.get("Accumulated KM") != total_km:
+                changed[trip["id"]] = dict(trip, **{"Accumulated KM": total_km})
+    return [changed.get(trip.get("id"), trip) for trip in trips], changed
+
+
+def monthly_vehicle_summary(trips):
+    """Per-vehicle totals for each calendar month: trip count, KM driven, odometer range, store visits.
+
+    Fleet change rows and trips without a valid date or KM values are left out.
+    """
+    frame = pd.DataFrame(list(trips), columns=["Date", "Vehicle", "Start KM", "End KM", "Route"])
+    frame = frame[frame["Route"] != FLEET_CHANGE_ROUTE]
+    frame["_date"] = pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce')
+    frame["Start KM"] = pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame["End KM"] = pd.to_numeric(frame["End KM"], errors='coerce')
+    frame = frame.dropna(subset=["_date", "Start KM", "End KM"])
+    if frame.empty:
+        return pd.DataFrame(columns=MONTHLY_SUMMARY_COLUMNS)
+
+    frame = frame.sort_values(["Vehicle", "_date", "Start KM"], kind="stable")
+    frame["Month"] = frame["_date"].dt.strftime('%Y-%m')
+    frame["_km"] = frame["End KM"] - frame["Start KM"]
+    frame["_stores"] = frame["Route"].fillna("").map(count_stores_in_route)  # A missing route may come in as NaN
+    summary = frame.groupby(["Month", "Vehicle"], sort=True).agg(**{
+        "Trips": ("_km", "size"),
+        "Total KM": ("_km", "sum"),
+        "First Start KM": ("Start KM", "first"),
+        "Last End KM": ("End KM", "last"),
+        "Store Visits": ("_stores", "sum"),
+    }).reset_index()
+    for col in ["Total KM", "First Start KM", "Last End KM"]:
+        summary[col] = summary[col].astype("int64")
+    return summary[MONTHLY_SUMMARY_COLUMNS]
+
+
+def _km_key(value):
+    """KM values compare as whole numbers, whether they came in as 1200, 1200.0 or "1200"."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def trip_fingerprint(trip):
+    """What makes two trips the same trip: vehicle, date, Start KM, End KM and the set of stores."""
+    stores = tuple(sorted({store.strip() for store in str(trip.get("Route") or "").split(",")
+                           if store.strip()}))
+    return (str(trip.get("Vehicle") or ""), str(trip.get("Date") or ""),
+            _km_key(trip.get("Start KM")), _km_key(trip.get("End KM")), stores)
+
+
+def duplicate_trip_report(trips):
+    """One row per group of trips sharing a trip_fingerprint, in sheet order.
+
+    The first trip of a group is the one to keep; fleet change rows are left out.
+    """
+    groups = {}
+    for trip in trips:
+        if trip.get("Route") != FLEET_CHANGE_ROUTE:
+            groups.setdefault(trip_fingerprint(trip), []).append(trip)
+    report = []
+    for group in groups.values():
+        if len(group) > 1:
+            first = group[0]
+            report.append({
+                "Vehicle": first.get("Vehicle"), "Date": first.get("Date"),
+                "Start KM": first.get("Start KM"), "End KM": first.get("End KM"),
+                "Route": first.get("Route"), "Copies": len(group), "Kept Trip ID": first.get("id"),
+                "Duplicate Trip IDs": ", ".join(str(trip.get("id")) for trip in group[1:]),
+            })
+    return pd.DataFrame(report, columns=DUPLICATE_REPORT_COLUMNS)
@@ -0,0 +1,200 @@
+# trip_query.py
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+
+import numpy as np
+
+from config import TRIP_QUERY_CACHE_SIZE, TRIP_TABLE_CACHE_SIZE
+
+# Columns a query can sort on
+SORTABLE_COLUMNS = ["Date", "Vehicle", "Driver", "Start KM", "End KM"]
+
+# Date ordinal used for missing or unparseable dates; sorts before every real date
+MISSING_DATE = -1
+
+
+@dataclass(frozen=True)
+class TripQuery:
+    """A declarative, hashable trip query.
+
+    Dates are inclusive `date` objects (None = open-ended). `vehicles`, `drivers` and `stores`
+    are tuples of allowed values (None = no filter); a trip matches `stores` if its route visits
+    any of them. `sort` is a tuple of (column, descending) pairs; ties keep the trips' stored order.
+    """
+    start_date: date = None
+    end_date: date = None
+    vehicles: tuple = None
+    drivers: tuple = None
+    stores: tuple = None
+    sort: tuple = ()
+    limit: int = None
+    offset: int = 0
+
+
+class LRUCache:
+    """A small thread-safe least-recently-used cache shared by all sessions of the process."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _date_ordinal(value):
+    """Returns a YYYY-MM-DD string (or date) as a day ordinal, or MISSING_DATE."""
+    if isinstance(value, date):
+        return value.toordinal()
+    if not isinstance(value, str) or not value:
+        return MISSING_DATE
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').toordinal()
+    except ValueError:
+        return MISSING_DATE
+
+
+def _km(value):
+    """Returns a KM value as float, or NaN."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _rank_codes(values):
+    """Integer codes that sort like the given strings."""
+    _, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes
+
+
+class TripTable:
+    """A columnar, date-sorted view of a trip list, built once per data version.
+
+    Dates are parsed once into ordinals and kept in date order, so a date range is two
+    binary searches; the other filters and sorts are numpy operations on the matching rows.
+    """
+
+    def __init__(self, trips):
+        self.trips = trips
+        self.dates = np.array([_date_ordinal(t.get("Date")) for t in trips], dtype=np.int64)
+        self.vehicles = np.array([t.get("Vehicle") or "" for t in trips], dtype=object)
+        self.drivers = np.array([t.get("Driver") or "" for t in trips], dtype=object)
+        self.by_date = np.argsort(self.dates, kind="stable")
+        self.sorted_dates = self.dates[self.by_date]
+        self.missing_dates = int(np.searchsorted(self.sorted_dates, MISSING_DATE, side="right"))
+
+        store_rows = {}
+        for position, trip in enumerate(trips):
+            for store in str(trip.get("Route") or "").split(","):
+                store = store.strip()
+                if store:
+                    store_rows.setdefault(store, []).append(position)
+        self.store_rows = {store: np.array(rows, dtype=np.int64) for store, rows in store_rows.items()}
+
+        self._sort_keys = {
+            "Date": self.dates,
+            "Vehicle": _rank_codes(self.vehicles) if trips else np.array([], dtype=np.int64),
+            "Driver": _rank_codes(self.drivers) if trips else np.array([], dtype=np.int64),
+            "Start KM": np.array([_km(t.get("Start KM")) for t in trips], dtype=float),
+            "End KM": np.array([_km(t.get("End KM")) for t in trips], dtype=float),
+        }
+
+    def select(self, query):
+        """Returns the positions (into the trip list) of the trips matching a query, in result order."""
+        if query.start_date is None and query.end_date is None:
+            rows = np.arange(len(self.trips))
+        else:
+            low = self.missing_dates  # A date range never matches trips without a valid date
+            high = len(self.trips)
+            if query.start_date is not None:
+                low = max(low, int(np.searchsorted(self.sorted_dates, query.start_date.toordinal(), side="left")))
+            if query.end_date is not None:
+                high = int(np.searchsorted(self.sorted_dates, query.end_date.toordinal(), side="right"))
+            rows = np.sort(self.by_date[low:high]) if high > low else np.array([], dtype=np.int64)
+
+        if query.vehicles is not None:
+            rows = rows[np.isin(self.vehicles[rows], list(query.vehicles))]
+        if query.drivers is not None:
+            rows = rows[np.isin(self.drivers[rows], list(query.drivers))]
+        if query.stores is not None:
+            visited = [self.store_rows[s] for s in query.stores if s in self.store_rows]
+            rows = rows[np.isin(rows, np.concatenate(visited))] if visited else rows[:0]
+
+        if query.sort and len(rows):
+            keys = [rows]  # Last resort: stored order
+            for column, descending in reversed(query.sort):
+                key = self._sort_keys[column][rows]
+                keys.append(-key if descending else key)
+            rows = rows[np.lexsort(keys)]
+
+        end = None if query.limit is None else query.offset + query.limit
+        return rows[query.offset:end]
+
+    def store_counts(self, rows):
+        """Counts store visits over the given rows: [(store, count)] by count, most visited first."""
+        counts = [(store, int(np.isin(store_rows, rows).sum())) for store, store_rows in self.store_rows.items()]
+        counts = [(store, count) for store, count in counts if count]
+        counts.sort(key=lambda item: -item[1])
+        return counts
+
+
+_TABLE_CACHE = LRUCache(TRIP_TABLE_CACHE_SIZE)
+_RESULT_CACHE = LRUCache(TRIP_QUERY_CACHE_SIZE)
+
+
+def get_trip_table(data_version, trips):
+    """Returns the columnar TripTable for a data version, building it on first use."""
+    table = _TABLE_CACHE.get(data_version)
+    if table is None:
+        table = TripTable(trips)
+        _TABLE_CACHE.put(data_version, table)
+    return table
+
+
+def run_trip_query(data_version, trips, query):
+    """Runs a TripQuery, serving repeated (data version, query) pairs from the LRU cache.
+
+    Returns a tuple of the matching trip dicts; treat them as read-only.
+    """
+    key = ("trips", data_version, query)
+    result = _RESULT_CACHE.get(key)
+    if result is None:
+        table = get_trip_table(data_version, trips)
+        result = tuple(table.trips[i] for i in table.select(query))
+        _RESULT_CACHE.put(key, result)
+    return result
+
+
+def run_store_count_query(data_version, trips, query):
+    """Counts store visits for the trips matching a query: [(store, count)], most visited first."""
+    key = ("store_counts", data_version, query)
+    result = _RESULT_CACHE.get(key)
+    if result is None:
+        table = get_trip_table(data_version, trips)
+        result = tuple(table.store_counts(table.select(query)))
+        _RESULT_CACHE.put(key, result)
+    return result
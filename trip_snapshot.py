@@ -0,0 +1,338 @@
+# trip_snapshot.py
+
+import threading
+import uuid
+from collections.abc import Sequence
+from itertools import count
+from types import MappingProxyType
+
+from trip_core import trip_fingerprint
+from trip_sync import rebase_trip, same_trip
+
+
+def freeze_trip(trip):
+    """Returns a read-only copy of a trip dict (already frozen trips are reused as-is)."""
+    if isinstance(trip, MappingProxyType):
+        return trip
+    return MappingProxyType(dict(trip))
+
+
+class TripSnapshot:
+    """An immutable trip list shared by every session of the server process.
+
+    Rows are read-only mappings, so display code can never modify stored data by accident.
+    `sheet_version` / `journal_row_count` record which version of the sheet the rows match, and
+    `matches_sheet_order` says whether row i is sheet row i + 2 (true after a load or full save).
+    """
+
+    __slots__ = ("rows", "version", "sheet_version", "journal_row_count",
+                 "matches_sheet_order", "_positions", "_fingerprints")
+
+    def __init__(self, rows, version, sheet_version, journal_row_count, matches_sheet_order):
+        self.rows = tuple(freeze_trip(trip) for trip in rows)
+        self.version = version
+        self.sheet_version = sheet_version
+        self.journal_row_count = journal_row_count
+        self.matches_sheet_order = matches_sheet_order
+        self._positions = {trip.get("id"): i for i, trip in enumerate(self.rows)}
+        self._fingerprints = None  # hash(trip_fingerprint) -> tuple of trip ids, built on first use
+
+    def get(self, trip_id):
+        """Returns the trip with this id, or None."""
+        position = self._positions.get(trip_id)
+        return None if position is None else self.rows[position]
+
+    def __contains__(self, trip_id):
+        return trip_id in self._positions
+
+    def fingerprint_index(self):
+        """The duplicate index: {hash of trip_fingerprint: tuple of trip ids}.
+
+        Keys are hashes rather than the fingerprints themselves to keep the index small;
+        `with_fingerprint` checks the candidates, so a hash collision cannot match two trips.
+        """
+        if self._fingerprints is None:
+            index = {}
+            for trip in self.rows:
+                key = hash(trip_fingerprint(trip))
+                index[key] = index.get(key, ()) + (trip.get("id"),)
+            self._fingerprints = index
+        return self._fingerprints
+
+    def with_fingerprint(self, fingerprint):
+        """Ids of the trips whose trip_fingerprint equals `fingerprint`, in O(1)."""
+        return [trip_id for trip_id in self.fingerprint_index().get(hash(fingerprint), ())
+                if trip_fingerprint(self.get(trip_id)) == fingerprint]
+
+
+def _carry_fingerprints(previous, snapshot, changed_ids):
+    """Derives the snapshot's duplicate index from the previous one by re-keying only the changed trips."""
+    index = dict(previous._fingerprints)
+    for trip_id in changed_ids:
+        old, new = previous.get(trip_id), snapshot.get(trip_id)
+        if old is not None:
+            key = hash(trip_fingerprint(old))
+            remaining = tuple(other for other in index.get(key, ()) if other != trip_id)
+            if remaining:
+                index[key] = remaining
+            else:
+                index.pop(key, None)
+        if new is not None:
+            key = hash(trip_fingerprint(new))
+            index[key] = index.get(key, ()) + (trip_id,)
+    snapshot._fingerprints = index
+
+
+class SnapshotStore:
+    """Holds the current TripSnapshot for the process; publishing replaces it atomically.
+
+    `name` (the depot key) prefixes the store's cache keys, so process-wide caches keyed by
+    data version never mix up two depots' snapshots of the same version number.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self._snapshot = None
+        self._versions = count(1)
+        self._lock = threading.Lock()
+        self.load_lock = threading.Lock()  # Lets only one session load from Google Sheets
+        # Held from the pre-write sync to the commit, so two sessions never write at once
+        self.write_lock = threading.RLock()
+
+    def current(self):
+        """Returns the current snapshot, or None before the first load."""
+        return self._snapshot
+
+    def version_key(self, snapshot):
+        """Cache key of a snapshot's rows (of this store): "<name>:<version>", "0" for no snapshot."""
+        if snapshot is None:
+            return "0"
+        return f"{self.name}:{snapshot.version}" if self.name else str(snapshot.version)
+
+    def publish(self, trips, sheet_version, journal_row_count, matches_sheet_order=True, replaces=False,
+                changed_ids=None):
+        """Publishes a new snapshot built from `trips` and returns it.
+
+        With `replaces` set to a snapshot, publishes only if that snapshot is still current
+        (returns None otherwise), so a slow background reload cannot overwrite a newer save.
+        `changed_ids`, if given, are the only trips that differ from the current snapshot; the
+        duplicate index is then carried over instead of rebuilt.
+        """
+        with self._lock:
+            if replaces is not False and self._snapshot is not replaces:
+                return None
+            previous = self._snapshot
+            self._snapshot = TripSnapshot(trips, next(self._versions), sheet_version,
+                                          journal_row_count, matches_sheet_order)
+            if changed_ids is not None and previous is not None and previous._fingerprints is not None:
+                _carry_fingerprints(previous, self._snapshot, changed_ids)
+            return self._snapshot
+
+
+class SessionTrips(Sequence):
+    """One session's view of the trips: the shared snapshot plus a small copy-on-write overlay.
+
+    Without local changes the view *is* the snapshot's row tuple (no copy). Edits go through
+    `edit`, `append` and `remove`, which copy only the affected trips into the overlay; the
+    overlay is folded into a new snapshot when the change is saved (see `commit`).
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._upserts = {}  # trip id -> mutable dict (edited or new trips)
+        self._bases = {}  # trip id -> the snapshot's trip when this session first edited or deleted it
+        self._base_version = None  # Snapshot version the overlay was started on
+        self._appended = []  # ids of new trips, in the order they were added
+        self._deletes = set()
+        self._session_token = uuid.uuid4().hex[:8]
+        self._overlay_changes = 0
+        self._view = None
+        self._view_key = None
+
+    # --- Reading ---
+
+    def snapshot(self):
+        """The shared snapshot this view is based on (None before the first load)."""
+        return self._store.current()
+
+    def rows(self):
+        """Returns the current rows as an immutable sequence; safe to cache against `data_version`."""
+        snapshot = self._store.current()
+        base = snapshot.rows if snapshot is not None else ()
+        if not self.has_changes():
+            return base
+        key = (snapshot.version if snapshot is not None else 0, self._overlay_changes)
+        if self._view_key != key:
+            rows = [self._upserts.get(trip.get("id"), trip) for trip in base
+                    if trip.get("id") not in self._deletes]
+            rows.extend(self._upserts[trip_id] for trip_id in self._appended
+                        if trip_id in self._upserts and (snapshot is None or trip_id not in snapshot))
+            self._view = tuple(rows)
+            self._view_key = key
+        return self._view
+
+    @property
+    def data_version(self):
+        """Identifies the rows: the snapshot version, plus this session's overlay if it has changes."""
+        version = self._store.version_key(self._store.current())
+        if self.has_changes():
+            version += f"+{self._session_token}.{self._overlay_changes}"
+        return version
+
+    def __len__(self):
+        return len(self.rows())
+
+    def __getitem__(self, index):
+        return self.rows()[index]
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def get(self, trip_id):
+        """Returns the trip with this id as seen by this session, or None."""
+        if trip_id in self._deletes:
+            return None
+        if trip_id in self._upserts:
+            return self._upserts[trip_id]
+        snapshot = self._store.current()
+        return snapshot.get(trip_id) if snapshot is not None else None
+
+    # --- Copy-on-write editing ---
+
+    def _changed(self):
+        self._overlay_changes += 1
+
+    def _start_overlay(self):
+        """Notes which snapshot a new overlay is based on (see rebase)."""
+        if not self.has_changes():
+            snapshot = self._store.current()
+            self._base_version = snapshot.version if snapshot is not None else None
+
+    def edit(self, trip_id):
+        """Returns a mutable copy of a trip, held in the overlay until the next commit."""
+        if trip_id not in self._upserts:
+            current = self.get(trip_id)
+            if current is None:
+                raise KeyError(trip_id)
+            self._start_overlay()
+            self._bases.setdefault(trip_id, current)
+            self._upserts[trip_id] = dict(current)
+        self._changed()
+        return self._upserts[trip_id]
+
+    def append(self, trip):
+        """Adds a new trip to the overlay."""
+        trip_id = trip.get("id")
+        self._start_overlay()
+        self._deletes.discard(trip_id)
+        self._upserts[trip_id] = dict(trip)
+        self._appended.append(trip_id)
+        self._changed()
+
+    def extend(self, trips):
+        for trip in trips:
+            self.append(trip)
+
+    def remove(self, trip_id):
+        """Deletes a trip in the overlay."""
+        self._start_overlay()
+        self._upserts.pop(trip_id, None)
+        snapshot = self._store.current()
+        if snapshot is not None and trip_id in snapshot:
+            self._bases.setdefault(trip_id, snapshot.get(trip_id))
+            self._deletes.add(trip_id)
+        self._changed()
+
+    def discard_change(self, trip_id):
+        """Drops this session's pending change to a trip, so it shows the snapshot version again."""
+        self._upserts.pop(trip_id, None)
+        self._bases.pop(trip_id, None)
+        self._deletes.discard(trip_id)
+        self._changed()
+
+    def has_changes(self):
+        return bool(self._upserts or self._deletes)
+
+    def find_duplicate(self, trip):
+        """Returns another trip in this view with the same trip_fingerprint as `trip`, or None.
+
+        Looks up the snapshot's duplicate index and the overlay, so it costs the same for any
+        number of trips.
+        """
+        fingerprint = trip_fingerprint(trip)
+        trip_id = trip.get("id")
+        snapshot = self._store.current()
+        if snapshot is not None:
+            for other_id in snapshot.with_fingerprint(fingerprint):
+                if other_id != trip_id and other_id not in self._upserts and other_id not in self._deletes:
+                    return snapshot.get(other_id)
+        for other_id, other in self._upserts.items():
+            if other_id != trip_id and trip_fingerprint(other) == fingerprint:
+                return other
+        return None
+
+    def changes(self):
+        """Returns (upserts {id: trip}, deletes {id}) pending in the overlay."""
+        return dict(self._upserts), set(self._deletes)
+
+    def is_current(self):
+        """True if the overlay is empty or was started on the current snapshot (nothing to rebase)."""
+        snapshot = self._store.current()
+        return not self.has_changes() or (snapshot is not None and snapshot.version == self._base_version)
+
+    def rebase(self):
+        """Moves the overlay onto the current snapshot, keeping other sessions' commits since it was started.
+
+        The overlay holds whole copies of the trips taken at edit time; laid over a newer snapshot
+        as-is, they would undo other sessions' changes to the same trips. Each edited trip keeps
+        only the fields this session changed, on top of the current version. A field both changed
+        to different values, or a trip one side deleted and the other changed, is a conflict: the
+        committed version is kept and the change is returned as {"id", "mine", "theirs"}, like
+        trip_sync.merge_remote_changes does for other processes' writes.
+        """
+        if self.is_current():
+            return []
+        snapshot = self._store.current()
+        conflicts = []
+        for trip_id, base in list(self._bases.items()):
+            theirs = snapshot.get(trip_id) if snapshot is not None else None
+            mine = self._upserts.get(trip_id)  # None: deleted by this session
+            if theirs is not None and same_trip(theirs, base):
+                self._bases[trip_id] = theirs  # Only this session changed it
+                continue
+            if theirs is None and mine is None:
+                self.discard_change(trip_id)  # Deleted on both sides
+                continue
+            merged = rebase_trip(base, mine, theirs) if mine is not None and theirs is not None else None
+            if merged is None:
+                conflicts.append({"id": trip_id, "mine": mine,
+                                  "theirs": dict(theirs) if theirs is not None else None})
+                self.discard_change(trip_id)
+            else:
+                self._upserts[trip_id] = merged
+                self._bases[trip_id] = theirs
+        self._base_version = snapshot.version if snapshot is not None else None
+        self._changed()
+        return conflicts
+
+    def commit(self, sheet_version, journal_row_count, matches_sheet_order=True):
+        """Publishes the view (snapshot + overlay) as the new shared snapshot and clears the overlay.
+
+        Call `rebase` first (under the store's write_lock) if other sessions may have committed
+        since the overlay was started.
+        """
+        snapshot = self._store.publish(self.rows(), sheet_version, journal_row_count, matches_sheet_order,
+                                       changed_ids=set(self._upserts) | self._deletes)
+        self._upserts.clear()
+        self._bases.clear()
+        self._appended.clear()
+        self._deletes.clear()
+        self._changed()
+        return snapshot
+
+
+def editable(trips, trip):
+    """Returns a trip that may be modified: the overlay copy for a SessionTrips, the trip itself otherwise."""
+    if isinstance(trips, SessionTrips):
+        return trips.edit(trip.get("id"))
+    return trip
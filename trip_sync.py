@@ -0,0 +1,123 @@
+# trip_sync.py
+
+import json
+
+from config import GSHEETS_TRIPS_COLUMNS
+
+# Columns recomputed from other data; differences here never count as conflicts
+DERIVED_TRIP_COLUMNS = ["Accumulated KM"]
+COMPARED_TRIP_COLUMNS = [col for col in GSHEETS_TRIPS_COLUMNS if col not in DERIVED_TRIP_COLUMNS]
+
+# Columns of the change journal worksheet (one row per changed trip per write)
+JOURNAL_COLUMNS = ["Version", "Action", "Trip ID", "Data", "Recorded At"]
+
+
+def _trip_key(trip):
+    """Comparable values of a trip, ignoring derived columns. Numbers and strings compare as text."""
+    return tuple("" if trip.get(col) is None else str(trip.get(col)) for col in COMPARED_TRIP_COLUMNS)
+
+
+def snapshot_trips(trips):
+    """Returns {trip id: comparable values} for a trip list, used as the base for the next write."""
+    return {trip.get("id"): _trip_key(trip) for trip in trips}
+
+
+def diff_trips(base, trips):
+    """Returns (upserts, deletes): trips added or changed since `base`, and ids removed since `base`."""
+    upserts = {}
+    current_ids = set()
+    for trip in trips:
+        trip_id = trip.get("id")
+        current_ids.add(trip_id)
+        if base.get(trip_id) != _trip_key(trip):
+            upserts[trip_id] = trip
+    deletes = set(base) - current_ids
+    return upserts, deletes
+
+
+def journal_rows(version, upserts, deletes, recorded_at):
+    """Builds change journal rows for one write."""
+    rows = [[version, "upsert", trip_id, json.dumps(
+        {col: trip.get(col) for col in GSHEETS_TRIPS_COLUMNS}, default=str), recorded_at]
+        for trip_id, trip in upserts.items()]
+    rows.extend([version, "delete", trip_id, "", recorded_at] for trip_id in sorted(deletes, key=str))
+    return rows
+
+
+def parse_journal(rows):
+    """Reduces journal rows to the latest change per trip id: {id: trip dict or None for a delete}."""
+    changes = {}
+    for row in rows:
+        if len(row) < 3 or not row[2]:
+            continue
+        action, trip_id = row[1], row[2]
+        if action == "delete":
+            changes[trip_id] = None
+        else:
+            try:
+                changes[trip_id] = json.loads(row[3])
+            except (IndexError, ValueError, TypeError):
+                continue
+    return changes
+
+
+def same_trip(trip, other):
+    """True if two versions of a trip have the same values, ignoring derived columns."""
+    return _trip_key(trip) == _trip_key(other)
+
+
+def rebase_trip(base, mine, theirs):
+    """Lays the fields this session changed (`mine` vs `base`) over `theirs`, field by field.
+
+    Returns the merged trip, or None if both sides changed a field to different values.
+    """
+    merged = dict(mine)
+    for col in COMPARED_TRIP_COLUMNS:
+        base_value, mine_value, theirs_value = (
+            "" if trip.get(col) is None else str(trip.get(col)) for trip in (base, mine, theirs))
+        if theirs_value == base_value:
+            continue
+        if mine_value not in (base_value, theirs_value):
+            return None
+        merged[col] = theirs.get(col)
+    return merged
+
+
+def merge_remote_changes(trips, local_upserts, local_deletes, remote_changes):
+    """Folds other sessions' changes into this session's trips.
+
+    Remote changes to trips this session did not touch are applied as-is. A trip both sides
+    changed differently is a true conflict: the remote version is kept (so this write cannot
+    clobber it) and the local version is returned for the user to decide on.
+
+    Returns (merged trips, conflicts, vehicles whose Accumulated KM must be recomputed).
+    """
+    local_changed = set(local_upserts) | set(local_deletes)
+    conflicts = []
+    touched_vehicles = set()
+    merged = {trip.get("id"): trip for trip in trips}
+    order = [trip.get("id") for trip in trips]
+
+    for trip_id, remote in remote_changes.items():
+        local = local_upserts.get(trip_id)
+        if trip_id in local_changed:
+            same = (remote is None and trip_id in local_deletes) or \
+                   (remote is not None and local is not None and _trip_key(remote) == _trip_key(local))
+            if same:
+                continue
+            conflicts.append({"id": trip_id, "mine": local, "theirs": remote})
+
+        previous = merged.get(trip_id)
+        if previous is not None:
+            touched_vehicles.add(previous.get("Vehicle"))
+        if remote is None:
+            merged.pop(trip_id, None)
+        else:
+            if trip_id not in merged:
+                order.append(trip_id)
+            merged[trip_id] = dict(remote)
+            touched_vehicles.add(remote.get("Vehicle"))
+
+    merged_trips = [merged[trip_id] for trip_id in order if trip_id in merged]
+    touched_vehicles.discard(None)
+    return merged_trips, conflicts, touched_vehicles
@@ -0,0 +1,208 @@
+# trip_validation.py
+
+import uuid
+import pandas as pd
+
+from config import GSHEETS_TRIPS_COLUMNS, FLEET_CHANGE_ROUTE
+
+# Columns a bulk file must provide; everything else in GSHEETS_TRIPS_COLUMNS is optional
+REQUIRED_IMPORT_COLUMNS = ["Date", "Vehicle", "Start KM", "End KM", "Driver", "Route"]
+
+ISSUE_COLUMNS = ["Row", "Severity", "Message"]
+
+
+def _issues(frame, mask, severity, message_series):
+    """Builds issue records for the rows selected by a boolean mask."""
+    if not mask.any():
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    return pd.DataFrame({
+        "Row": frame.loc[mask, "_row"].values,
+        "Severity": severity,
+        "Message": message_series[mask].values,
+    })
+
+
+def basic_trip_errors(vehicle, driver, start_km, end_km, route_list):
+    """Required-field and KM order checks for one new trip (Add Trip tab, driver mode, ingestion API)."""
+    error_messages = []
+    if not vehicle or vehicle == "":
+        error_messages.append("Vehicle is required.")
+    if start_km < 0:
+        error_messages.append("Start KM cannot be negative.")
+    if end_km < start_km:
+        error_messages.append("End KM cannot be less than Start KM.")
+    if not driver or driver == "":
+        error_messages.append("Driver Name is required.")
+    if not route_list:
+        error_messages.append(
+            "Please select at least one Store for the Route.")
+    return error_messages
+
+
+def split_route_column(routes):
+    """Splits a Series of comma-separated route strings into one row per store (index preserved)."""
+    stores = routes.fillna("").astype(str).str.split(",").explode().str.strip()
+    return stores[stores != ""]
+
+
+def trips_to_frame(trips):
+    """Returns the continuity-relevant columns of a trip list as a typed DataFrame."""
+    frame = pd.DataFrame(list(trips), columns=["id", "Date", "Vehicle", "Start KM", "End KM", "Route"])
+    frame["_date"] = pd.to_datetime(frame["Date"], format='%Y-%m-%d', errors='coerce')
+    frame["Start KM"] = pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame["End KM"] = pd.to_numeric(frame["End KM"], errors='coerce')
+    return frame
+
+
+def normalize_trip_frame(raw):
+    """Parses an uploaded trips table: typed dates and KM values, plus its file row number in `_row`."""
+    frame = raw.copy()
+    frame.columns = [str(col).strip() for col in frame.columns]
+    for col in GSHEETS_TRIPS_COLUMNS:
+        if col not in frame.columns:
+            frame[col] = None
+    frame = frame.reset_index(drop=True)
+    frame["_row"] = frame.index + 2  # +1 for the header line, +1 for 1-based numbering
+    for col in ["Vehicle", "Driver", "Route", "Remarks", "Edited By", "Fleet Change",
+                "License Plate at Trip Time", "id"]:
+        frame[col] = frame[col].where(frame[col].notna(), "").astype(str).str.strip()
+    frame["_date"] = pd.to_datetime(
+        frame["Date"].astype(str).str.strip(), format='%Y-%m-%d', errors='coerce')
+    frame["_start_km"] = pd.to_numeric(frame["Start KM"], errors='coerce')
+    frame["_end_km"] = pd.to_numeric(frame["End KM"], errors='coerce')
+    return frame
+
+
+def validate_trip_frame(frame, existing_trips, vehicles, drivers, stores):
+    """Validates every row of a normalized trips table in one vectorized pass.
+
+    Returns a DataFrame of issues with columns Row, Severity ("error" or "warning") and Message.
+    Errors block an import; warnings (odometer continuity) can be overridden by an admin.
+    """
+    issue_frames = []
+
+    missing_columns = [col for col in REQUIRED_IMPORT_COLUMNS if col not in frame.columns]
+    if missing_columns:
+        return pd.DataFrame([{"Row": 1, "Severity": "error",
+                              "Message": f"Missing column(s): {', '.join(missing_columns)}"}],
+                            columns=ISSUE_COLUMNS)
+
+    def add(mask, severity, message):
+        if not isinstance(message, pd.Series):
+            message = pd.Series(message, index=frame.index)
+        issue_frames.append(_issues(frame, mask, severity, message))
+
+    # Field-level checks
+    add(frame["_date"].isna(), "error",
+        "Date '" + frame["Date"].astype(str) + "' is not in YYYY-MM-DD format.")
+    add(frame["_start_km"].isna(), "error", "Start KM is missing or not a number.")
+    add(frame["_end_km"].isna(), "error", "End KM is missing or not a number.")
+    add(frame["_start_km"] < 0, "error", "Start KM cannot be negative.")
+    add(frame["_end_km"] < frame["_start_km"], "error", "End KM cannot be less than Start KM.")
+
+    known_vehicles = [v for v in vehicles if v]
+    add(~frame["Vehicle"].isin(known_vehicles), "error",
+        "Unknown vehicle '" + frame["Vehicle"] + "'.")
+    known_drivers = [d for d in drivers if d]
+    add(~frame["Driver"].isin(known_drivers), "error",
+        "Unknown driver '" + frame["Driver"] + "'.")
+
+    route_stores = split_route_column(frame["Route"])
+    add(~frame.index.isin(route_stores.index), "error",
+        "Route must contain at least one store.")
+    unknown_stores = route_stores[~route_stores.isin(set(stores))]
+    if not unknown_stores.empty:
+        unknown_by_row = unknown_stores.groupby(level=0).agg(", ".join)
+        add(frame.index.isin(unknown_by_row.index), "error",
+            ("Unknown store(s): " + unknown_by_row).reindex(frame.index))
+
+    duplicate_ids = (frame["id"] != "") & frame["id"].duplicated(keep=False)
+    existing_ids = {trip.get("id") for trip in existing_trips}
+    add(duplicate_ids, "error", "Duplicate id within the file.")
+    add((frame["id"] != "") & frame["id"].isin(existing_ids), "error",
+        "A trip with this id already exists.")
+
+    issue_frames.append(continuity_issues(frame, existing_trips))
+
+    issues = pd.concat([f for f in issue_frames if not f.empty] or
+                       [pd.DataFrame(columns=ISSUE_COLUMNS)], ignore_index=True)
+    return issues.sort_values(["Row", "Severity"], kind="stable").reset_index(drop=True)
+
+
+def continuity_issues(frame, existing_trips):
+    """Checks odometer continuity of imported rows against each other and the existing history.
+
+    Imported and existing trips are merged per vehicle and ordered by date; each trip's Start KM is
+    compared with the previous trip's End KM using a shifted column, so the whole check is one pass.
+    """
+    valid = frame["_date"].notna() & frame["_start_km"].notna() & frame["_end_km"].notna()
+    imported = pd.DataFrame({
+        "Vehicle": frame.loc[valid, "Vehicle"],
+        "_date": frame.loc[valid, "_date"],
+        "Start KM": frame.loc[valid, "_start_km"],
+        "End KM": frame.loc[valid, "_end_km"],
+        "_row": frame.loc[valid, "_row"],
+    })
+    if imported.empty:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+
+    existing = trips_to_frame(existing_trips)
+    existing = existing[(existing["Route"] != FLEET_CHANGE_ROUTE) &
+                        existing["Vehicle"].isin(imported["Vehicle"].unique()) &
+                        existing["_date"].notna()]
+    existing = pd.DataFrame({
+        "Vehicle": existing["Vehicle"], "_date": existing["_date"],
+        "Start KM": existing["Start KM"], "End KM": existing["End KM"], "_row": pd.NA,
+    })
+
+    combined = pd.concat([existing, imported], ignore_index=True)
+    combined = combined.sort_values(["Vehicle", "_date", "Start KM"], kind="stable")
+    grouped = combined.groupby("Vehicle", sort=False)
+    combined["_prev_end"] = grouped["End KM"].shift()
+    combined["_prev_row"] = grouped["_row"].shift()
+    combined["_prev_date"] = grouped["_date"].shift()
+
+    broken = combined["_prev_end"].notna() & (combined["Start KM"] != combined["_prev_end"])
+    touches_import = combined["_row"].notna() | combined["_prev_row"].notna()
+    broken &= touches_import
+    if not broken.any():
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+
+    breaks = combined[broken]
+    # Report on the imported side of each break
+    rows = breaks["_row"].where(breaks["_row"].notna(), breaks["_prev_row"])
+    messages = (
+        "Odometer gap for vehicle " + breaks["Vehicle"] + ": trip on "
+        + breaks["_date"].dt.strftime('%Y-%m-%d') + " starts at "
+        + breaks["Start KM"].astype("int64").astype(str) + " but the previous trip ("
+        + breaks["_prev_date"].dt.strftime('%Y-%m-%d') + ") ended at "
+        + breaks["_prev_end"].astype("int64").astype(str) + "."
+    )
+    return pd.DataFrame({"Row": rows.astype("int64").values,
+                         "Severity": "warning", "Message": messages.values})
+
+
+def frame_to_trips(frame):
+    """Converts a validated, normalized trips table into trip dicts ready for the trips list."""
+    ids = frame["id"].where(frame["id"] != "", pd.Series(
+        [str(uuid.uuid4()) for _ in range(len(frame))], index=frame.index))
+    trips = pd.DataFrame({
+        "id": ids,
+        "Date": frame["_date"].dt.strftime('%Y-%m-%d'),
+        "Vehicle": frame["Vehicle"],
+        "Start KM": frame["_start_km"].astype("int64"),
+        "End KM": frame["_end_km"].astype("int64"),
+        "Accumulated KM": 0,  # Set by the per-vehicle recalculation
+        "Driver": frame["Driver"],
+        "Route": split_route_column(frame["Route"]).groupby(level=0).agg(", ".join)
+                 .reindex(frame.index, fill_value=""),
+        "Remarks": frame["Remarks"],
+        "Edited By": frame["Edited By"],
+        "Fleet Change": frame["Fleet Change"],
+        "License Plate at Trip Time": frame["License Plate at Trip Time"],
+    }, columns=GSHEETS_TRIPS_COLUMNS)
+    records = trips.to_dict('records')
+    for record in records:  # Plain ints for gspread / JSON
+        record["Start KM"] = int(record["Start KM"])
+        record["End KM"] = int(record["End KM"])
+    return records
@@ -1,19 +1,309 @@
 # utils.py
 
+import os
+import sqlite3
+from contextlib import contextmanager
 import streamlit as st
 import pandas as pd
 import uuid
 from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
-import json  # To parse the credentials string
 
 from config import (
-    STORE_REGION_MAPPING, DRIVER_OPTIONS,
-    GSHEETS_SPREADSHEET_NAME, GSHEETS_TRIPS_WORKSHEET_NAME,
+    GSHEETS_TRIPS_WORKSHEET_NAME,
     GSHEETS_VEHICLES_WORKSHEET_NAME, GSHEETS_CREDENTIALS,
-    GSHEETS_TRIPS_COLUMNS, GSHEETS_VEHICLES_COLUMNS, INITIAL_STATE
+    GSHEETS_TRIPS_COLUMNS, GSHEETS_VEHICLES_COLUMNS, INITIAL_STATE,
+    GSHEETS_PLATE_HISTORY_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_COLUMNS,
+    GSHEETS_META_WORKSHEET_NAME, GSHEETS_JOURNAL_WORKSHEET_NAME,
+    GSHEETS_ODOMETER_WORKSHEET_NAME, GSHEETS_CATALOG_WORKSHEET_NAME, GSHEETS_CATALOG_COLUMNS
 )
+from plate_history import (
+    EARLIEST_PLATE_DATE, build_plate_timeline, is_fleet_change_trip,
+    fleet_change_trips_to_history
+)
+from odometer_index import (
+    ODOMETER_INDEX_COLUMNS, compute_odometer_summary
+)
+from trip_sync import JOURNAL_COLUMNS, parse_journal, merge_remote_changes
+from trip_snapshot import SnapshotStore, SessionTrips, editable
+from anomaly import AnomalyIndex
+from catalog import CatalogStore
+from shared_cache import SharedCache, replay
+from change_feed import ChangeFeed, CHANGE_TRIPS, CHANGE_PLATES, affects
+from submission_log import SubmissionLog
+from depots import DEPOTS, DEFAULT_DEPOT, MULTI_DEPOT, active_depot, fan_out
+from trip_query import TripQuery, run_trip_query
+from trip_core import accumulated_km, count_stores_in_route, filter_trips, trip_fingerprint  # noqa: F401 (re-exported)
+import storage
+
+# --- Depots ---
+# Each session works on one depot (see depots.py). The process-wide stores, caches and
+# worksheet handles below exist once per depot; their getters pick the current depot's.
+
+
+def current_depot():
+    """The depot this code runs for: the one set with depot_context (background threads), else the session's."""
+    depot = active_depot()
+    if depot is not None:
+        return depot
+    return DEPOTS.get(st.session_state.get('depot'), DEFAULT_DEPOT)
+
+
+def sheet_title(worksheet_name):
+    """Title of the current depot's worksheet for a [gsheets] worksheet name (for messages)."""
+    return current_depot().worksheet(worksheet_name)
+
+
+def switch_depot(depot_key):
+    """Binds the session to another depot and drops everything it had loaded for the previous one."""
+    for key, value in INITIAL_STATE.items():
+        if key not in ('current_tab', 'logged_in'):
+            st.session_state[key] = value
+    st.session_state.pop('change_feed_seq', None)
+    st.session_state.depot = depot_key
+
+
+def select_depot(show_selector=True):
+    """Picks the session's depot: ?depot=<key> in the URL, else the sidebar choice (the first depot by default)."""
+    requested = st.query_params.get("depot")
+    if requested in DEPOTS and requested != st.session_state.get('depot'):
+        switch_depot(requested)
+    elif 'depot' not in st.session_state:
+        st.session_state.depot = DEFAULT_DEPOT.key
+    if MULTI_DEPOT and show_selector:
+        keys = list(DEPOTS)
+        chosen = st.sidebar.selectbox("Depot", keys, index=keys.index(st.session_state.depot),
+                                      format_func=lambda key: DEPOTS[key].name)
+        if chosen != st.session_state.depot:
+            switch_depot(chosen)
+            st.query_params["depot"] = chosen
+            st.rerun()
+    return current_depot()
+
+# --- Shared Trip Snapshot ---
+
+
+@st.cache_resource  # One store per depot and server process, shared by all sessions
+def _depot_snapshot_store(depot_key):
+    return SnapshotStore(depot_key)
+
+
+def get_snapshot_store():
+    """Returns the current depot's process-wide SnapshotStore holding the immutable trip snapshot."""
+    return _depot_snapshot_store(current_depot().key)
+
+
+def get_data_version():
+    """Returns the token identifying the trips this session currently sees (used as a cache key)."""
+    trips = st.session_state.get('trips')
+    if isinstance(trips, SessionTrips):
+        return trips.data_version
+    return "0"
+
+# --- Shared Cache ---
+# Server processes on one machine share the trips through a local SQLite file (see
+# shared_cache.py): the first process reads the trips sheet and stores it there, the others
+# load that copy, and every write is published so the other processes apply it without
+# reading Sheets. The sheet's Meta version still decides whether the cached trips are current.
+
+
+@st.cache_resource  # One handle per depot and server process
+def _depot_shared_cache(path):
+    try:
+        return SharedCache(path)
+    except (sqlite3.Error, OSError) as e:
+        st.warning(f"Shared cache not used: {e}")
+        return None
+
+
+def get_shared_cache():
+    """Returns the current depot's SharedCache, or None when it is turned off or cannot be opened."""
+    path = current_depot().shared_cache_path
+    return _depot_shared_cache(path) if path else None
+
+
+def sync_from_shared_cache():
+    """Applies the snapshots and writes other processes published since this process last looked.
+
+    Costs one local query when nothing changed. Returns True if a new snapshot was published.
+    """
+    cache = get_shared_cache()
+    if cache is None or cache.latest_seq() <= cache.applied_seq:
+        return False
+    with cache.follow_lock:
+        store = get_snapshot_store()
+        snapshot = store.current()
+        if snapshot is None:
+            return False  # The first load checks the cache against the sheet version itself
+        result = replay(snapshot, cache.applied_seq, cache.read_since(cache.applied_seq))
+        if not (result.changes or result.reloaded):
+            cache.applied_seq = result.seq
+            return False
+        published = store.publish(result.rows, result.sheet_version, result.journal_row_count,
+                                  result.matches_sheet_order, replaces=snapshot,
+                                  changed_ids=None if result.reloaded else result.changes.keys())
+        if published is None:
+            return False  # A save in this process got in first; retried on the next rerun
+        cache.applied_seq = result.seq
+        if result.reloaded:
+            get_change_feed().publish(CHANGE_TRIPS)  # Any vehicle may have changed
+        else:
+            get_anomaly_index().apply_write(snapshot, published, result.changes, set())
+            publish_trip_change(result.changes, snapshot, published, origin=None)
+        return True
+
+
+def share_snapshot(snapshot):
+    """Stores a snapshot just read from (or fully written to) the sheet in the shared cache."""
+    cache = get_shared_cache()
+    if cache is None or snapshot is None:
+        return
+    try:
+        cache.store_snapshot(snapshot.rows, snapshot.sheet_version, snapshot.journal_row_count,
+                             snapshot.matches_sheet_order, origin=f"app:{os.getpid()}")
+    except sqlite3.Error as e:
+        st.warning(f"Could not update the shared cache: {e}")
+
+
+def share_write(before, after, upserts, deletes):
+    """Publishes a completed write so other processes can apply it instead of reloading."""
+    cache = get_shared_cache()
+    if cache is None or after is None:
+        return
+    try:
+        if before is None or not before.matches_sheet_order or cache.needs_compaction():
+            # Rows were written in an order other processes cannot reproduce (or the log is
+            # long): store the whole list once instead
+            share_snapshot(after)
+            return
+        cache.publish_write(before.sheet_version, after.sheet_version, after.journal_row_count,
+                            upserts, deletes, order_preserved=after.matches_sheet_order,
+                            origin=f"app:{os.getpid()}")
+    except sqlite3.Error as e:
+        st.warning(f"Could not update the shared cache: {e}")
+
+# --- Change Feed ---
+# Every committed trip or plate change is published once on the process's change feed (see
+# change_feed.py). Sessions apply other sessions' plate changes from it instead of re-reading
+# the plate sheets, and live fragments redraw only when a change touches what they show.
+# Plate changes are also logged in the shared cache, and each process passes the other
+# processes' ones on to its own feed (see sync_plates_from_shared_cache).
+
+
+@st.cache_resource  # One feed per depot and server process, shared by all sessions
+def _depot_change_feed(depot_key):
+    return ChangeFeed()
+
+
+def get_change_feed():
+    """Returns the current depot's process-wide ChangeFeed."""
+    return _depot_change_feed(current_depot().key)
+
+
+def session_origin():
+    """Token identifying this session's changes on the feed."""
+    if 'feed_origin' not in st.session_state:
+        st.session_state.feed_origin = uuid.uuid4().hex[:8]
+    return st.session_state.feed_origin
+
+
+def feed_seq():
+    """The newest change on the feed; take it before reading data to watch for later changes."""
+    return get_change_feed().latest_seq()
+
+
+def publish_trip_change(trip_ids, *snapshots, origin=None):
+    """Publishes a trips change, with the vehicles the trips belong to in any of `snapshots`."""
+    vehicles = set()
+    for snapshot in snapshots:
+        if snapshot is not None:
+            for trip_id in trip_ids:
+                trip = snapshot.get(trip_id)
+                if trip is not None:
+                    vehicles.add(trip.get("Vehicle"))
+    get_change_feed().publish(CHANGE_TRIPS, vehicles, trip_ids, origin)
+
+
+def publish_plate_change(vehicles=None, history_records=()):
+    """Publishes this session's plate table and any new plate history rows for the other sessions
+    of this process and, through the shared cache, of the other processes."""
+    payload = {"plates": st.session_state.df_vehicles.to_dict('records'),
+               "history": [dict(record) for record in history_records]}
+    get_change_feed().publish(CHANGE_PLATES, vehicles, origin=session_origin(), payload=payload)
+    cache = get_shared_cache()
+    if cache is not None:
+        try:
+            cache.publish_plate_change(payload["plates"], payload["history"], origin=f"app:{os.getpid()}")
+        except sqlite3.Error as e:
+            st.warning(f"Could not update the shared cache: {e}")
+
+
+def sync_plates_from_shared_cache():
+    """Passes the plate changes other processes logged in the shared cache on to this process's feed.
+
+    Costs one local query when nothing changed. Returns True if there were any.
+    """
+    cache = get_shared_cache()
+    if cache is None or cache.latest_plate_seq() <= cache.applied_plate_seq:
+        return False
+    own_origin = f"app:{os.getpid()}"
+    with cache.follow_lock:
+        changes = cache.plate_changes_since(cache.applied_plate_seq)
+        if changes is None:
+            # Too far behind for the kept changes: every session reads the plates again
+            cache.applied_plate_seq = cache.latest_plate_seq()
+            get_change_feed().publish(CHANGE_PLATES)
+            return True
+        for change in changes:
+            if change.origin != own_origin:
+                vehicles = {record.get("Vehicle") for record in change.history} or None
+                get_change_feed().publish(CHANGE_PLATES, vehicles, payload={
+                    "plates": change.plates, "history": change.history})
+            cache.applied_plate_seq = change.seq
+        return bool(changes)
+
+
+def changed_since(seq, kind, vehicles=None):
+    """True if another session published a `kind` change touching `vehicles` (None = any) after `seq`."""
+    return affects(get_change_feed().since(seq), kind, vehicles, origin=session_origin())
+
+
+def apply_feed_changes():
+    """Applies the plate changes other sessions published since this session loaded its plates.
+
+    Trips need nothing here: the session's view always reads the current shared snapshot.
+    """
+    seen = st.session_state.get('change_feed_seq')
+    if seen is None or seen >= feed_seq():
+        return
+    changes = get_change_feed().since(seen)
+    # Too far behind for the kept history, or a change published without its rows: read the plates again
+    reload = changes is None
+    for change in changes or ():
+        if change.kind != CHANGE_PLATES or change.origin == session_origin():
+            continue
+        if change.payload is None:
+            reload = True
+            continue
+        st.session_state.df_vehicles = pd.DataFrame(change.payload["plates"])
+        st.session_state.plate_history = st.session_state.plate_history + change.payload["history"]
+        st.session_state.plate_timeline = None
+    if reload:
+        st.session_state.data_loaded = False
+        load_reference_data()
+        return
+    st.session_state.change_feed_seq = changes[-1].seq if changes else seen
+
+
+def refresh_live_data():
+    """Catches up at the start of a live fragment run: writes and plate changes other server
+    processes shared, then other sessions' plate changes. All are in-memory or local checks when
+    nothing changed."""
+    try:
+        sync_from_shared_cache()
+        sync_plates_from_shared_cache()
+    except sqlite3.Error:
+        pass  # The next full rerun reports it
+    apply_feed_changes()
 
 # --- Google Sheets Integration ---
 
@@ -26,111 +316,371 @@ def get_gsheets_client():
         st.stop()  # Stop the app if credentials is missing
 
     try:
-        # Parse the JSON credentials string
-        credentials_info = json.loads(GSHEETS_CREDENTIALS)
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        credentials = Credentials.from_service_account_info(
-            credentials_info, scopes=scopes)
-        client = gspread.authorize(credentials)
-        return client
+        return storage.authorize_client(GSHEETS_CREDENTIALS)
     except Exception as e:
         st.error(f"Error authenticating with Google Sheets: {e}")
         st.stop()  # Stop the app on authentication failure
 
 
 @st.cache_resource(ttl=3600)  # Cache the spreadsheet object for an hour
-def get_spreadsheet():
-    """Returns the Google Spreadsheet object."""
+def _open_spreadsheet(spreadsheet_name):
     client = get_gsheets_client()
     try:
-        spreadsheet = client.open(GSHEETS_SPREADSHEET_NAME)
+        spreadsheet = client.open(spreadsheet_name)
         return spreadsheet
     except Exception as e:
         st.error(
-            f"Error opening Google Spreadsheet '{GSHEETS_SPREADSHEET_NAME}': {e}")
+            f"Error opening Google Spreadsheet '{spreadsheet_name}': {e}")
         st.stop()
 
 
-def get_worksheet(worksheet_name):
-    """Returns a specific worksheet object within the spreadsheet."""
-    spreadsheet = get_spreadsheet()
+def get_spreadsheet():
+    """Returns the current depot's Google Spreadsheet object."""
+    return _open_spreadsheet(current_depot().spreadsheet_name)
+
+
+# Worksheet handles are cached too, so small reads (version check, odometer summary)
+# cost one request instead of an extra spreadsheet metadata fetch each time
+@st.cache_resource(ttl=3600)
+def _open_worksheet(spreadsheet_name, title):
+    spreadsheet = _open_spreadsheet(spreadsheet_name)
     try:
-        worksheet = spreadsheet.worksheet(worksheet_name)
+        worksheet = spreadsheet.worksheet(title)
         return worksheet
     except Exception as e:
-        st.error(f"Error opening Google Worksheet '{worksheet_name}': {e}")
+        st.error(f"Error opening Google Worksheet '{title}': {e}")
         st.stop()
 
 
-def load_trips_from_gsheets():
-    """Loads trip data from the Google Sheet (Full_route) into session state."""
-    worksheet = get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+@st.cache_resource(ttl=3600)
+def _open_or_create_worksheet(spreadsheet_name, title, columns):
     try:
-        # Get all records as a list of dictionaries
-        records = worksheet.get_all_records()
-        # Convert to DataFrame for easier handling, then back to list of dicts
-        df = pd.DataFrame(records)
+        return storage.open_or_create_worksheet(_open_spreadsheet(spreadsheet_name), title, columns)
+    except Exception as e:
+        st.error(f"Error creating Google Worksheet '{title}': {e}")
+        st.stop()
 
-        # Ensure all expected columns are present, add if missing
-        for col in GSHEETS_TRIPS_COLUMNS:
-            if col not in df.columns:
-                df[col] = None  # Add missing column with None values
 
-        # Convert DataFrame back to list of dictionaries
-        # Use .where(pd.notna, None) to replace NaN with None for cleaner dicts
-        trips_list = df.where(pd.notna(df), None).to_dict('records')
+def get_worksheet(worksheet_name):
+    """Returns the current depot's worksheet for a [gsheets] worksheet name (e.g. GSHEETS_TRIPS_WORKSHEET_NAME)."""
+    depot = current_depot()
+    return _open_worksheet(depot.spreadsheet_name, depot.worksheet(worksheet_name))
+
+
+def get_or_create_worksheet(worksheet_name, columns):
+    """Like get_worksheet, creating the worksheet with a header row if it does not exist yet."""
+    depot = current_depot()
+    return _open_or_create_worksheet(depot.spreadsheet_name, depot.worksheet(worksheet_name), columns)
+
+
+def clear_sheets_handles():
+    """Forgets the cached client, spreadsheets and worksheets (e.g. after a failed warm-up cached None)."""
+    for cached in (get_gsheets_client, _open_spreadsheet, _open_worksheet, _open_or_create_worksheet):
+        cached.clear()
+
+
+# --- Optimistic Concurrency ---
+# The Meta worksheet holds the trips version (B2) and the number of rows in the
+# change journal (B3). Every write bumps the version and appends one journal row
+# per changed trip, so a session can detect other writers with a single small read
+# and fetch only the journal rows written since it last synced.
+
+
+def read_sheet_version():
+    """Returns (trips version, journal row count) from the Meta worksheet in one read."""
+    return storage.read_version(get_or_create_worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"]))
+
+
+def write_sheet_version(version, journal_row_count):
+    """Stores the trips version and journal row count in the Meta worksheet."""
+    storage.write_version(get_or_create_worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"]),
+                          version, journal_row_count)
+
+
+def report_write_conflicts(conflicts):
+    """Keeps trips changed by this session and another one at once, for the conflicts prompt."""
+    if conflicts:
+        st.session_state.write_conflicts = st.session_state.get('write_conflicts', []) + conflicts
+
+
+@contextmanager
+def trip_write():
+    """Holds this process's write lock, then the sheet's write lease, for one trips write.
+
+    The lock keeps this process's sessions apart; the lease makes writers in other processes
+    (app replicas, the ingest server, the CLI) wait until the rows, the journal entry and the
+    version bump are all written (see storage.write_lease).
+    """
+    with get_snapshot_store().write_lock:
+        with storage.write_lease(get_or_create_worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"]),
+                                 f"app:{os.getpid()}:{uuid.uuid4().hex[:8]}"):
+            yield
+
+
+def sync_before_write():
+    """Checks the sheet version before a write and merges other writers' changes if it moved.
+
+    Must be called inside trip_write(), held until record_write. The
+    session's overlay is first moved onto the current snapshot, so commits of other sessions
+    of this process since the trips were edited are kept (see SessionTrips.rebase); then, if
+    the sheet version moved, other server processes' writes are merged from the journal.
+    Returns (local upserts, local deletes, unchanged) where `unchanged` is True when row
+    positions in the sheet still match the session's rows.
+    """
+    trips = st.session_state.trips
+    in_place = trips.is_current()
+    if not in_place:
+        conflicts = trips.rebase()
+        report_write_conflicts(conflicts)
+        upserts, _ = trips.changes()
+        for vehicle in {trip.get("Vehicle") for trip in list(upserts.values()) + [
+                conflict["theirs"] for conflict in conflicts if conflict["theirs"] is not None]}:
+            apply_accumulated_km(trips, vehicle)
+    snapshot = trips.snapshot()
+    version, journal_row_count = read_sheet_version()
+    if snapshot is not None and version == snapshot.sheet_version:
+        upserts, deletes = trips.changes()
+        # Row numbers computed on an older snapshot may have moved: write the rows in full
+        return upserts, deletes, snapshot.matches_sheet_order and in_place
+
+    remote_changes = {}
+    first_row = (snapshot.journal_row_count if snapshot is not None else 1) + 1
+    if journal_row_count >= first_row:
+        journal = get_or_create_worksheet(GSHEETS_JOURNAL_WORKSHEET_NAME, JOURNAL_COLUMNS)
+        remote_changes = parse_journal(storage.read_journal(journal, first_row, journal_row_count))
+
+    # Fold the remote changes into the shared snapshot; our overlay stays on top of it
+    upserts, deletes = trips.changes()
+    base_rows = snapshot.rows if snapshot is not None else ()
+    merged, conflicts, touched_vehicles = merge_remote_changes(
+        base_rows, upserts, deletes, remote_changes)
+    merged_snapshot = get_snapshot_store().publish(merged, version, journal_row_count, matches_sheet_order=False,
+                                                   changed_ids=remote_changes.keys())
+    publish_trip_change(remote_changes.keys(), snapshot, merged_snapshot)
+    for conflict in conflicts:
+        trips.discard_change(conflict["id"])
+    report_write_conflicts(conflicts)
+
+    for vehicle in touched_vehicles | {trip.get("Vehicle") for trip in upserts.values()}:
+        apply_accumulated_km(trips, vehicle)
+    upserts, deletes = trips.changes()
+    return upserts, deletes, False
+
+
+def record_write(upserts, deletes, matches_sheet_order=True):
+    """Appends the journal rows for a completed write, bumps the sheet version and publishes the new snapshot."""
+    trips = st.session_state.trips
+    snapshot = trips.snapshot()
+    version = snapshot.sheet_version if snapshot is not None else 0
+    journal_row_count = snapshot.journal_row_count if snapshot is not None else 1
+    version, journal_row_count = storage.record_trip_write(
+        get_or_create_worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"]),
+        get_or_create_worksheet(GSHEETS_JOURNAL_WORKSHEET_NAME, JOURNAL_COLUMNS),
+        version, journal_row_count, upserts, deletes,
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    trips.commit(version, journal_row_count, matches_sheet_order)
+    get_anomaly_index().apply_write(snapshot, trips.snapshot(), upserts, deletes)
+    share_write(snapshot, trips.snapshot(), upserts, deletes)
+    publish_trip_change(set(upserts) | set(deletes), snapshot, trips.snapshot(), origin=session_origin())
+    write_odometer_summary()
+
+
+# --- KM Anomaly Detection ---
+# Rolling daily KM statistics per vehicle and driver, kept in step with the shared snapshot
+# by replaying each write, so checking a trip on submit never rescans the history.
+
+
+@st.cache_resource  # One index per depot and server process, shared by all sessions
+def _depot_anomaly_index(depot_key):
+    return AnomalyIndex()
+
+
+def get_anomaly_index():
+    """Returns the current depot's process-wide AnomalyIndex."""
+    return _depot_anomaly_index(current_depot().key)
+
+
+def check_km_anomaly(date, vehicle, driver, start_km, end_km, trip_id=None):
+    """Warnings for a trip whose day KM is an outlier for its vehicle or driver (trip_id when editing)."""
+    snapshot = get_snapshot_store().current()
+    if snapshot is None:
+        return []
+    trip = {"Date": date.strftime('%Y-%m-%d'), "Vehicle": vehicle, "Driver": driver,
+            "Start KM": start_km, "End KM": end_km}
+    replaces = snapshot.get(trip_id) if trip_id is not None else None
+    return get_anomaly_index().score_trip(snapshot, trip, replaces)
+
+
+# --- Latest Odometer Summary ---
+# One row per vehicle with its latest End KM and date, rewritten on every trip write,
+# so the Add Trip submit path can validate Start KM against the sheet with one small read.
+
+
+def odometer_vehicles():
+    """Vehicles tracked in the odometer summary, in the row order of a full rewrite."""
+    return list(get_catalog().vehicles)
+
+
+def write_odometer_summary():
+    """Rewrites the per-vehicle latest odometer summary from the session's trips in one request."""
+    vehicles = odometer_vehicles()
+    storage.write_odometer_rows(
+        get_or_create_worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS),
+        compute_odometer_summary(st.session_state.trips, vehicles), vehicles,
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def read_odometer_summary():
+    """Reads {vehicle: (latest End KM, latest date)} from the odometer summary in one request."""
+    worksheet = get_or_create_worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS)
+    return storage.read_odometer_rows(worksheet)
+
+
+def read_odometer_details():
+    """Reads {vehicle: (latest End KM, latest date, trip id, Accumulated KM)} in one request."""
+    worksheet = get_or_create_worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS)
+    return storage.read_odometer_details(worksheet)
+
+
+def get_authoritative_latest_end_km(vehicle, fallback):
+    """Latest End KM for a vehicle as recorded in the sheet, or `fallback` if the summary is unavailable."""
+    try:
+        end_km, _ = read_odometer_summary().get(vehicle, (None, None))
+    except Exception:
+        return fallback
+    return end_km if end_km is not None else fallback
+
+
+def ensure_odometer_summary():
+    """Builds the odometer summary from the loaded trips if it is missing any vehicle."""
+    try:
+        summary = read_odometer_details()
+        # Rewritten if a vehicle is missing, or it predates the Accumulated KM column
+        if any(vehicle not in summary or (summary[vehicle][0] is not None and summary[vehicle][3] is None)
+               for vehicle in odometer_vehicles()):
+            write_odometer_summary()
+    except Exception as e:
+        st.warning(f"Could not check the odometer summary sheet: {e}")
+
 
-        # Ensure each trip has a unique ID if loading older data without IDs
-        for trip in trips_list:
-            if trip.get('id') is None or trip.get('id') == '':
-                # Generate a unique ID if missing
-                trip['id'] = str(uuid.uuid4())
+def load_trips_from_gsheets():
+    """Loads trip data into the shared trip snapshot, from the shared cache if it matches the
+    sheet version and from the Google Sheet (Full_route) otherwise."""
+    try:
+        if load_trips_from_shared_cache():
+            st.success("Trip data loaded from the shared cache.")
+            return
+    except sqlite3.Error as e:
+        st.warning(f"Shared cache not used: {e}")
 
-        st.session_state.trips = trips_list
+    worksheet = get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+    try:
+        # Versioned before the read: a write in between is merged in again later, never lost
+        version, journal_row_count = read_sheet_version()
+        trips_list = storage.read_trips(worksheet)
+        share_snapshot(get_snapshot_store().publish(trips_list, version, journal_row_count))
+        ensure_odometer_summary()
         st.success(
-            f"Trip data loaded from '{GSHEETS_TRIPS_WORKSHEET_NAME}' sheet.")
+            f"Trip data loaded from '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet.")
     except Exception as e:
+        # Nothing is published, so the next session retries the load
         st.error(
-            f"Error loading data from '{GSHEETS_TRIPS_WORKSHEET_NAME}' sheet: {e}")
-        st.session_state.trips = []  # Initialize as empty list on error
+            f"Error loading data from '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet: {e}")
+
+
+def load_trips_from_shared_cache():
+    """Publishes the shared cache's trips if they are at the sheet's current version; True if so."""
+    cache = get_shared_cache()
+    if cache is None:
+        return False
+    with cache.follow_lock:
+        result = replay(None, 0, cache.read_since(0))
+        if result.rows is None or result.sheet_version != read_sheet_version()[0]:
+            return False
+        get_snapshot_store().publish(result.rows, result.sheet_version, result.journal_row_count,
+                                     result.matches_sheet_order)
+        cache.applied_seq = result.seq
+        return True
+
+
+def ensure_trip_snapshot():
+    """Returns the current depot's trip snapshot, loading it first if the process has none.
+
+    For code running off the page (warm-up, cross-depot reports): nothing is shown, and a
+    failed load raises instead of stopping the page.
+    """
+    store = get_snapshot_store()
+    with store.load_lock:
+        if store.current() is None:
+            try:
+                loaded = load_trips_from_shared_cache()
+            except sqlite3.Error:
+                loaded = False  # Read from the sheet instead
+            if not loaded:
+                worksheet = get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+                if worksheet is None:  # Outside a page run, st.stop() returns
+                    raise RuntimeError(f"Could not open the '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet.")
+                version, journal_row_count = read_sheet_version()
+                share_snapshot(store.publish(storage.read_trips(worksheet), version, journal_row_count))
+    return store.current()
+
+
+def write_all_trips_to_gsheets(worksheet):
+    """Rewrites the whole trips worksheet from the session's trip list."""
+    storage.write_trips(worksheet, list(st.session_state.trips))
 
 
 def save_trips_to_gsheets():
-    """Saves the current trip data from session state back to the Google Sheet (Full_route)."""
+    """Saves the current trip data from session state back to the Google Sheet (Full_route).
+
+    Other sessions' writes since this session loaded are merged in first (see sync_before_write).
+    """
     worksheet = get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
     try:
-        if not st.session_state.trips:
-            # Clear the sheet if there are no trips
-            worksheet.clear()
-            # Write headers back
-            worksheet.append_row(GSHEETS_TRIPS_COLUMNS)
-        else:
-            # Create a DataFrame from the current trips list
-            df = pd.DataFrame(st.session_state.trips)
+        with trip_write():
+            upserts, deletes, _ = sync_before_write()
+            write_all_trips_to_gsheets(worksheet)
+            record_write(upserts, deletes)
 
-            # Ensure columns are in the correct order and all expected columns are present
-            for col in GSHEETS_TRIPS_COLUMNS:
-                if col not in df.columns:
-                    df[col] = None  # Add missing column with None
+        st.success(
+            f"Trip data saved to '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet.")
+    except Exception as e:
+        st.error(
+            f"Error saving data to '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet: {e}")
 
-            # Reorder columns
-            df = df[GSHEETS_TRIPS_COLUMNS]
 
-            # Convert DataFrame to a list of lists (including header) for gspread
-            data_to_save = [df.columns.tolist()] + df.values.tolist()
+def update_trip_cells_in_gsheets(cell_updates):
+    """Writes individual trip cells to the Google Sheet (Full_route) in one batch request.
 
-            # Clear existing data and write the new data
-            worksheet.clear()
-            worksheet.append_rows(data_to_save)
+    `cell_updates` is a list of (sheet_row, sheet_col, value) tuples, both 1-based.
+    Row numbers follow the order of st.session_state.trips, which mirrors the sheet
+    (header on row 1) because every full save writes the list in order. If another
+    server process wrote in the meantime, row positions may have moved, so the merged
+    list is saved in full instead.
+    """
+    if not cell_updates:
+        if st.session_state.trips.has_changes():
+            save_trips_to_gsheets()
+        return
+    from gspread.utils import rowcol_to_a1  # gspread is imported on first use (see storage.py)
 
+    worksheet = get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME)
+    try:
+        with trip_write():
+            upserts, deletes, unchanged = sync_before_write()
+            if unchanged:
+                worksheet.batch_update([
+                    {'range': rowcol_to_a1(row, col), 'values': [[value]]}
+                    for row, col, value in cell_updates
+                ])
+            else:
+                write_all_trips_to_gsheets(worksheet)
+            record_write(upserts, deletes)
         st.success(
-            f"Trip data saved to '{GSHEETS_TRIPS_WORKSHEET_NAME}' sheet.")
+            f"Updated {len(cell_updates)} cell(s) in '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet.")
     except Exception as e:
         st.error(
-            f"Error saving data to '{GSHEETS_TRIPS_WORKSHEET_NAME}' sheet: {e}")
+            f"Error saving data to '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet: {e}")
 
 
 def load_vehicle_plates_from_gsheets():
@@ -153,12 +703,13 @@ def load_vehicle_plates_from_gsheets():
 
         # Store as DataFrame in session state for easier lookup in admin section
         st.session_state.df_vehicles = pd.DataFrame(vehicle_plates_list)
+        st.session_state.plate_timeline = None  # Current plates seed the timeline
         st.success(
-            f"Vehicle plate data loaded from '{GSHEETS_VEHICLES_WORKSHEET_NAME}' sheet.")
+            f"Vehicle plate data loaded from '{sheet_title(GSHEETS_VEHICLES_WORKSHEET_NAME)}' sheet.")
         return vehicle_plates_list
     except Exception as e:
         st.error(
-            f"Error loading data from '{GSHEETS_VEHICLES_WORKSHEET_NAME}' sheet: {e}")
+            f"Error loading data from '{sheet_title(GSHEETS_VEHICLES_WORKSHEET_NAME)}' sheet: {e}")
         st.session_state.df_vehicles = pd.DataFrame(
             columns=GSHEETS_VEHICLES_COLUMNS)  # Initialize empty DataFrame on error
 
@@ -183,98 +734,343 @@ def save_vehicle_plates_to_gsheets():
         # Clear existing data and write the new data
         worksheet.clear()
         worksheet.append_rows(data_to_save)
+        st.session_state.plate_timeline = None  # Current plates seed the timeline
+        publish_plate_change()
 
         st.success(
-            f"Vehicle plate data saved to '{GSHEETS_VEHICLES_WORKSHEET_NAME}' sheet.")
+            f"Vehicle plate data saved to '{sheet_title(GSHEETS_VEHICLES_WORKSHEET_NAME)}' sheet.")
+    except Exception as e:
+        st.error(
+            f"Error saving data to '{sheet_title(GSHEETS_VEHICLES_WORKSHEET_NAME)}' sheet: {e}")
+
+
+def load_plate_history_from_gsheets():
+    """Loads the plate history (one row per plate change) into session state."""
+    worksheet = get_or_create_worksheet(
+        GSHEETS_PLATE_HISTORY_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_COLUMNS)
+    try:
+        records = worksheet.get_all_records()
+        st.session_state.plate_history = [
+            {col: str(record.get(col, "") or "") for col in GSHEETS_PLATE_HISTORY_COLUMNS}
+            for record in records
+        ]
+    except Exception as e:
+        st.error(
+            f"Error loading data from '{sheet_title(GSHEETS_PLATE_HISTORY_WORKSHEET_NAME)}' sheet: {e}")
+        st.session_state.plate_history = []
+    st.session_state.plate_timeline = None  # Rebuilt on next lookup
+
+
+def append_plate_history_to_gsheets(records):
+    """Appends plate history rows to the Google Sheet (Plate history) in one request."""
+    worksheet = get_or_create_worksheet(
+        GSHEETS_PLATE_HISTORY_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_COLUMNS)
+    try:
+        worksheet.append_rows([[record.get(col, "") for col in GSHEETS_PLATE_HISTORY_COLUMNS]
+                               for record in records])
+        return True
     except Exception as e:
         st.error(
-            f"Error saving data to '{GSHEETS_VEHICLES_WORKSHEET_NAME}' sheet: {e}")
+            f"Error saving data to '{sheet_title(GSHEETS_PLATE_HISTORY_WORKSHEET_NAME)}' sheet: {e}")
+        return False
 
 
 # --- Helper Functions (Modified to call save_trips_to_gsheets) ---
 
-# Function to initialize session state and load data
-def initialize_state():
-    """Initializes session state variables and loads data from Google Sheets."""
-    # Initialize basic state variables first
+def initialize_session_defaults():
+    """Sets the INITIAL_STATE session keys that are not set yet (no data is loaded)."""
     for key, value in INITIAL_STATE.items():
         if key not in st.session_state:
             st.session_state[key] = value
 
-    # Load data from Google Sheets when the app initializes for the first time in a session
+
+def load_reference_data():
+    """Loads the vehicle plates and plate history the first time in a session."""
     if not st.session_state.get('data_loaded', False):
-        load_trips_from_gsheets()
+        # Plate changes published from here on are applied by apply_feed_changes
+        st.session_state.change_feed_seq = feed_seq()
         load_vehicle_plates_from_gsheets()
+        load_plate_history_from_gsheets()
         st.session_state.data_loaded = True  # Set flag
 
 
-# Function to get store region mapping
-def get_store_region_mapping():
-    """Returns the dictionary mapping regions to stores. Used for reference."""
-    return STORE_REGION_MAPPING
+# Function to initialize session state and load data
+def initialize_state():
+    """Initializes session state variables and loads data from Google Sheets."""
+    # Initialize basic state variables first
+    initialize_session_defaults()
+
+    # Trips are loaded once per server process and shared by every session as a read-only snapshot
+    store = get_snapshot_store()
+    if store.current() is None:
+        with store.load_lock:
+            if store.current() is None:
+                load_trips_from_gsheets()
+    else:
+        # Pick up writes other server processes published (one local query if there are none)
+        try:
+            sync_from_shared_cache()
+        except sqlite3.Error as e:
+            st.warning(f"Shared cache not used: {e}")
+    try:
+        sync_plates_from_shared_cache()  # Same for plate changes made in other processes
+    except sqlite3.Error as e:
+        st.warning(f"Shared cache not used: {e}")
+    if not isinstance(st.session_state.trips, SessionTrips):
+        st.session_state.trips = SessionTrips(store)
 
-# List of drivers
+    # Load the remaining data from Google Sheets the first time in a session
+    load_reference_data()
+    apply_feed_changes()  # Plate changes other sessions made since
 
 
-def get_drivers_list():
-    """Returns the list of available drivers."""
-    return DRIVER_OPTIONS
+# --- Cross-Depot Reports ---
+# A session only loads its own depot. Reports over every depot fan out one task per depot on
+# a thread pool: each loads that depot's shared snapshot (already in memory if any session or
+# the warm-up of this process loaded it) and runs the query on it.
+
+
+def depot_trips_in_range(start_date, end_date):
+    """Saved trips of every depot in a date range, in date order: {depot key: [trips]}."""
+    query = TripQuery(start_date=start_date, end_date=end_date, sort=(("Date", False),))
+
+    def depot_trips(depot):
+        snapshot = ensure_trip_snapshot()
+        return run_trip_query(get_snapshot_store().version_key(snapshot), snapshot.rows, query)
+    return fan_out(depot_trips, DEPOTS.values())
+
 
-# Function to get all stores
+# --- Catalog ---
+# Vehicles, drivers and stores come from the Catalog worksheet (config.py lists as fallback).
+# The parsed Catalog is shared by every session of the process and re-read by a background
+# job, so new entries show up without a restart.
+
+
+@st.cache_resource  # One store per depot and server process, shared by all sessions
+def _depot_catalog_store(depot_key):
+    return CatalogStore()
+
+
+def get_catalog_store():
+    """Returns the current depot's process-wide CatalogStore."""
+    return _depot_catalog_store(current_depot().key)
+
+
+def refresh_catalog():
+    """Re-reads the Catalog worksheet; returns True if the catalog changed."""
+    worksheet = get_or_create_worksheet(GSHEETS_CATALOG_WORKSHEET_NAME, GSHEETS_CATALOG_COLUMNS)
+    return get_catalog_store().publish(storage.read_catalog(worksheet))
+
+
+def save_catalog_to_gsheets(catalog):
+    """Writes a catalog's entries to the Catalog worksheet and reloads it."""
+    try:
+        storage.write_catalog(
+            get_or_create_worksheet(GSHEETS_CATALOG_WORKSHEET_NAME, GSHEETS_CATALOG_COLUMNS), catalog)
+        refresh_catalog()
+        return True
+    except Exception as e:
+        st.error(f"Error writing the '{sheet_title(GSHEETS_CATALOG_WORKSHEET_NAME)}' sheet: {e}")
+        return False
+
+
+def get_catalog():
+    """Returns the current Catalog, reading the sheet the first time in the process."""
+    store = get_catalog_store()
+    if not store.loaded:
+        try:
+            refresh_catalog()
+        except Exception as e:
+            store.publish(store.current())  # Keep the config.py lists until the next refresh
+            st.warning(f"Could not read the '{sheet_title(GSHEETS_CATALOG_WORKSHEET_NAME)}' sheet, using the built-in lists: {e}")
+    return store.current()
+
+
+def get_store_region_mapping():
+    """Returns the mapping of regions to their (sorted) stores. Used for reference."""
+    return get_catalog().regions
+
+
+def get_drivers_list():
+    """Returns the driver options, with a leading "" placeholder."""
+    return get_catalog().driver_options
 
 
 def get_all_stores():
-    """Returns a sorted list of all stores from the mapping."""
-    all_stores = [store for region_stores in STORE_REGION_MAPPING.values()
-                  for store in region_stores]
-    all_stores.sort()
-    return all_stores
+    """Returns every store, sorted."""
+    return get_catalog().all_stores
 
 # --- Helper Function: Recalculate Accumulated KM for a Vehicle ---
 
 
+def apply_accumulated_km(trips, vehicle):
+    """Recomputes Accumulated KM in place for one vehicle's trips in chronological order (no save)."""
+    for trip, total_km in accumulated_km(trips, vehicle):
+        if trip.get("Accumulated KM") != total_km:
+            # Copy-on-write: only trips whose value changes are copied into the session overlay
+            editable(trips, trip)["Accumulated KM"] = total_km
+
+
 def recalculate_accumulated_km(vehicle):
     """Recalculates the Accumulated KM for all trips of a vehicle in chronological order."""
-    trips = [trip for trip in st.session_state.trips if trip.get(
-        "Vehicle") == vehicle]
-    if not trips:
+    if not any(trip.get("Vehicle") == vehicle for trip in st.session_state.trips):
         return
+    apply_accumulated_km(st.session_state.trips, vehicle)
+    save_trips_to_gsheets()  # Save updated trips to Google Sheets
+
+
+def get_current_plate(vehicle):
+    """Returns the license plate currently recorded for a vehicle, or "N/A"."""
+    current_plate = "N/A"
+    if not st.session_state.df_vehicles.empty:
+        vehicle_row = st.session_state.df_vehicles[st.session_state.df_vehicles['Vehicle'] == vehicle]
+        if not vehicle_row.empty:
+            plate_val = vehicle_row.get('License Plate', None)
+            current_plate = plate_val.iloc[0] if plate_val is not None and not plate_val.empty and pd.notna(
+                plate_val.iloc[0]) else "N/A"
+    return current_plate
 
-    # Sort trips by date
-    trips_sorted = sorted(
-        trips,
-        key=lambda x: datetime.strptime(x["Date"], '%Y-%m-%d')
-    )
 
-    total_km = 0
+# --- License Plate History ---
 
-    # Recalculate and update each trip's Accumulated KM
-    for trip in trips_sorted:
-        start_km = trip.get("Start KM", 0)
-        end_km = trip.get("End KM", 0)
-        delta = end_km - start_km
-        total_km += delta
-        trip["Accumulated KM"] = total_km
 
-    save_trips_to_gsheets()  # Save updated trips to Google Sheets
+def get_plate_timeline():
+    """Returns the session's PlateTimeline, building it from the plate history on first use."""
+    if st.session_state.get('plate_timeline') is None:
+        current_plates = {}
+        df_vehicles = st.session_state.get('df_vehicles')
+        if df_vehicles is not None and not df_vehicles.empty and 'License Plate' in df_vehicles.columns:
+            current_plates = {
+                row['Vehicle']: row['License Plate'] for _, row in df_vehicles.iterrows()
+                if pd.notna(row['License Plate'])
+            }
+        st.session_state.plate_timeline = build_plate_timeline(
+            st.session_state.get('plate_history', []), current_plates)
+    return st.session_state.plate_timeline
+
+
+def get_plate_for_trip(vehicle, date_str):
+    """Returns the plate a vehicle carried on a trip date, falling back to its current plate."""
+    return get_plate_timeline().plate_on(vehicle, date_str, default=get_current_plate(vehicle))
+
+
+def record_plate_change(vehicle, old_plate, new_plate, admin_name, effective_date, comments=""):
+    """Records a plate change in the plate history and restamps any trips already dated after it."""
+    effective_from = effective_date.strftime('%Y-%m-%d')
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    records = []
+    # A vehicle's first change also records the plate it carried before, as the migration does:
+    # once a vehicle has history rows its current plate no longer seeds the timeline
+    has_history = any(r.get("Vehicle") == vehicle for r in st.session_state.plate_history)
+    if not has_history and old_plate and old_plate != "N/A":
+        records.append({
+            "Vehicle": vehicle,
+            "License Plate": old_plate,
+            "Effective From": EARLIEST_PLATE_DATE,
+            "Changed By": admin_name,
+            "Comments": "Plate before first recorded change",
+            "Recorded At": timestamp,
+        })
+    records.append({
+        "Vehicle": vehicle,
+        "License Plate": new_plate,
+        "Effective From": effective_from,
+        "Changed By": admin_name,
+        "Comments": comments or f"Plate changed: {old_plate} -> {new_plate}",
+        "Recorded At": timestamp,
+    })
+    if not append_plate_history_to_gsheets(records):
+        return False
+    st.session_state.plate_history.extend(records)
+    st.session_state.plate_timeline = None
+    publish_plate_change({vehicle}, records)
+
+    # A backdated change also changes the plate of trips already recorded after its date
+    timeline = get_plate_timeline()
+    cell_updates = []
+    plate_col = GSHEETS_TRIPS_COLUMNS.index("License Plate at Trip Time") + 1
+    for index, trip in enumerate(st.session_state.trips):
+        if trip.get("Vehicle") == vehicle and str(trip.get("Date") or "") >= effective_from:
+            plate = timeline.plate_on(vehicle, trip["Date"], default=new_plate)
+            if trip.get("License Plate at Trip Time") != plate:
+                editable(st.session_state.trips, trip)["License Plate at Trip Time"] = plate
+                cell_updates.append((index + 2, plate_col, plate))
+    update_trip_cells_in_gsheets(cell_updates)  # Also marks the data as changed
+    st.info(f"Recorded plate change for {vehicle} effective {effective_from}.")
+    return True
+
+
+def migrate_fleet_change_trips():
+    """Moves legacy "Fleet Change Event" trip rows into the plate history and removes them from the trips."""
+    fleet_rows = [trip for trip in st.session_state.trips if is_fleet_change_trip(trip)]
+    if not fleet_rows:
+        return 0
+    records = fleet_change_trips_to_history(fleet_rows)
+    if records and not append_plate_history_to_gsheets(records):
+        return 0
+    st.session_state.plate_history.extend(records)
+    st.session_state.plate_timeline = None
+    publish_plate_change({record["Vehicle"] for record in records}, records)
+    for trip in fleet_rows:
+        st.session_state.trips.remove(trip["id"])
+    save_trips_to_gsheets()
+    st.success(f"Moved {len(fleet_rows)} fleet change row(s) to the plate history.")
+    return len(fleet_rows)
+
+# --- Duplicate Protection ---
+# Every trip form render carries an idempotency token, so resubmitting the same form (a double
+# click, a rerun) saves the trip once. Independently, a trip with the same vehicle, date, Start
+# KM, End KM and stores as a recorded one is rejected before anything is written, using the
+# duplicate index the trip snapshot maintains (see TripSnapshot.fingerprint_index).
+
+
+@st.cache_resource  # One log per server process, so a token is honoured by every session
+def get_submission_log():
+    """Returns the process-wide SubmissionLog of recent submission tokens."""
+    return SubmissionLog()
+
+
+def new_submission_token():
+    """A fresh idempotency token for a form render."""
+    return uuid.uuid4().hex
+
+
+def snapshot_duplicate(trip):
+    """A recorded trip identical to `trip` in this process's trip snapshot, or None if none is loaded."""
+    snapshot = get_snapshot_store().current()
+    if snapshot is None:
+        return None
+    duplicates = snapshot.with_fingerprint(trip_fingerprint(trip))
+    return snapshot.get(duplicates[0]) if duplicates else None
+
+
+def describe_trip(trip):
+    """Short description of a trip for messages."""
+    return (f"Vehicle {trip.get('Vehicle')} on {trip.get('Date')}, "
+            f"{trip.get('Start KM')}–{trip.get('End KM')} KM ({trip.get('Route')})")
+
 # --- Add New Trip Function ---
 
 
-def add_trip(date, vehicle, start_km, end_km, driver, route_list, remarks):
-    """Adds a new trip record and recalculates accumulated KM for the vehicle."""
+def add_trip(date, vehicle, start_km, end_km, driver, route_list, remarks, token=None):
+    """Adds a new trip record and recalculates accumulated KM for the vehicle.
+
+    `token` is the form's idempotency token: a repeated submission of an already saved form is
+    acknowledged without saving again. A trip identical to a recorded one is rejected.
+    """
     if end_km < start_km:
         st.error("Error: End KM must be greater than or equal to Start KM.")
         return False
 
+    submissions = get_submission_log()
+    if token is not None and not submissions.claim(token)[0]:
+        st.info("This trip was already submitted and saved.")
+        return True
+
     route_string = ", ".join(route_list)
 
-    current_plate = "N/A"
-    if not st.session_state.df_vehicles.empty:
-        vehicle_row = st.session_state.df_vehicles[st.session_state.df_vehicles['Vehicle'] == vehicle]
-        if not vehicle_row.empty:
-            plate_val = vehicle_row.get('License Plate', None)
-            current_plate = plate_val.iloc[0] if plate_val is not None and not plate_val.empty and pd.notna(
-                plate_val.iloc[0]) else "N/A"
+    # Plate the vehicle carried on the trip date (not just today's plate)
+    current_plate = get_plate_for_trip(vehicle, date.strftime('%Y-%m-%d'))
 
     new_trip = {
         "id": str(uuid.uuid4()),  # Unique ID
@@ -291,14 +1087,198 @@ def add_trip(date, vehicle, start_km, end_km, driver, route_list, remarks):
         "License Plate at Trip Time": current_plate
     }
 
-    st.session_state.trips.append(new_trip)
-    # Recalculate all trips for this vehicle
-    recalculate_accumulated_km(vehicle)
-
+    trips = st.session_state.trips
+    try:
+        duplicate = trips.find_duplicate(new_trip)
+        snapshot = trips.snapshot()
+        if duplicate is not None and snapshot is not None and duplicate.get("id") in snapshot:
+            st.error(f"This trip is already recorded: {describe_trip(duplicate)}. It was not added again.")
+            return False
+        if duplicate is not None:
+            # The same trip is still waiting from a save that failed: save that one, not a second copy
+            new_trip = duplicate
+        else:
+            trips.append(new_trip)
+        # Recalculate all trips for this vehicle
+        recalculate_accumulated_km(vehicle)
+    finally:
+        if token is not None:
+            # Decided by the snapshot, so a rerun interrupting the success message still counts
+            snapshot = trips.snapshot()
+            if snapshot is not None and new_trip["id"] in snapshot:
+                submissions.complete(token)
+            else:
+                submissions.release(token)
+
+    snapshot = trips.snapshot()
+    if snapshot is None or new_trip["id"] not in snapshot:
+        return False  # save_trips_to_gsheets has shown the error; submitting again retries the save
     st.success(
         f"Trip added successfully for Vehicle {vehicle} on {date.strftime('%Y-%m-%d')}!")
     return True
 
+# --- Driver Quick Entry ---
+# Driver mode (app.py?mode=driver) never loads the trip history: it validates against the
+# odometer summary and appends a single row, journaled like any other write.
+
+
+def append_trip_without_history(date, vehicle, start_km, end_km, driver, route_list, remarks, latest,
+                                token=None):
+    """Appends one trip that follows the vehicle's latest trip, without loading the trips sheet.
+
+    `latest` is the vehicle's odometer summary entry (see read_odometer_details), from which
+    Accumulated KM continues; `token` is the form's idempotency token. Returns True on success.
+    """
+    submissions = get_submission_log()
+    if token is not None and not submissions.claim(token)[0]:
+        st.info("This trip was already submitted and saved.")
+        return True
+
+    date_str = date.strftime('%Y-%m-%d')
+    accumulated = ((latest[3] or 0) if latest else 0) + end_km - start_km
+    new_trip = {
+        "id": str(uuid.uuid4()),
+        "Date": date_str,
+        "Vehicle": vehicle,
+        "Start KM": start_km,
+        "End KM": end_km,
+        "Accumulated KM": accumulated,
+        "Driver": driver,
+        "Route": ", ".join(route_list),
+        "Remarks": remarks,
+        "Edited By": "",
+        "Fleet Change": "",
+        "License Plate at Trip Time": get_plate_for_trip(vehicle, date_str)
+    }
+    recorded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    store = get_snapshot_store()
+    saved = False
+    # Held until the snapshot has the row, so no other session of this process writes in between
+    with store.write_lock:
+        try:
+            duplicate = snapshot_duplicate(new_trip)
+            if duplicate is not None:
+                st.error(f"This trip is already recorded: {describe_trip(duplicate)}. It was not added again.")
+                return False
+            with trip_write():
+                version, journal_row_count = read_sheet_version()
+                storage.append_trips(get_worksheet(GSHEETS_TRIPS_WORKSHEET_NAME), [new_trip])
+                new_version, new_journal_row_count = storage.record_trip_write(
+                    get_or_create_worksheet(GSHEETS_META_WORKSHEET_NAME, ["Key", "Value"]),
+                    get_or_create_worksheet(GSHEETS_JOURNAL_WORKSHEET_NAME, JOURNAL_COLUMNS),
+                    version, journal_row_count, {new_trip["id"]: new_trip}, set(), recorded_at)
+                storage.write_odometer_row(
+                    get_or_create_worksheet(GSHEETS_ODOMETER_WORKSHEET_NAME, ODOMETER_INDEX_COLUMNS),
+                    vehicle, (end_km, date_str, new_trip["id"], accumulated), recorded_at)
+            saved = True
+        except Exception as e:
+            st.error(f"Error saving data to '{sheet_title(GSHEETS_TRIPS_WORKSHEET_NAME)}' sheet: {e}")
+            return False
+        finally:
+            if token is not None:
+                if saved:
+                    submissions.complete(token)
+                else:
+                    submissions.release(token)
+
+        # If this process has the trips loaded and up to date, add the row to its snapshot too
+        snapshot = store.current()
+        if snapshot is not None and snapshot.sheet_version == version:
+            published = store.publish(snapshot.rows + (new_trip,), new_version, new_journal_row_count,
+                                      snapshot.matches_sheet_order, replaces=snapshot,
+                                      changed_ids={new_trip["id"]})
+            if published is not None:
+                get_anomaly_index().apply_write(snapshot, published, {new_trip["id"]: new_trip}, set())
+    get_change_feed().publish(CHANGE_TRIPS, {vehicle}, {new_trip["id"]}, session_origin())
+    cache = get_shared_cache()
+    if cache is not None:
+        try:
+            cache.publish_write(version, new_version, new_journal_row_count, {new_trip["id"]: new_trip},
+                                set(), order_preserved=True, origin=f"app:{os.getpid()}")
+        except sqlite3.Error as e:
+            st.warning(f"Could not update the shared cache: {e}")
+
+    st.success(f"Trip added successfully for Vehicle {vehicle} on {date_str}!")
+    return True
+
+# --- Bulk Import Function ---
+
+
+def add_trips_bulk(new_trips):
+    """Adds many validated trips at once: one Accumulated KM pass per affected vehicle, then a single save.
+
+    Trips already recorded, or repeated within `new_trips`, are skipped and counted.
+    """
+    trips = st.session_state.trips
+    unique, seen = [], set()
+    for trip in new_trips:
+        fingerprint = trip_fingerprint(trip)
+        if fingerprint not in seen and trips.find_duplicate(trip) is None:
+            unique.append(trip)
+        seen.add(fingerprint)
+    if len(unique) < len(new_trips):
+        st.warning(f"Skipped {len(new_trips) - len(unique)} trip(s) that are already recorded "
+                   "or repeated in the file.")
+    new_trips = unique
+    if not new_trips:
+        return 0
+
+    for trip in new_trips:
+        if not trip.get("License Plate at Trip Time"):
+            trip["License Plate at Trip Time"] = get_plate_for_trip(
+                trip["Vehicle"], trip["Date"])
+
+    st.session_state.trips.extend(new_trips)
+    for vehicle in sorted({trip["Vehicle"] for trip in new_trips}):
+        apply_accumulated_km(st.session_state.trips, vehicle)
+
+    save_trips_to_gsheets()  # One write for the whole batch
+    st.success(f"Imported {len(new_trips)} trip(s).")
+    return len(new_trips)
+
+# --- Bulk Edit Function ---
+
+# Trip fields that can be changed from the bulk edit grid
+BULK_EDITABLE_FIELDS = ["Date", "Vehicle", "Start KM", "End KM",
+                        "Driver", "Route", "Remarks", "Edited By"]
+
+
+def apply_trip_edits(edited_trips):
+    """Applies validated edits to many trips and pushes only the cells that changed in one batch update."""
+    edits_by_id = {trip["id"]: trip for trip in edited_trips}
+    trips = st.session_state.trips
+
+    affected_vehicles = set()
+    for trip in trips:
+        if trip["id"] in edits_by_id:
+            affected_vehicles.add(trip.get("Vehicle"))
+            affected_vehicles.add(edits_by_id[trip["id"]]["Vehicle"])
+
+    # Snapshot every row whose Accumulated KM may move, so the diff covers those too
+    before = {
+        index: [trip.get(col) for col in GSHEETS_TRIPS_COLUMNS]
+        for index, trip in enumerate(trips) if trip.get("Vehicle") in affected_vehicles
+    }
+
+    for trip_id, edit in edits_by_id.items():
+        trip = trips.edit(trip_id)
+        trip.update({field: edit[field] for field in BULK_EDITABLE_FIELDS})
+        trip["License Plate at Trip Time"] = get_plate_for_trip(
+            trip["Vehicle"], trip["Date"])
+
+    for vehicle in sorted(v for v in affected_vehicles if v):
+        apply_accumulated_km(trips, vehicle)
+
+    cell_updates = []
+    for index, old_values in before.items():
+        for col_index, col in enumerate(GSHEETS_TRIPS_COLUMNS):
+            new_value = trips[index].get(col)
+            if new_value != old_values[col_index]:
+                cell_updates.append((index + 2, col_index + 1, new_value))
+
+    update_trip_cells_in_gsheets(cell_updates)
+    return len(edits_by_id)
+
 # --- Update Existing Trip Function ---
 
 
@@ -310,21 +1290,28 @@ def update_trip(trip_id, date, vehicle, start_km, end_km, driver, route_list, re
 
     route_string = ", ".join(route_list)
 
-    for trip in st.session_state.trips:
-        if trip["id"] == trip_id:
-            trip.update({
-                "Date": date.strftime('%Y-%m-%d'),
-                "Vehicle": vehicle,
-                "Start KM": start_km,
-                "End KM": end_km,
-                "Accumulated KM": 0,
-                "Driver": driver,
-                "Route": route_string,
-                "Remarks": remarks,
-                "Edited By": edited_by,
-                "Fleet Change": fleet_change
-            })
-            break
+    duplicate = st.session_state.trips.find_duplicate({
+        "id": trip_id, "Vehicle": vehicle, "Date": date.strftime('%Y-%m-%d'),
+        "Start KM": start_km, "End KM": end_km, "Route": route_string})
+    if duplicate is not None:
+        st.error(f"Another trip is already recorded with these details: {describe_trip(duplicate)}.")
+        return False
+
+    if st.session_state.trips.get(trip_id) is not None:
+        # Copy-on-write: the edit lives in the session overlay until it is saved
+        st.session_state.trips.edit(trip_id).update({
+            "Date": date.strftime('%Y-%m-%d'),
+            "Vehicle": vehicle,
+            "Start KM": start_km,
+            "End KM": end_km,
+            "Accumulated KM": 0,
+            "Driver": driver,
+            "Route": route_string,
+            "Remarks": remarks,
+            "Edited By": edited_by,
+            "Fleet Change": fleet_change,
+            "License Plate at Trip Time": get_plate_for_trip(vehicle, date.strftime('%Y-%m-%d'))
+        })
 
     # Recalculate all trips for this vehicle
     recalculate_accumulated_km(vehicle)
@@ -336,59 +1323,14 @@ def update_trip(trip_id, date, vehicle, start_km, end_km, driver, route_list, re
 
 def delete_trip(trip_id):
     """Deletes a trip and recalculates accumulated KM for the associated vehicle."""
-    trip_to_delete = next(
-        (trip for trip in st.session_state.trips if trip["id"] == trip_id), None)
+    trip_to_delete = st.session_state.trips.get(trip_id)
 
     if trip_to_delete:
         vehicle = trip_to_delete["Vehicle"]
-        st.session_state.trips = [
-            t for t in st.session_state.trips if t["id"] != trip_id]
-        recalculate_accumulated_km(vehicle)  # Recalculate after deletion
+        st.session_state.trips.remove(trip_id)
+        # Recalculate after deletion; save even if it was the vehicle's last trip
+        apply_accumulated_km(st.session_state.trips, vehicle)
+        save_trips_to_gsheets()
         st.success("Trip deleted successfully!")
     else:
         st.error("Error: Could not find trip to delete.")
-
-# Function to record a fleet change event as a trip
-def record_fleet_change_trip(vehicle, old_plate, new_plate, admin_name):
-    """Records a fleet change event as a special trip entry."""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    fleet_change_note = f"[{timestamp}] Plate changed for {vehicle}: {old_plate} -> {new_plate}"
-
-    new_fleet_change_trip = {
-        "id": str(uuid.uuid4()),  # Unique ID for this entry
-        "Date": datetime.now().strftime('%Y-%m-%d'),  # Date of the change
-        "Vehicle": vehicle,
-        "Start KM": 0,  # N/A for this type of entry
-        "End KM": 0,   # N/A
-        "Accumulated KM": 0,  # N/A
-        "Driver": "N/A",  # Or could be the admin's name if desired
-        "Route": "Fleet Change Event",  # Indicate this is a fleet change event
-        # Put the note in remarks or fleet change
-        "Remarks": f"Admin Note: {fleet_change_note}",
-        "Edited By": admin_name,  # The admin who made the change
-        "Fleet Change": fleet_change_note,  # Put the specific change note here
-        "License Plate at Trip Time": new_plate  # Record the new plate
-    }
-    st.session_state.trips.append(new_fleet_change_trip)
-    save_trips_to_gsheets()  # Save the new entry to Google Sheets
-    st.info(f"Recorded fleet change event for {vehicle}.")
-
-# Function to count stores from route string
-def count_stores_in_route(route_string):
-    """Counts the number of stores in a comma-separated route string."""
-    if not route_string:
-        return 0
-    # Simple approach: split by comma and count non-empty parts
-    return len([store.strip() for store in route_string.split(',') if store.strip()])
-
-# Function to filter trips by date range and vehicle
-def filter_trips(trips, start_date, end_date, vehicle):
-    """Filters a list of trips by date range and vehicle."""
-    filtered = [
-        trip for trip in trips
-        if datetime.strptime(trip["Date"], '%Y-%m-%d').date() >= start_date and
-        datetime.strptime(trip["Date"], '%Y-%m-%d').date() <= end_date
-    ]
-    if vehicle != "All":
-        filtered = [trip for trip in filtered if trip["Vehicle"] == vehicle]
-    return filtered
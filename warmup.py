@@ -0,0 +1,183 @@
+# warmup.py
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import streamlit as st
+
+from config import (
+    GSHEETS_VEHICLES_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_WORKSHEET_NAME,
+    GSHEETS_PLATE_HISTORY_COLUMNS, STARTUP_FIRST_PAINT_HISTORY
+)
+from background_jobs import get_scheduler
+from depots import DEPOTS, MULTI_DEPOT, fan_out
+from trip_query import get_trip_table
+from utils import (
+    get_gsheets_client, get_spreadsheet, get_worksheet, get_or_create_worksheet, get_snapshot_store,
+    get_anomaly_index, ensure_trip_snapshot, ensure_odometer_summary, refresh_catalog, clear_sheets_handles
+)
+
+# Server warm-up: everything the first page run of a fresh process would otherwise wait for
+# (authentication, opening the spreadsheet, the full trip load, the catalog, the indexes built
+# over the snapshot) runs once per server process on a background thread. serve.py starts it
+# before the server accepts connections; app.py starts it too, for servers launched with
+# `streamlit run`. Sessions arriving mid-way wait only for the step they need (the trip load
+# holds the snapshot store's load lock) and find the rest ready. With several depots, each
+# depot's steps run on their own thread, so adding a depot does not delay the others.
+
+
+class StartupTimings:
+    """Import time, warm-up step timings and recent first page renders of the server process."""
+
+    def __init__(self):
+        self.import_seconds = None
+        self.steps = []  # (step, seconds, error message or "")
+        self.warm_up_started = None
+        self.warm_up_finished = None
+        self.first_paints = deque(maxlen=STARTUP_FIRST_PAINT_HISTORY)  # (finished at, seconds, mode)
+        self._lock = threading.Lock()
+
+    def record_import(self, seconds):
+        """Keeps the first measurement: later page runs find the modules already imported."""
+        with self._lock:
+            if self.import_seconds is None:
+                self.import_seconds = seconds
+
+    def record_step(self, step, seconds, error=""):
+        with self._lock:
+            self.steps.append((step, seconds, error))
+
+    def record_first_paint(self, seconds, mode):
+        with self._lock:
+            self.first_paints.append((datetime.now(), seconds, mode))
+
+    def summary(self):
+        """Rows for the admin timings table."""
+        with self._lock:
+            rows = [{"Stage": "Import app modules", "Seconds": self.import_seconds, "Note": ""}]
+            rows += [{"Stage": f"Warm-up: {step}", "Seconds": seconds, "Note": error}
+                     for step, seconds, error in self.steps]
+            if self.warm_up_started is not None and self.warm_up_finished is not None:
+                rows.append({"Stage": "Warm-up total",
+                             "Seconds": (self.warm_up_finished - self.warm_up_started).total_seconds(),
+                             "Note": f"finished {self.warm_up_finished.strftime('%Y-%m-%d %H:%M:%S')}"})
+            elif self.warm_up_started is not None:
+                rows.append({"Stage": "Warm-up total", "Seconds": None, "Note": "running"})
+            paints = sorted(seconds for _, seconds, _ in self.first_paints)
+            if paints:
+                rows.append({"Stage": "First paint (median)", "Seconds": paints[len(paints) // 2],
+                             "Note": f"over the last {len(paints)} session(s)"})
+                rows.append({"Stage": "First paint (slowest)", "Seconds": paints[-1], "Note": ""})
+            return rows
+
+
+@st.cache_resource  # One record per server process
+def get_startup_timings():
+    """Returns the process-wide StartupTimings."""
+    return StartupTimings()
+
+
+def mark_first_paint(run_started, mode="app"):
+    """Records how long this session's first page run took (`run_started` is a perf_counter value)."""
+    if not st.session_state.get('first_paint_recorded'):
+        st.session_state.first_paint_recorded = True
+        get_startup_timings().record_first_paint(time.perf_counter() - run_started, mode)
+
+
+def _sheets_handle(function, *args):
+    """Calls a cached Sheets helper of utils.py and checks it returned a handle.
+
+    Outside a page run their st.stop() on failure returns instead of stopping, leaving None.
+    """
+    handle = function(*args)
+    if handle is None:
+        raise RuntimeError(f"{function.__name__}{args or ''} failed; see the server log.")
+    return handle
+
+
+def _authenticate():
+    _sheets_handle(get_gsheets_client)
+
+
+def _open_spreadsheet():
+    _sheets_handle(get_spreadsheet)
+
+
+def _load_trip_snapshot():
+    """Loads the trip snapshot like the first session would, holding the store's load lock."""
+    ensure_trip_snapshot()
+    ensure_odometer_summary()
+
+
+def _open_reference_sheets():
+    """Caches the worksheet handles every session reads its plates from."""
+    _sheets_handle(get_worksheet, GSHEETS_VEHICLES_WORKSHEET_NAME)
+    _sheets_handle(get_or_create_worksheet, GSHEETS_PLATE_HISTORY_WORKSHEET_NAME, GSHEETS_PLATE_HISTORY_COLUMNS)
+
+
+def _build_indexes():
+    """Builds the duplicate index, the query table and the anomaly model over the loaded snapshot."""
+    store = get_snapshot_store()
+    snapshot = store.current()
+    if snapshot is None:
+        raise RuntimeError("No trips loaded.")
+    snapshot.fingerprint_index()
+    get_trip_table(store.version_key(snapshot), snapshot.rows)  # Keyed like get_data_version without edits
+    get_anomaly_index().rescore(snapshot)
+
+
+# Run once per depot, each depot on its own thread; without the depot's spreadsheet the
+# depot's other steps would only fail, so they are skipped
+DEPOT_WARM_UP_STEPS = [
+    ("Open spreadsheet", _open_spreadsheet),
+    ("Load trips", _load_trip_snapshot),
+    ("Open plate sheets", _open_reference_sheets),
+    ("Load catalog", refresh_catalog),
+    ("Build indexes", _build_indexes),
+    ("Start background jobs", get_scheduler),
+]
+
+
+def _timed_step(timings, step, function):
+    """Runs one warm-up step and records its time; returns its error message, "" if it worked."""
+    started = time.perf_counter()
+    try:
+        function()
+        error = ""
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    timings.record_step(step, time.perf_counter() - started, error)
+    return error
+
+
+def _warm_up_depot(timings, depot):
+    """Runs the depot steps in order (inside the depot's context); True if every step worked."""
+    ok = True
+    for position, (step, function) in enumerate(DEPOT_WARM_UP_STEPS):
+        if _timed_step(timings, f"{step} ({depot.name})" if MULTI_DEPOT else step, function):
+            ok = False
+            if position == 0:
+                break
+    return ok
+
+
+def warm_up(timings):
+    """Authenticates, then warms every depot up in parallel; a failed step is recorded and the rest still run."""
+    timings.warm_up_started = datetime.now()
+    ok = not _timed_step(timings, "Authenticate", _authenticate)
+    if ok:
+        ok = all(fan_out(lambda depot: _warm_up_depot(timings, depot), DEPOTS.values()).values())
+    if not ok:
+        # A failed helper may have cached None; let the first page run retry and show the error
+        clear_sheets_handles()
+    timings.warm_up_finished = datetime.now()
+
+
+@st.cache_resource(show_spinner=False)  # Once per server process
+def start_warm_up():
+    """Starts the warm-up thread of this server process (later calls return the same thread)."""
+    thread = threading.Thread(target=warm_up, args=(get_startup_timings(),), name="warm-up", daemon=True)
+    thread.start()
+    return thread